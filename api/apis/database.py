@@ -1,14 +1,37 @@
+from apis import settings
+from apis.pool import AsyncInstrumentedQueuePool, InstrumentedQueuePool, register_pool_metrics
 from database.utils import get_db_config
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 STOCK_MARKET_DATA = 'stock_market_data'
 
 SQLALCHEMY_DATABASE_URL = get_db_config(db_name=STOCK_MARKET_DATA).uri
+ASYNC_SQLALCHEMY_DATABASE_URL = get_db_config(db_name=STOCK_MARKET_DATA).async_uri
 
-db_engine = create_engine(SQLALCHEMY_DATABASE_URL)
+POOL_KWARGS = dict(
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_POOL_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+)
+
+db_engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedQueuePool, **POOL_KWARGS)
+register_pool_metrics(db_engine, max_overflow=settings.DB_POOL_MAX_OVERFLOW)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
 
+# Used by the async routes, waiting for Postgres doesn't hold a threadpool worker
+async_db_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=AsyncInstrumentedQueuePool, **POOL_KWARGS
+)
+register_pool_metrics(async_db_engine.sync_engine, max_overflow=settings.DB_POOL_MAX_OVERFLOW)
+
+AsyncSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=async_db_engine, class_=AsyncSession
+)
+
 Base = declarative_base()
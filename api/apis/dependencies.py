@@ -1,4 +1,4 @@
-from apis.database import SessionLocal
+from apis.database import AsyncSessionLocal, SessionLocal
 
 
 def get_db_session():
@@ -7,3 +7,15 @@ def get_db_session():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db_session():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def get_async_session_factory():
+    """
+    Factory of the async sessions opened by the computations outliving the request, eg: shared by single flight
+    """
+    return AsyncSessionLocal
@@ -0,0 +1,96 @@
+import hashlib
+import threading
+import time
+from typing import Dict, Optional
+
+from apis import settings
+from apis.price_cache import get_stock_dataset_version
+from fastapi import Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+
+class DatasetVersionCache:
+    """
+    Version of the stock table recorded by the pipeline, read from the DB at most every version_check_seconds
+    """
+
+    def __init__(self, version_check_seconds: float) -> None:
+        self.version_check_seconds = version_check_seconds
+        self.version: Optional[int] = None
+        self.version_checked_at: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def is_stale(self) -> bool:
+        return (
+            self.version_checked_at is None or time.monotonic() - self.version_checked_at >= self.version_check_seconds
+        )
+
+    def set(self, version: Optional[int]):
+        with self.lock:
+            self.version = version
+            self.version_checked_at = time.monotonic()
+
+    def get(self, db_session: Session) -> Optional[int]:
+        if self.is_stale():
+            self.set(get_stock_dataset_version(db_session))
+        return self.version
+
+    async def get_async(self, db_session: AsyncSession) -> Optional[int]:
+        if self.is_stale():
+            self.set(await db_session.run_sync(get_stock_dataset_version))
+        return self.version
+
+
+dataset_version_cache = DatasetVersionCache(version_check_seconds=settings.PRICE_CACHE_VERSION_CHECK_SECONDS)
+
+
+def get_etag(dataset_version: int, request: Request) -> str:
+    """
+    Strong ETag of the response to request for the dataset_version: the response only depends on the data, the
+    path and query string of the request and the settings changing the computed values
+    """
+    key = '|'.join(
+        [
+            request.url.path,
+            str(request.query_params),
+            settings.METRICS_ENGINE,
+            settings.STOCK_SCHEMA,
+            str(settings.PRICE_DECIMALS),
+        ]
+    )
+    return f'"{dataset_version}-{hashlib.blake2b(key.encode(), digest_size=12).hexdigest()}"'
+
+
+def get_cache_headers(dataset_version: Optional[int], request: Request) -> Dict[str, str]:
+    """
+    Returns the ETag and Cache-Control headers of the response to request, no headers when the dataset version
+    isn't recorded (the response can't be validated) or when HTTP_CACHE_MAX_AGE is negative
+    """
+    if dataset_version is None or settings.HTTP_CACHE_MAX_AGE < 0:
+        return {}
+    return {
+        'ETag': get_etag(dataset_version, request),
+        'Cache-Control': f'public, max-age={settings.HTTP_CACHE_MAX_AGE}',
+    }
+
+
+def matches_if_none_match(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Weak comparison of the If-None-Match header values with etag (https://www.rfc-editor.org/rfc/rfc7232#section-3.2)
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(value.strip().removeprefix('W/') == etag for value in if_none_match.split(','))
+
+
+def get_not_modified_response(request: Request, cache_headers: Dict[str, str]) -> Optional[Response]:
+    """
+    Returns a 304 response when the client already holds the current representation, None otherwise
+    """
+    etag = cache_headers.get('ETag')
+    if etag is None or not matches_if_none_match(request.headers.get('if-none-match'), etag):
+        return None
+    return Response(status_code=304, headers=cache_headers)
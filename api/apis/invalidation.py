@@ -0,0 +1,72 @@
+import json
+import logging
+import select
+import threading
+from typing import Callable, Dict, List, Optional
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+logger = logging.getLogger(__name__)
+
+
+# Channel the pipeline notifies with {"table": table name, "version": new version} after each load
+DATASET_VERSION_CHANNEL = 'dataset_version'
+
+
+class DatasetVersionListener:
+    """
+    Background thread LISTENing to the dataset version notifications of the pipeline with a dedicated connection,
+    the callbacks of the loaded table are called as soon as a load is committed. The connection is reopened after
+    reconnect_seconds when it is lost.
+    """
+
+    def __init__(
+        self,
+        connection_kwargs: Dict[str, str],
+        callbacks: Dict[str, List[Callable[[int], None]]],
+        reconnect_seconds: float = 5,
+    ) -> None:
+        self.connection_kwargs = connection_kwargs
+        self.callbacks = callbacks
+        self.reconnect_seconds = reconnect_seconds
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='dataset-version-listener', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def notify(self, payload: str):
+        notification = json.loads(payload)
+        logger.info(f'{notification["table"]} dataset version changed to {notification["version"]}')
+        for callback in self.callbacks.get(notification['table'], []):
+            callback(notification['version'])
+
+    def listen(self):
+        conn = psycopg2.connect(**self.connection_kwargs)
+        try:
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            conn.cursor().execute(f'LISTEN {DATASET_VERSION_CHANNEL}')
+            while not self.stopped.is_set():
+                # Wakes up every second to check if the listener is stopped
+                if select.select([conn], [], [], 1) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self.notify(conn.notifies.pop(0).payload)
+        finally:
+            conn.close()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.listen()
+            except Exception as error:
+                logger.error(f'Dataset version listener failed: {error!r}, reconnecting')
+                self.stopped.wait(self.reconnect_seconds)
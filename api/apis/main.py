@@ -1,26 +1,300 @@
-from apis.dependencies import get_db_session
+from typing import Callable, List, Optional, Tuple
+
+from apis import settings
+from apis.database import STOCK_MARKET_DATA, async_db_engine, db_engine
+from apis.dependencies import get_async_db_session, get_async_session_factory, get_db_session
+from apis.http_cache import dataset_version_cache, get_cache_headers, get_not_modified_response
+from apis.invalidation import DatasetVersionListener
+from apis.pool import warm_up_async_pool, warm_up_pool
+from apis.price_cache import price_cache
+from apis.result_cache import result_cache
 from apis.schemas import StockMetric
-from apis.stock_functions import get_stock_metric
-from fastapi import Depends, FastAPI, Query
-from pydantic import Required
+from apis.similarity import MAX_TOP_K, get_most_similar_stocks, shutdown_similarity_workers
+from apis.single_flight import async_stock_metrics_flight, stock_metrics_flight
+from apis.stock_functions import (
+    Metric,
+    get_stock_metric,
+    get_stock_metric_async,
+    get_stock_metric_dataset_version,
+    get_stock_metrics_batch,
+    parse_metrics,
+)
+from apis.timing import finish_request_timing, request_timing, timed_phase
+from database.utils import get_db_config
+from fastapi import Depends, FastAPI, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from pydantic import Required, constr
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 app = FastAPI(title='API for stock metrics', version='1-0-0')
 
+JSON_MEDIA_TYPE = 'application/json'
+
+
+def on_stock_loaded(version: int):
+    dataset_version_cache.set(version)
+    price_cache.invalidate()
+    result_cache.invalidate()
+
+
+def get_flight_key(
+    dataset_version: Optional[int],
+    ticker: str,
+    price_column: str,
+    metric: str,
+    rolling_window: int,
+    start: str,
+    end: str,
+) -> Tuple:
+    """
+    Normalized parameters of a /stock_metrics/ request, the concurrent requests with the same key share their
+    computation
+    """
+    return (dataset_version, ticker, price_column, tuple(parse_metrics(metric)), rolling_window, start, end)
+
+
+def get_metric_label(metric: str) -> str:
+    """
+    Metric label of the request_phase_seconds histograms, multiple for several metrics
+    """
+    metrics = parse_metrics(metric)
+    if len(metrics) > 1:
+        return 'multiple'
+    return metrics[0] if metrics[0] in Metric.keys() else 'invalid'
+
+
+dataset_version_listener = DatasetVersionListener(
+    connection_kwargs=get_db_config(db_name=STOCK_MARKET_DATA).psycopg2_compatible_dict,
+    callbacks={'stock': [on_stock_loaded]},
+)
+
+
+@app.on_event('startup')
+async def warm_up_db_pools():
+    """
+    Opens the pools connections before serving the first requests
+    """
+    if settings.DB_POOL_WARMUP:
+        await run_in_threadpool(warm_up_pool, db_engine, settings.DB_POOL_WARMUP)
+        await warm_up_async_pool(async_db_engine, settings.DB_POOL_WARMUP)
+
+
+@app.on_event('startup')
+def start_dataset_version_listener():
+    if settings.DATASET_VERSION_LISTEN:
+        dataset_version_listener.start()
+
+
+@app.on_event('shutdown')
+def release_similarity_workers():
+    shutdown_similarity_workers()
+
+
+@app.on_event('shutdown')
+def stop_dataset_version_listener():
+    dataset_version_listener.stop()
+
 
 # TODO add response type as Pydantic class # , response_model=list[StockMetric]
-@app.get('/stock_metrics/')
+# The records are already JSON serializable, ORJSONResponse encodes them without jsonable_encoder
+@app.get('/stock_metrics/', response_class=ORJSONResponse)
 def read_stock_metric(
+    request: Request,
+    price_column: str,
+    metric: str,
+    rolling_window: int,
+    ticker: str = Query(default=Required, min_length=1, max_length=5),
+    start: str = Query(default=Required, regex=r'^(\d{4})-(\d{2})-(\d{2}?)', format='date'),
+    end: str = Query(default=Required, regex=r'^(\d{4})-(\d{2})-(\d{2}?)', format='date'),
+    db_session: Session = Depends(get_db_session),
+):
+    """
+    The durations of the phases of the request are sent in the Server-Timing header and recorded in the
+    request_phase_seconds histograms of /metrics
+    """
+    with request_timing() as timing:
+        response = get_stock_metric_response(
+            request, price_column, metric, rolling_window, ticker, start, end, db_session
+        )
+        return finish_request_timing(timing, response, get_metric_label(metric), rolling_window)
+
+
+def get_stock_metric_response(
+    request: Request,
+    price_column: str,
+    metric: str,
+    rolling_window: int,
+    ticker: str,
+    start: str,
+    end: str,
+    db_session: Session,
+) -> Response:
+    with timed_phase('dataset_version'):
+        # Version of the data read by the engine, which keys the responses and the results
+        db_dataset_version = dataset_version_cache.get(db_session)
+        dataset_version = get_stock_metric_dataset_version(db_session, metric, db_dataset_version)
+    cache_headers = get_cache_headers(dataset_version, request)
+    not_modified_response = get_not_modified_response(request, cache_headers)
+    if not_modified_response is not None:
+        return not_modified_response
+
+    result_key = result_cache.get_key(dataset_version, ticker, price_column, metric, rolling_window, start, end)
+    with timed_phase('result_cache'):
+        cached_result = result_cache.get(result_key)
+    if cached_result is not None:
+        return Response(cached_result, media_type=JSON_MEDIA_TYPE, headers=cache_headers)
+
+    def compute_stock_metrics() -> bytes:
+        stock_metrics = get_stock_metric(
+            db_session,
+            ticker=ticker,
+            start=start,
+            end=end,
+            price_column=price_column,
+            metric=metric,
+            rolling_window=rolling_window,
+        )
+        with timed_phase('encode'):
+            body = ORJSONResponse(stock_metrics).body
+        with timed_phase('result_cache'):
+            result_cache.set(result_key, body)
+        return body
+
+    flight_key = get_flight_key(dataset_version, ticker, price_column, metric, rolling_window, start, end)
+    # Time waited for the response of an identical request, or overhead of the request computing it
+    with timed_phase('single_flight'):
+        body = stock_metrics_flight.do(flight_key, compute_stock_metrics)
+    return Response(body, media_type=JSON_MEDIA_TYPE, headers=cache_headers)
+
+
+@app.get('/async/stock_metrics/', response_class=ORJSONResponse)
+async def read_stock_metric_async(
+    request: Request,
+    price_column: str,
+    metric: str,
+    rolling_window: int,
+    ticker: str = Query(default=Required, min_length=1, max_length=5),
+    start: str = Query(default=Required, regex=r'^(\d{4})-(\d{2})-(\d{2}?)', format='date'),
+    end: str = Query(default=Required, regex=r'^(\d{4})-(\d{2})-(\d{2}?)', format='date'),
+    db_session: AsyncSession = Depends(get_async_db_session),
+    session_factory: Callable[[], AsyncSession] = Depends(get_async_session_factory),
+):
+    with request_timing() as timing:
+        response = await get_stock_metric_response_async(
+            request, price_column, metric, rolling_window, ticker, start, end, db_session, session_factory
+        )
+        return finish_request_timing(timing, response, get_metric_label(metric), rolling_window)
+
+
+async def get_stock_metric_response_async(
+    request: Request,
+    price_column: str,
+    metric: str,
+    rolling_window: int,
+    ticker: str,
+    start: str,
+    end: str,
+    db_session: AsyncSession,
+    session_factory: Callable[[], AsyncSession],
+) -> Response:
+    with timed_phase('dataset_version'):
+        db_dataset_version = await dataset_version_cache.get_async(db_session)
+        dataset_version = await db_session.run_sync(get_stock_metric_dataset_version, metric, db_dataset_version)
+    cache_headers = get_cache_headers(dataset_version, request)
+    not_modified_response = get_not_modified_response(request, cache_headers)
+    if not_modified_response is not None:
+        return not_modified_response
+
+    result_key = result_cache.get_key(dataset_version, ticker, price_column, metric, rolling_window, start, end)
+    # The sqlite backend blocks, kept out of the event loop
+    with timed_phase('result_cache'):
+        cached_result = await run_in_threadpool(result_cache.get, result_key)
+    if cached_result is not None:
+        return Response(cached_result, media_type=JSON_MEDIA_TYPE, headers=cache_headers)
+
+    # The computation runs in a task shared with the identical requests, which can outlive the request leading it:
+    # it reads with its own session and the connection of the request session is released meanwhile
+    await db_session.close()
+
+    async def compute_stock_metrics() -> bytes:
+        async with session_factory() as compute_session:
+            stock_metrics = await get_stock_metric_async(
+                compute_session,
+                ticker=ticker,
+                start=start,
+                end=end,
+                price_column=price_column,
+                metric=metric,
+                rolling_window=rolling_window,
+            )
+        with timed_phase('encode'):
+            body = ORJSONResponse(stock_metrics).body
+        with timed_phase('result_cache'):
+            await run_in_threadpool(result_cache.set, result_key, body)
+        return body
+
+    flight_key = get_flight_key(dataset_version, ticker, price_column, metric, rolling_window, start, end)
+    with timed_phase('single_flight'):
+        body = await async_stock_metrics_flight.do(flight_key, compute_stock_metrics)
+    return Response(body, media_type=JSON_MEDIA_TYPE, headers=cache_headers)
+
+
+@app.get('/batch/stock_metrics/', response_class=ORJSONResponse)
+def read_stock_metrics_batch(
+    request: Request,
+    price_column: str,
+    tickers: List[constr(min_length=1, max_length=5)] = Query(default=Required),
+    metrics: List[str] = Query(default=Required),
+    rolling_windows: List[int] = Query(default=Required),
+    start: str = Query(default=Required, regex=r'^(\d{4})-(\d{2})-(\d{2}?)', format='date'),
+    end: str = Query(default=Required, regex=r'^(\d{4})-(\d{2})-(\d{2}?)', format='date'),
+    db_session: Session = Depends(get_db_session),
+):
+    """
+    Metrics of several tickers, metrics and rolling windows read with a single query,
+    keyed by ticker, metric and rolling window
+    """
+    cache_headers = get_cache_headers(dataset_version_cache.get(db_session), request)
+    not_modified_response = get_not_modified_response(request, cache_headers)
+    if not_modified_response is not None:
+        return not_modified_response
+
+    stock_metrics = get_stock_metrics_batch(
+        db_session,
+        tickers=tickers,
+        start=start,
+        end=end,
+        price_column=price_column,
+        metrics=metrics,
+        rolling_windows=rolling_windows,
+    )
+    return ORJSONResponse(stock_metrics, headers=cache_headers)
+
+
+@app.get('/most_similar_stocks/', response_class=ORJSONResponse)
+def read_most_similar_stocks(
+    request: Request,
     price_column: str,
     metric: str,
     rolling_window: int,
     ticker: str = Query(default=Required, min_length=1, max_length=5),
     start: str = Query(default=Required, regex=r'^(\d{4})-(\d{2})-(\d{2}?)', format='date'),
     end: str = Query(default=Required, regex=r'^(\d{4})-(\d{2})-(\d{2}?)', format='date'),
+    top_k: int = Query(default=10, ge=1, le=MAX_TOP_K),
     db_session: Session = Depends(get_db_session),
 ):
+    """
+    Tickers whose rolling metric is the most correlated with the one of ticker between start and end
+    """
+    cache_headers = get_cache_headers(dataset_version_cache.get(db_session), request)
+    not_modified_response = get_not_modified_response(request, cache_headers)
+    if not_modified_response is not None:
+        return not_modified_response
 
-    stock_metrics = get_stock_metric(
+    most_similar_stocks = get_most_similar_stocks(
         db_session,
         ticker=ticker,
         start=start,
@@ -28,5 +302,14 @@ def read_stock_metric(
         price_column=price_column,
         metric=metric,
         rolling_window=rolling_window,
+        top_k=top_k,
     )
-    return stock_metrics
+    return ORJSONResponse(most_similar_stocks, headers=cache_headers)
+
+
+@app.get('/metrics')
+def read_metrics():
+    """
+    Prometheus metrics of the API process
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
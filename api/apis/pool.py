@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+
+from apis.timing import record_phase
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import exc, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+
+POOL_CHECKOUT_SECONDS = Histogram(
+    'db_pool_checkout_seconds',
+    'Time waited to get a connection from the pool, including the connection opening and pre ping',
+    ['engine'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+POOL_CHECKOUT_TIMEOUTS = Counter(
+    'db_pool_checkout_timeouts_total', 'Number of checkouts that timed out waiting for a connection', ['engine']
+)
+POOL_CHECKED_OUT = Gauge('db_pool_checked_out_connections', 'Connections in use', ['engine'])
+POOL_IDLE = Gauge('db_pool_idle_connections', 'Open connections waiting in the pool', ['engine'])
+POOL_OVERFLOW = Gauge('db_pool_overflow_connections', 'Connections opened above the pool size', ['engine'])
+POOL_SATURATION = Gauge(
+    'db_pool_saturation',
+    'Connections in use divided by the maximum number of connections (size + overflow)',
+    ['engine'],
+)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool recording its checkout wait times and timeouts in the POOL_CHECKOUT_* metrics
+    """
+
+    engine_label = 'sync'
+
+    def connect(self):
+        start_time = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            POOL_CHECKOUT_TIMEOUTS.labels(self.engine_label).inc()
+            raise
+        finally:
+            checkout_seconds = time.perf_counter() - start_time
+            POOL_CHECKOUT_SECONDS.labels(self.engine_label).observe(checkout_seconds)
+            record_phase('db_checkout', checkout_seconds)
+
+
+class AsyncInstrumentedQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    engine_label = 'async'
+
+
+def register_pool_metrics(db_engine: Engine, max_overflow: int):
+    """
+    Reports the usage of the engine pool in the POOL_* gauges at each scrape, max_overflow is the one the pool
+    was created with (negative for no limit, the saturation is then relative to the pool size).
+    The pool is looked up at each scrape since it's replaced when the engine is disposed.
+    """
+    engine_label = db_engine.pool.engine_label
+
+    def get_saturation() -> float:
+        pool = db_engine.pool
+        return pool.checkedout() / (pool.size() + max(max_overflow, 0))
+
+    POOL_CHECKED_OUT.labels(engine_label).set_function(lambda: db_engine.pool.checkedout())
+    POOL_IDLE.labels(engine_label).set_function(lambda: db_engine.pool.checkedin())
+    POOL_OVERFLOW.labels(engine_label).set_function(lambda: max(db_engine.pool.overflow(), 0))
+    POOL_SATURATION.labels(engine_label).set_function(get_saturation)
+
+
+def warm_up_pool(db_engine: Engine, connections: int):
+    """
+    Opens up to the pool size connections at once and returns them to the pool, so that the first requests
+    don't pay the connection opening. A failure is only logged: the pool is then filled on demand.
+    """
+    opened = []
+    try:
+        for _ in range(min(connections, db_engine.pool.size())):
+            conn = db_engine.connect()
+            opened.append(conn)
+            conn.execute(text('SELECT 1'))
+    except Exception as e:
+        logger.warning(f'Could not warm up the {db_engine.pool.engine_label} pool: {e}')
+    finally:
+        for conn in opened:
+            conn.close()
+    logger.info(f'Warmed up {len(opened)} {db_engine.pool.engine_label} connections')
+
+
+async def warm_up_async_pool(async_db_engine: AsyncEngine, connections: int):
+    """
+    Same as warm_up_pool for an async engine, the connections are opened concurrently
+    """
+
+    async def open_connection():
+        conn = await async_db_engine.connect()
+        await conn.execute(text('SELECT 1'))
+        return conn
+
+    connections = min(connections, async_db_engine.sync_engine.pool.size())
+    results = await asyncio.gather(*[open_connection() for _ in range(connections)], return_exceptions=True)
+    opened = [result for result in results if not isinstance(result, BaseException)]
+    for conn in opened:
+        await conn.close()
+    if len(opened) < connections:
+        error = next(result for result in results if isinstance(result, BaseException))
+        logger.warning(f'Could not warm up the async pool: {error}')
+    logger.info(f'Warmed up {len(opened)} async connections')
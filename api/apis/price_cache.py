@@ -0,0 +1,195 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+from apis import settings
+from models.dataset_version import DatasetVersion
+from models.stock import STOCK_TABLE_NAME, Stock
+from prometheus_client import Counter, Gauge
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+
+PRICE_COLUMNS = ['open_price', 'close_price', 'high_price', 'low_price']
+
+PRICE_CACHE_HITS = Counter('price_cache_hits_total', 'Number of tickers served from the price cache')
+PRICE_CACHE_MISSES = Counter('price_cache_misses_total', 'Number of tickers loaded from the DB to the price cache')
+PRICE_CACHE_EVICTIONS = Counter('price_cache_evictions_total', 'Number of tickers evicted from the price cache')
+PRICE_CACHE_INVALIDATIONS = Counter(
+    'price_cache_invalidations_total', 'Number of times the price cache was cleared after a pipeline load'
+)
+PRICE_CACHE_BYTES = Gauge('price_cache_bytes', 'Size of the arrays held by the price cache')
+
+
+@dataclass
+class TickerPrices:
+    """
+    Dates and prices of a ticker sorted by date, as NumPy columns
+    """
+
+    dates: np.ndarray  # datetime64[D]
+    prices: Dict[str, np.ndarray]  # price column -> float64 prices
+
+    @property
+    def nbytes(self) -> int:
+        return self.dates.nbytes + sum(prices.nbytes for prices in self.prices.values())
+
+    def get_dates_slice(self, start: str, end: str) -> slice:
+        """
+        Returns the slice of the rows with start <= date <= end
+        """
+        return slice(
+            int(np.searchsorted(self.dates, np.datetime64(start, 'D'), side='left')),
+            int(np.searchsorted(self.dates, np.datetime64(end, 'D'), side='right')),
+        )
+
+
+def load_ticker_prices(db_session: Session, ticker: str) -> TickerPrices:
+    query = (
+        db_session.query(Stock.date, *[getattr(Stock, column) for column in PRICE_COLUMNS])
+        .filter(Stock.name == ticker)
+        .order_by(Stock.date.asc())
+    )
+    df = pd.read_sql_query(query.statement, db_session.connection())
+    return TickerPrices(
+        dates=pd.to_datetime(df['date']).to_numpy().astype('datetime64[D]'),
+        prices={column: df[column].to_numpy(dtype=np.float64) for column in PRICE_COLUMNS},
+    )
+
+
+def get_stock_dataset_version(db_session: Session) -> Optional[int]:
+    """
+    Returns the version of the stock table recorded by the pipeline, None if it isn't recorded
+    """
+    try:
+        return db_session.query(DatasetVersion.version).filter(DatasetVersion.table_name == STOCK_TABLE_NAME).scalar()
+    except ProgrammingError:
+        # The dataset_version table doesn't exist (the data was loaded before it was introduced)
+        db_session.rollback()
+        return None
+
+
+class PriceCache:
+    """
+    In-process LRU cache of the TickerPrices of the requested tickers, holding at most max_bytes of arrays.
+    The whole cache is cleared when the pipeline loads a new version of the stock table, which is checked
+    at most every version_check_seconds.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        version_check_seconds: float,
+        load_ticker_prices: Callable[[Session, str], TickerPrices] = load_ticker_prices,
+        load_dataset_version: Callable[[Session], Optional[int]] = get_stock_dataset_version,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.version_check_seconds = version_check_seconds
+        self.load_ticker_prices = load_ticker_prices
+        self.load_dataset_version = load_dataset_version
+
+        self.entries: 'OrderedDict[str, TickerPrices]' = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.dataset_version: Optional[int] = None
+        self.version_checked_at: Optional[float] = None
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+            PRICE_CACHE_BYTES.set(0)
+
+    def invalidate(self):
+        """
+        Clears the cache when the pipeline notifies a new load, the version is read again by the next request
+        """
+        if self.entries:
+            PRICE_CACHE_INVALIDATIONS.inc()
+        self.clear()
+        with self.lock:
+            self.dataset_version = None
+            self.version_checked_at = None
+
+    def get_dataset_version(self, db_session: Session) -> Optional[int]:
+        """
+        Returns the version of the stock table the cached prices were loaded from
+        """
+        self.check_dataset_version(db_session)
+        return self.dataset_version
+
+    def check_dataset_version(self, db_session: Session):
+        """
+        Clears the cache if the stock table version changed since the last check
+        """
+        now = time.monotonic()
+        if self.version_checked_at is not None and now - self.version_checked_at < self.version_check_seconds:
+            return
+        self.version_checked_at = now
+
+        dataset_version = self.load_dataset_version(db_session)
+        if dataset_version != self.dataset_version:
+            if self.entries:
+                logger.info(f'stock dataset version changed to {dataset_version}, clearing the price cache')
+                PRICE_CACHE_INVALIDATIONS.inc()
+            self.clear()
+            self.dataset_version = dataset_version
+
+    def put(self, ticker: str, ticker_prices: TickerPrices):
+        if ticker_prices.nbytes > self.max_bytes:
+            return
+
+        with self.lock:
+            previous = self.entries.pop(ticker, None)
+            if previous is not None:
+                self.nbytes -= previous.nbytes
+            self.entries[ticker] = ticker_prices
+            self.nbytes += ticker_prices.nbytes
+
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+                PRICE_CACHE_EVICTIONS.inc()
+            PRICE_CACHE_BYTES.set(self.nbytes)
+
+    def get(self, db_session: Session, ticker: str) -> TickerPrices:
+        """
+        Returns the TickerPrices of ticker, loading them from the DB if they aren't cached
+        """
+        self.check_dataset_version(db_session)
+
+        with self.lock:
+            ticker_prices = self.entries.get(ticker)
+            if ticker_prices is not None:
+                self.entries.move_to_end(ticker)
+                self.hits += 1
+                PRICE_CACHE_HITS.inc()
+                return ticker_prices
+            self.misses += 1
+            PRICE_CACHE_MISSES.inc()
+
+        # Loaded outside of the lock to not block the other tickers, concurrent misses of a ticker load it twice
+        ticker_prices = self.load_ticker_prices(db_session, ticker)
+        self.put(ticker, ticker_prices)
+        return ticker_prices
+
+
+price_cache = PriceCache(
+    max_bytes=settings.PRICE_CACHE_MAX_BYTES,
+    version_check_seconds=settings.PRICE_CACHE_VERSION_CHECK_SECONDS,
+)
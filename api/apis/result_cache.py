@@ -0,0 +1,229 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+
+from apis import settings
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+
+RESULT_CACHE_HITS = Counter('result_cache_hits_total', 'Number of responses served from the result cache')
+RESULT_CACHE_MISSES = Counter('result_cache_misses_total', 'Number of responses computed and put in the result cache')
+RESULT_CACHE_INVALIDATIONS = Counter(
+    'result_cache_invalidations_total', 'Number of times the result cache was cleared after a pipeline load'
+)
+RESULT_CACHE_BYTES = Gauge('result_cache_bytes', 'Size of the responses held by the result cache')
+RESULT_CACHE_HIT_RATIO = Gauge('result_cache_hit_ratio', 'Hits over lookups of the result cache since the start')
+
+
+class ResultCacheBackend(ABC):
+    """
+    Storage of the encoded responses by key, holding at most max_bytes of responses
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: bytes):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+    @property
+    @abstractmethod
+    def nbytes(self) -> int:
+        pass
+
+
+class MemoryResultCacheBackend(ResultCacheBackend):
+    """
+    LRU of the responses in the memory of the worker process
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        super().__init__(max_bytes)
+        self.entries: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._nbytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self._nbytes -= len(previous)
+            self.entries[key] = value
+            self._nbytes += len(value)
+            while self._nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self._nbytes -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self._nbytes = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+
+class SQLiteResultCacheBackend(ResultCacheBackend):
+    """
+    Responses stored in a SQLite file shared by the worker processes of the host, the least recently read
+    responses are deleted when the file holds more than max_bytes of responses
+    """
+
+    def __init__(self, max_bytes: int, path: str) -> None:
+        super().__init__(max_bytes)
+        self.path = path
+        self.local = threading.local()
+        with self.connection as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS result '
+                '(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, read_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_result_read_at ON result (read_at)')
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            # Readers don't block the writer of another process
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self.connection.execute('SELECT value FROM result WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self.connection.execute('UPDATE result SET read_at = ? WHERE key = ?', (time.time(), key))
+        return row[0]
+
+    def set(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        with self.connection as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO result (key, value, size, read_at) VALUES (?, ?, ?, ?)',
+                (key, value, len(value), time.time()),
+            )
+            # Deletes the least recently read responses beyond max_bytes
+            conn.execute(
+                """
+                DELETE FROM result WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, sum(size) OVER (ORDER BY read_at DESC, key) AS cumulative_size FROM result
+                    ) WHERE cumulative_size > ?
+                )
+                """,
+                (self.max_bytes,),
+            )
+
+    def clear(self):
+        self.connection.execute('DELETE FROM result')
+
+    @property
+    def nbytes(self) -> int:
+        return self.connection.execute('SELECT coalesce(sum(size), 0) FROM result').fetchone()[0]
+
+
+class ResultCache:
+    """
+    Encoded responses of the computed metrics keyed by the request parameters and the stock dataset version,
+    a disabled cache (backend None) never hits. The entries of the previous versions are dropped by invalidate
+    when the pipeline notifies a load.
+    """
+
+    def __init__(self, backend: Optional[ResultCacheBackend]) -> None:
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        RESULT_CACHE_HIT_RATIO.set_function(self.get_hit_ratio)
+        RESULT_CACHE_BYTES.set_function(lambda: self.backend.nbytes if self.enabled else 0)
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def get_hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @staticmethod
+    def get_key(
+        dataset_version: Optional[int],
+        ticker: str,
+        price_column: str,
+        metric: str,
+        rolling_window: int,
+        start: str,
+        end: str,
+    ) -> Optional[str]:
+        """
+        Returns the key of the response, None when the dataset version isn't recorded since the cached responses
+        couldn't be invalidated
+        """
+        if dataset_version is None:
+            return None
+        return f'{dataset_version}:{ticker}:{price_column}:{metric}:{rolling_window}:{start}:{end}'
+
+    def get(self, key: Optional[str]) -> Optional[bytes]:
+        if not self.enabled or key is None:
+            return None
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            RESULT_CACHE_MISSES.inc()
+        else:
+            self.hits += 1
+            RESULT_CACHE_HITS.inc()
+        return value
+
+    def set(self, key: Optional[str], value: bytes):
+        if self.enabled and key is not None:
+            self.backend.set(key, value)
+
+    def invalidate(self):
+        if self.enabled:
+            self.backend.clear()
+            RESULT_CACHE_INVALIDATIONS.inc()
+
+
+def get_result_cache_backend() -> Optional[ResultCacheBackend]:
+    if settings.RESULT_CACHE_BACKEND == 'memory':
+        return MemoryResultCacheBackend(max_bytes=settings.RESULT_CACHE_MAX_BYTES)
+    if settings.RESULT_CACHE_BACKEND == 'sqlite':
+        return SQLiteResultCacheBackend(max_bytes=settings.RESULT_CACHE_MAX_BYTES, path=settings.RESULT_CACHE_PATH)
+    if settings.RESULT_CACHE_BACKEND:
+        raise ValueError(f'Unknown RESULT_CACHE_BACKEND {settings.RESULT_CACHE_BACKEND}, expected memory or sqlite')
+    return None
+
+
+result_cache = ResultCache(get_result_cache_backend())
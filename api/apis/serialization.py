@@ -0,0 +1,40 @@
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+METRIC_DECIMALS = 2
+# Value of the metric when it can't be computed (not enough rows for a complete rolling window)
+MISSING_METRIC = ''
+
+
+def get_iso_dates(dates: pd.Series) -> np.ndarray:
+    """
+    Converts a column of dates (datetime.date objects or datetime64) to an array of ISO strings at once
+    """
+    return np.datetime_as_string(dates.to_numpy().astype('datetime64[D]'), unit='D')
+
+
+def get_rounded_metrics(metrics: pd.Series) -> np.ndarray:
+    """
+    Rounds the metrics to METRIC_DECIMALS decimals, the missing or non numeric values are replaced by MISSING_METRIC.
+    Returns an object array of floats and MISSING_METRIC.
+
+    Python's round is used rather than np.round: it rounds the exact binary value of the float, whereas np.round
+    scales it by 10 ** decimals first and rounds the values just below a half cent (729.655) up
+    """
+    numeric = pd.to_numeric(metrics, errors='coerce').to_numpy(dtype=np.float64)
+    output = np.empty(len(numeric), dtype=object)
+    output[:] = [round(metric, METRIC_DECIMALS) for metric in numeric.tolist()]
+    output[np.isnan(numeric)] = MISSING_METRIC
+    return output
+
+
+def get_stock_metric_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """
+    Returns the date and metric columns as a list of {'date': ISO date, 'metric': rounded metric} records
+    """
+    return [
+        {'date': date, 'metric': metric}
+        for date, metric in zip(get_iso_dates(df['date']).tolist(), get_rounded_metrics(df['metric']).tolist())
+    ]
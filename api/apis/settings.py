@@ -0,0 +1,73 @@
+import os
+
+# Engine computing the rolling metrics:
+# - pandas: the prices are read and the rolling metric computed with pandas
+# - moments: the mean and standard deviation are computed from the stock_moments prefix sums table built by the
+#   pipeline (STOCK_MOMENTS=true), the other metrics fall back to pandas
+# - sql: the rolling metric is computed by Postgres with window functions, only the rows between start and end
+#   are returned
+# - range_index: the min and max are computed from the stock_range_index sparse tables built by the pipeline
+#   (STOCK_RANGE_INDEX=true) for windows up to RANGE_INDEX_MAX_WINDOW rows, the other metrics fall back to pandas
+METRICS_ENGINE = os.environ.get('METRICS_ENGINE') or 'pandas'
+# Must not exceed the RANGE_INDEX_MAX_WINDOW the pipeline built the stock_range_index with
+RANGE_INDEX_MAX_WINDOW = int(os.environ.get('RANGE_INDEX_MAX_WINDOW') or 1024)
+
+# Schema of the stock table loaded by the pipeline (STOCK_SCHEMA of the pipeline): default or compact, the Stock
+# model then decodes the ticker ids, market codes and the prices stored in units of 10^-PRICE_DECIMALS
+STOCK_SCHEMA = os.environ.get('STOCK_SCHEMA') or 'default'
+PRICE_DECIMALS = int(os.environ.get('PRICE_DECIMALS') or 4)
+# Partitioning of the stock table loaded by the pipeline (PARTITION_INTERVAL of the pipeline): month, year or empty
+# when it isn't partitioned. The rolling window queries on a partitioned table first look up the date of the first
+# row of the window so that Postgres prunes the partitions before it.
+PARTITION_INTERVAL = os.environ.get('PARTITION_INTERVAL') or None
+
+# When above 0, the pandas engine reads the prices from an in-process LRU cache of the tickers holding at most
+# PRICE_CACHE_MAX_BYTES of NumPy arrays. The cache is cleared when the pipeline loads a new version of the stock
+# table, which is checked at most every PRICE_CACHE_VERSION_CHECK_SECONDS.
+PRICE_CACHE_MAX_BYTES = int(os.environ.get('PRICE_CACHE_MAX_BYTES') or 0)
+PRICE_CACHE_VERSION_CHECK_SECONDS = float(os.environ.get('PRICE_CACHE_VERSION_CHECK_SECONDS') or 10)
+
+# When set, the pandas engine reads the prices from the memory mapped snapshot of the stock table exported by the
+# pipeline to this directory (SNAPSHOT_DIR of the pipeline) instead of the DB or the price cache. The snapshot is
+# remapped when the pipeline publishes a new one, which is checked at most every SNAPSHOT_RELOAD_CHECK_SECONDS.
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR') or None
+SNAPSHOT_RELOAD_CHECK_SECONDS = float(os.environ.get('SNAPSHOT_RELOAD_CHECK_SECONDS') or 10)
+
+# The GET responses carry a strong ETag derived from the stock dataset version and the request, and a
+# `Cache-Control: public, max-age=HTTP_CACHE_MAX_AGE` header (none when negative). A request whose If-None-Match
+# holds the current ETag gets a 304 without computing the response.
+HTTP_CACHE_MAX_AGE = int(os.environ.get('HTTP_CACHE_MAX_AGE') or 60)
+
+# Result cache of the /stock_metrics/ responses keyed by the request parameters and the stock dataset version:
+# memory (per worker process LRU) or sqlite (file at RESULT_CACHE_PATH shared by the workers of the host), disabled
+# when empty. Each backend holds at most RESULT_CACHE_MAX_BYTES of responses.
+RESULT_CACHE_BACKEND = os.environ.get('RESULT_CACHE_BACKEND') or None
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES') or 256 * 1024 * 1024)
+RESULT_CACHE_PATH = os.environ.get('RESULT_CACHE_PATH') or '/tmp/stock_metrics_result_cache.sqlite3'
+# LISTEN to the dataset version notifications of the pipeline: the result cache is dropped and the new version used
+# as soon as a load is committed instead of at the next version check
+DATASET_VERSION_LISTEN = os.environ.get('DATASET_VERSION_LISTEN', 'true').lower() in ('1', 'true')
+
+# Coalesce the concurrent /stock_metrics/ requests with the same parameters: one of them computes the response and
+# the others wait for it instead of querying and computing it again
+SINGLE_FLIGHT = os.environ.get('SINGLE_FLIGHT', 'true').lower() in ('1', 'true')
+
+# Send the durations of the phases of the /stock_metrics/ requests (validation, db_checkout, query, compute,
+# serialize, encode...) in a Server-Timing header, they are recorded in the request_phase_seconds histograms anyway
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'true').lower() in ('1', 'true')
+
+# Connection pool of the sync and async engines (each worker process has its own pools): DB_POOL_SIZE connections
+# are kept open and up to DB_POOL_MAX_OVERFLOW more are opened under load, a request waits at most
+# DB_POOL_TIMEOUT seconds for a connection. The connections are reopened after DB_POOL_RECYCLE seconds (-1 never)
+# and checked before use with DB_POOL_PRE_PING. DB_POOL_WARMUP connections (default: DB_POOL_SIZE) are opened at
+# startup.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 5)
+DB_POOL_MAX_OVERFLOW = int(os.environ.get('DB_POOL_MAX_OVERFLOW') or 10)
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT') or 30)
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE') or 1800)
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true')
+DB_POOL_WARMUP = int(os.environ.get('DB_POOL_WARMUP') or DB_POOL_SIZE)
+
+# Number of worker processes computing the most similar stocks, the price matrix of all the tickers is then held in
+# shared memory and its tickers are sharded across the workers. With 0 it is computed in the API process.
+SIMILARITY_WORKERS = int(os.environ.get('SIMILARITY_WORKERS') or 0)
@@ -0,0 +1,330 @@
+import logging
+import multiprocessing
+import threading
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from apis import settings
+from apis.price_cache import get_stock_dataset_version
+from apis.stock_functions import Metric, get_agg_from_rolling_df, validate_query_parameters
+from fastapi import HTTPException
+from models.stock import Stock
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+
+# Minimum number of dates where both metric series are defined to score a ticker
+MIN_COMMON_DATES = 3
+MAX_TOP_K = 100
+
+
+@dataclass
+class PriceMatrix:
+    """
+    Prices of a price column of every ticker aligned on the dates of all the tickers: prices[i, j] is the price of
+    tickers[i] at dates[j], NaN when the ticker has no row at this date. The prices can be backed by a shared
+    memory block that the similarity workers attach to.
+    """
+
+    tickers: np.ndarray  # sorted ticker names
+    dates: np.ndarray  # sorted datetime64[D]
+    prices: np.ndarray  # (tickers, dates) float64
+    shared_memory: Optional[SharedMemory] = None
+
+    def __post_init__(self) -> None:
+        # The workers of the requests still holding the matrix attach to the block by name: it's only unlinked
+        # when the matrix is garbage collected, its memory is freed once the views on it are released
+        if self.shared_memory is not None:
+            weakref.finalize(self, self.shared_memory.unlink)
+
+    def get_dates_slice(self, start: str, end: str) -> slice:
+        """
+        Returns the slice of the dates with start <= date <= end
+        """
+        return slice(
+            int(np.searchsorted(self.dates, np.datetime64(start, 'D'), side='left')),
+            int(np.searchsorted(self.dates, np.datetime64(end, 'D'), side='right')),
+        )
+
+    def get_ticker_index(self, ticker: str) -> Optional[int]:
+        index = int(np.searchsorted(self.tickers, ticker))
+        if index < len(self.tickers) and self.tickers[index] == ticker:
+            return index
+        return None
+
+
+def load_price_matrix(db_session: Session, price_column: str, shared: bool) -> PriceMatrix:
+    """
+    Reads the price_column of every ticker in a single query and pivots it to a PriceMatrix
+    """
+    query = db_session.query(Stock.name, Stock.date, getattr(Stock, price_column).label(price_column))
+    return get_price_matrix(pd.read_sql(query.statement, db_session.connection()), price_column, shared)
+
+
+def get_price_matrix(df: pd.DataFrame, price_column: str, shared: bool) -> PriceMatrix:
+    """
+    Pivots the name, date and price_column columns of df to a PriceMatrix, the prices are copied to a shared
+    memory block if shared
+    """
+    tickers, ticker_indexes = np.unique(df['name'].to_numpy(dtype=str), return_inverse=True)
+    dates, date_indexes = np.unique(pd.to_datetime(df['date']).to_numpy().astype('datetime64[D]'), return_inverse=True)
+    shape = (len(tickers), len(dates))
+
+    shared_memory = None
+    if shared and len(df):
+        shared_memory = SharedMemory(create=True, size=int(np.prod(shape)) * np.dtype(np.float64).itemsize)
+        prices = np.ndarray(shape, dtype=np.float64, buffer=shared_memory.buf)
+        prices.fill(np.nan)
+    else:
+        prices = np.full(shape, np.nan)
+    prices[ticker_indexes, date_indexes] = df[price_column].to_numpy(dtype=np.float64)
+    logger.info(f'Loaded the {price_column} matrix of {shape[0]} tickers and {shape[1]} dates')
+
+    return PriceMatrix(tickers=tickers, dates=dates, prices=prices, shared_memory=shared_memory)
+
+
+def get_rolling_metric_matrix(prices: np.ndarray, metric: Metric, rolling_window: int) -> np.ndarray:
+    """
+    Computes the rolling metric of each row of prices over its columns at once, a window holding a missing
+    price is NaN
+    """
+    rolling_df = pd.DataFrame(prices.T).rolling(rolling_window)
+    return get_agg_from_rolling_df(rolling_df, metric).to_numpy().T
+
+
+def get_pearson_correlations(target: np.ndarray, metrics: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the Pearson correlation of the target series with each row of metrics, only over the dates where
+    both are defined. Returns the correlations and the number of common dates of each row.
+    """
+    common = ~np.isnan(metrics) & ~np.isnan(target)
+    common_dates = common.sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Centered on their means over the common dates to keep the sums accurate
+        target = np.where(common, target, 0.0)
+        metrics = np.where(common, metrics, 0.0)
+        target = np.where(common, target - (target.sum(axis=1) / common_dates)[:, None], 0.0)
+        metrics = np.where(common, metrics - (metrics.sum(axis=1) / common_dates)[:, None], 0.0)
+
+        covariance = (target * metrics).sum(axis=1)
+        correlations = covariance / np.sqrt((target**2).sum(axis=1) * (metrics**2).sum(axis=1))
+
+    correlations[(common_dates < MIN_COMMON_DATES) | ~np.isfinite(correlations)] = np.nan
+    return np.clip(correlations, -1, 1), common_dates
+
+
+def get_shard_correlations(
+    prices: np.ndarray, target: np.ndarray, metric: Metric, rolling_window: int, output_start: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the rolling metric of the prices of a shard of tickers and correlates it with target from the
+    output_start column, the columns before are only needed by the rolling windows
+    """
+    metrics = get_rolling_metric_matrix(prices, metric, rolling_window)[:, output_start:]
+    return get_pearson_correlations(target, metrics)
+
+
+def get_shared_shard_correlations(
+    shared_memory_name: str,
+    shape: Tuple[int, int],
+    rows: slice,
+    columns: slice,
+    target: np.ndarray,
+    metric: Metric,
+    rolling_window: int,
+    output_start: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Runs get_shard_correlations in a worker process on the rows of the price matrix shared by the API process
+    """
+    # The spawned workers share the resource tracker of the API process, which unlinks the block
+    shared_memory = SharedMemory(name=shared_memory_name)
+    prices = np.ndarray(shape, dtype=np.float64, buffer=shared_memory.buf)
+    try:
+        return get_shard_correlations(prices[rows, columns], target, metric, rolling_window, output_start)
+    finally:
+        # The views on the buffer must be released before closing it
+        del prices
+        shared_memory.close()
+
+
+class PriceMatrixCache:
+    """
+    PriceMatrix of each requested price column, cleared when the pipeline loads a new version of the stock table
+    (checked at most every version_check_seconds)
+    """
+
+    def __init__(
+        self,
+        version_check_seconds: float,
+        shared: bool,
+        load_price_matrix: Callable[[Session, str, bool], PriceMatrix] = load_price_matrix,
+        get_dataset_version: Callable[[Session], Optional[int]] = get_stock_dataset_version,
+    ) -> None:
+        self.version_check_seconds = version_check_seconds
+        self.shared = shared
+        self.load_price_matrix = load_price_matrix
+        self.get_dataset_version = get_dataset_version
+
+        self.matrices: Dict[str, PriceMatrix] = {}
+        self.dataset_version: Optional[int] = None
+        self.version_checked_at: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def clear(self):
+        # The shared blocks are unlinked when the requests using the matrices are done with them
+        self.matrices = {}
+
+    def check_dataset_version(self, db_session: Session):
+        now = time.monotonic()
+        if self.version_checked_at is not None and now - self.version_checked_at < self.version_check_seconds:
+            return
+        self.version_checked_at = now
+
+        dataset_version = self.get_dataset_version(db_session)
+        if dataset_version != self.dataset_version:
+            if self.matrices:
+                logger.info(f'stock dataset version changed to {dataset_version}, clearing the price matrices')
+            self.clear()
+            self.dataset_version = dataset_version
+
+    def get(self, db_session: Session, price_column: str) -> PriceMatrix:
+        with self.lock:
+            self.check_dataset_version(db_session)
+            dataset_version = self.dataset_version
+            price_matrix = self.matrices.get(price_column)
+        if price_matrix is not None:
+            return price_matrix
+
+        # Loaded outside of the lock to not block the other price columns, concurrent misses of a price column
+        # load it twice and the matrix of a previous dataset version isn't kept
+        price_matrix = self.load_price_matrix(db_session, price_column, self.shared)
+        with self.lock:
+            if self.dataset_version == dataset_version:
+                price_matrix = self.matrices.setdefault(price_column, price_matrix)
+        return price_matrix
+
+
+price_matrix_cache = PriceMatrixCache(
+    version_check_seconds=settings.PRICE_CACHE_VERSION_CHECK_SECONDS, shared=settings.SIMILARITY_WORKERS > 0
+)
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """
+    Returns the pool of SIMILARITY_WORKERS processes, started at the first sharded request
+    """
+    global _executor
+    if _executor is None:
+        # Spawned rather than forked from the multi-threaded API process
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.SIMILARITY_WORKERS, mp_context=multiprocessing.get_context('spawn')
+        )
+    return _executor
+
+
+def shutdown_similarity_workers():
+    """
+    Stops the worker processes and releases the shared price matrices
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+    price_matrix_cache.clear()
+
+
+def get_correlations(
+    price_matrix: PriceMatrix,
+    target: np.ndarray,
+    metric: Metric,
+    rolling_window: int,
+    columns: slice,
+    output_start: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Correlates target with the rolling metric of every ticker, the tickers are sharded across the worker
+    processes when the price matrix is shared
+    """
+    if price_matrix.shared_memory is None:
+        return get_shard_correlations(price_matrix.prices[:, columns], target, metric, rolling_window, output_start)
+
+    shards = np.array_split(np.arange(len(price_matrix.tickers)), settings.SIMILARITY_WORKERS)
+    futures = [
+        get_executor().submit(
+            get_shared_shard_correlations,
+            price_matrix.shared_memory.name,
+            price_matrix.prices.shape,
+            slice(int(shard[0]), int(shard[-1]) + 1),
+            columns,
+            target,
+            metric,
+            rolling_window,
+            output_start,
+        )
+        for shard in shards
+        if len(shard)
+    ]
+    results = [future.result() for future in futures]
+    return np.concatenate([result[0] for result in results]), np.concatenate([result[1] for result in results])
+
+
+def get_most_similar_stocks(
+    db_session: Session,
+    ticker: str,
+    start: str,
+    end: str,
+    price_column: str,
+    metric: Metric,
+    rolling_window: int,
+    top_k: int,
+) -> List[Dict[str, Any]]:
+    """
+    Returns the top_k tickers whose rolling metric between start and end has the highest Pearson correlation with
+    the one of ticker. The rolling windows are over the dates of the price matrix (the trading days of all the
+    tickers) and the dates where a ticker's window misses a price aren't compared.
+    """
+    validate_query_parameters(
+        start=start,
+        end=end,
+        price_column=price_column,
+        metric=metric,
+        rolling_window=rolling_window,
+    )
+
+    price_matrix = price_matrix_cache.get(db_session, price_column)
+    ticker_index = price_matrix.get_ticker_index(ticker)
+    if ticker_index is None:
+        raise HTTPException(status_code=404, detail=f'ticker {ticker} not found')
+
+    dates_slice = price_matrix.get_dates_slice(start, end)
+    # The rolling_window - 1 dates before start are needed to compute the metric at start
+    window_start = max(dates_slice.start - (rolling_window - 1), 0)
+    columns = slice(window_start, dates_slice.stop)
+    output_start = dates_slice.start - window_start
+
+    target_prices = price_matrix.prices[ticker_index : ticker_index + 1, columns]  # noqa: E203
+    target = get_rolling_metric_matrix(target_prices, metric, rolling_window)[0, output_start:]
+    correlations, common_dates = get_correlations(price_matrix, target, metric, rolling_window, columns, output_start)
+    correlations[ticker_index] = np.nan
+
+    scored = np.flatnonzero(~np.isnan(correlations))
+    top_k_indexes = scored[np.argsort(-correlations[scored], kind='stable')[:top_k]]
+    return [
+        {
+            'ticker': str(price_matrix.tickers[index]),
+            'correlation': round(float(correlations[index]), 4),
+            'common_dates': int(common_dates[index]),
+        }
+        for index in top_k_indexes
+    ]
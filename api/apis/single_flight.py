@@ -0,0 +1,111 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+from apis import settings
+from prometheus_client import Counter, Gauge
+
+T = TypeVar('T')
+
+SINGLE_FLIGHT_REQUESTS = Counter(
+    'single_flight_requests_total',
+    'Number of requests computing their response (computed) or sharing the one of an identical request (coalesced)',
+    ['flight', 'outcome'],
+)
+SINGLE_FLIGHT_IN_FLIGHT = Gauge('single_flight_in_flight', 'Number of computations shared by the requests', ['flight'])
+
+
+class Call:
+    """
+    Computation shared by the concurrent requests with the same key, its result or error is set once it is done
+    """
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        # Number of calls waiting for the result
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces the concurrent calls with the same key (eg: the identical requests served by the threadpool):
+    the first call computes the result and the calls arriving while it runs wait for it and get the same result
+    or error. Nothing is kept once the computation is done, the next call computes again.
+    """
+
+    def __init__(self, name: str, enabled: bool = True) -> None:
+        self.name = name
+        self.enabled = enabled
+        self.calls: Dict[Hashable, Call] = {}
+        self.lock = threading.Lock()
+
+    def do(self, key: Hashable, function: Callable[[], T]) -> T:
+        if not self.enabled:
+            return function()
+
+        with self.lock:
+            call = self.calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self.calls[key] = Call()
+            else:
+                call.waiters += 1
+
+        if not is_leader:
+            SINGLE_FLIGHT_REQUESTS.labels(self.name, 'coalesced').inc()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        SINGLE_FLIGHT_REQUESTS.labels(self.name, 'computed').inc()
+        SINGLE_FLIGHT_IN_FLIGHT.labels(self.name).inc()
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+            SINGLE_FLIGHT_IN_FLIGHT.labels(self.name).dec()
+
+
+class AsyncSingleFlight:
+    """
+    Same as SingleFlight for the coroutines of the event loop: the first call runs the coroutine in a task that
+    the calls arriving while it runs await. The task isn't cancelled when the first request is.
+    """
+
+    def __init__(self, name: str, enabled: bool = True) -> None:
+        self.name = name
+        self.enabled = enabled
+        self.tasks: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, function: Callable[[], Awaitable[T]]) -> T:
+        if not self.enabled:
+            return await function()
+
+        task = self.tasks.get(key)
+        if task is not None:
+            SINGLE_FLIGHT_REQUESTS.labels(self.name, 'coalesced').inc()
+            return await asyncio.shield(task)
+
+        SINGLE_FLIGHT_REQUESTS.labels(self.name, 'computed').inc()
+        SINGLE_FLIGHT_IN_FLIGHT.labels(self.name).inc()
+        task = self.tasks[key] = asyncio.ensure_future(function())
+
+        def forget(_: asyncio.Task):
+            del self.tasks[key]
+            SINGLE_FLIGHT_IN_FLIGHT.labels(self.name).dec()
+
+        task.add_done_callback(forget)
+        return await asyncio.shield(task)
+
+
+stock_metrics_flight = SingleFlight('stock_metrics', enabled=settings.SINGLE_FLIGHT)
+async_stock_metrics_flight = AsyncSingleFlight('async_stock_metrics', enabled=settings.SINGLE_FLIGHT)
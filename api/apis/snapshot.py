@@ -0,0 +1,116 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import numpy as np
+from apis import settings
+from apis.price_cache import PRICE_COLUMNS, TickerPrices
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+
+# Written by the pipeline (pipeline/core/snapshot.py): the CURRENT file holds the name of the directory of the
+# current snapshot, which holds one .npy file per column sorted by (name, date), the sorted tickers and their offsets
+CURRENT_FILE = 'CURRENT'
+METADATA_FILE = 'snapshot.json'
+
+SNAPSHOT_RELOADS = Counter('stock_snapshot_reloads_total', 'Number of times a new stock snapshot was mapped')
+
+
+class MappedSnapshot:
+    """
+    Columns of a snapshot directory memory mapped read only: the pages are shared by every process mapping the
+    same files and read from the OS page cache
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, METADATA_FILE)) as f:
+            self.metadata = json.load(f)
+        self.tickers = np.load(os.path.join(path, 'tickers.npy'))
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        self.dates = self.load_column('date')
+        self.prices: Dict[str, np.ndarray] = {column: self.load_column(column) for column in PRICE_COLUMNS}
+
+    def load_column(self, column: str) -> np.ndarray:
+        return np.load(os.path.join(self.path, f'{column}.npy'), mmap_mode='r')
+
+    def get(self, ticker: str) -> TickerPrices:
+        """
+        Returns views on the rows of ticker (no copy), empty if the ticker isn't in the snapshot
+        """
+        index = int(np.searchsorted(self.tickers, ticker))
+        if index < len(self.tickers) and self.tickers[index] == ticker:
+            rows = slice(int(self.offsets[index]), int(self.offsets[index + 1]))
+        else:
+            rows = slice(0, 0)
+        return TickerPrices(
+            dates=self.dates[rows],
+            prices={column: prices[rows] for column, prices in self.prices.items()},
+        )
+
+
+def read_current_snapshot(snapshot_dir: str) -> Optional[str]:
+    current_path = os.path.join(snapshot_dir, CURRENT_FILE)
+    if not os.path.exists(current_path):
+        return None
+    with open(current_path) as f:
+        return f.read().strip()
+
+
+class StockSnapshot:
+    """
+    Serves the TickerPrices from the snapshot of the stock table exported by the pipeline to snapshot_dir.
+    The CURRENT file is re-read at most every reload_check_seconds and the new snapshot mapped when it changed,
+    the requests holding views on the previous one keep it mapped until they are done.
+    """
+
+    def __init__(self, snapshot_dir: Optional[str], reload_check_seconds: float) -> None:
+        self.snapshot_dir = snapshot_dir
+        self.reload_check_seconds = reload_check_seconds
+
+        self.snapshot: Optional[MappedSnapshot] = None
+        self.reload_checked_at: Optional[float] = None
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.snapshot_dir)
+
+    def check_current_snapshot(self):
+        now = time.monotonic()
+        if self.reload_checked_at is not None and now - self.reload_checked_at < self.reload_check_seconds:
+            return
+        self.reload_checked_at = now
+
+        current = read_current_snapshot(self.snapshot_dir)
+        if current is None:
+            raise FileNotFoundError(f'No stock snapshot in {self.snapshot_dir}, run the pipeline with SNAPSHOT_DIR')
+        if self.snapshot is None or os.path.basename(self.snapshot.path) != current:
+            self.snapshot = MappedSnapshot(os.path.join(self.snapshot_dir, current))
+            SNAPSHOT_RELOADS.inc()
+            logger.info(f'Mapped the {current} stock snapshot of {self.snapshot.metadata["rows"]} rows')
+
+    def get_dataset_version(self) -> Optional[int]:
+        """
+        Returns the version of the stock table exported to the current snapshot
+        """
+        with self.lock:
+            self.check_current_snapshot()
+            return self.snapshot.metadata['dataset_version']
+
+    def get(self, ticker: str) -> TickerPrices:
+        with self.lock:
+            self.check_current_snapshot()
+            snapshot = self.snapshot
+        return snapshot.get(ticker)
+
+
+stock_snapshot = StockSnapshot(
+    snapshot_dir=settings.SNAPSHOT_DIR,
+    reload_check_seconds=settings.SNAPSHOT_RELOAD_CHECK_SECONDS,
+)
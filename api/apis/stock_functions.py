@@ -1,12 +1,24 @@
 import logging
-from datetime import datetime
+from datetime import date, datetime
 from enum import Enum
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
+from apis import settings
+from apis.price_cache import TickerPrices, price_cache
 from apis.schemas import StockMetric
+from apis.serialization import get_stock_metric_records
+from apis.snapshot import stock_snapshot
+from apis.timing import current_timing, timed_phase
 from models.stock import Stock
-from sqlalchemy.orm import Session
+from models.stock_moments import StockMoments
+from models.stock_range_index import StockRangeIndex
+from numpy.lib.stride_tricks import sliding_window_view
+from sqlalchemy import Float, Text, and_, any_, case, cast, func, literal, null, select
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
 from validation.validation import ComparisonValidation, TwoElementsComparisonValidation, ValueBelongsToFieldValidation
 
 logger = logging.getLogger(__name__)
@@ -17,6 +29,10 @@ START_DATE = '2010-01-04'
 VALID_PRICE_COLUMN_VALUES = ['high_price', 'low_price', 'open_price', 'close_price']
 MAX_ROLLING_WINDOW = 100
 MIN_ROLLING_WINDOW = 1
+# Value of the metric query parameter requesting every metric
+ALL_METRICS = 'all'
+MAX_BATCH_TICKERS = 100
+MAX_BATCH_ROLLING_WINDOWS = 10
 
 
 class Metric(Enum):
@@ -31,6 +47,28 @@ class Metric(Enum):
         return [e.value for e in cls]
 
 
+class MetricsEngine(Enum):
+    PANDAS = 'pandas'
+    MOMENTS = 'moments'
+    SQL = 'sql'
+    RANGE_INDEX = 'range_index'
+
+
+# Metrics that the moments engine computes from the prefix sums
+MOMENTS_METRICS = [Metric.MEAN.value, Metric.STANDARD_DEVIATION.value]
+# Metrics that the range index engine computes from the sparse tables, with the function combining two ranges
+RANGE_INDEX_METRICS = {Metric.MIN.value: func.least, Metric.MAX.value: func.greatest}
+
+# Postgres aggregates computing the metrics over the rolling window frame, the median is computed separately
+# since percentile_cont can't be used as a window function
+SQL_WINDOW_AGGREGATES = {
+    Metric.MEAN.value: func.avg,
+    Metric.MIN.value: func.min,
+    Metric.MAX.value: func.max,
+    Metric.STANDARD_DEVIATION.value: func.stddev_samp,
+}
+
+
 def get_agg_from_rolling_df(
     rolling_df: pd.core.window.rolling.Rolling,
     metric: Metric,
@@ -52,7 +90,67 @@ def get_agg_from_rolling_df(
         return rolling_df.std()
 
 
-def validate_query_parameters(start: str, end: str, price_column: str, metric: Metric, rolling_window: int):
+def get_window_sums(values: np.ndarray, rolling_window: int) -> np.ndarray:
+    """
+    Returns the sums of the complete rolling windows of values from the differences of its cumulative sum
+    """
+    cumulative_sum = np.concatenate(([0], np.cumsum(values)))
+    return cumulative_sum[rolling_window:] - cumulative_sum[:-rolling_window]
+
+
+def get_rolling_metrics(prices: np.ndarray, rolling_window: int, metrics: List[Metric]) -> Dict[str, np.ndarray]:
+    """
+    Computes several rolling metrics over the same prices:
+    - the mean and standard deviation from the window sums of the prices and of their squares, computed from
+      one cumulative sum each
+    - the min and max over one sliding window view of the prices (no copy)
+    - the median from one partition of each window of the same view
+    As with pandas rolling, the first rolling_window - 1 values and the windows holding a missing price are NaN,
+    the standard deviation is the sample one. Returns the metric values aligned with prices.
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    output = {metric: np.full(len(prices), np.nan) for metric in metrics}
+    if len(prices) < rolling_window:
+        return output
+
+    complete_windows = slice(rolling_window - 1, None)
+    missing = np.isnan(prices)
+    windows = sliding_window_view(prices, rolling_window)
+
+    if Metric.MEAN.value in metrics or Metric.STANDARD_DEVIATION.value in metrics:
+        # The prices are shifted by their mean to keep the differences of the cumulative sums accurate
+        shift = prices[~missing].mean() if not missing.all() else 0.0
+        shifted_prices = np.where(missing, 0.0, prices - shift)
+        has_missing = get_window_sums(missing, rolling_window) > 0
+        window_sum = get_window_sums(shifted_prices, rolling_window)
+        window_mean = window_sum / rolling_window
+
+        if Metric.MEAN.value in metrics:
+            output[Metric.MEAN.value][complete_windows] = np.where(has_missing, np.nan, window_mean + shift)
+        if Metric.STANDARD_DEVIATION.value in metrics and rolling_window > 1:
+            window_sum_squares = get_window_sums(shifted_prices**2, rolling_window)
+            # Clipped at 0 as it can be slightly negative due to rounding
+            variance = np.maximum((window_sum_squares - window_sum * window_mean) / (rolling_window - 1), 0)
+            output[Metric.STANDARD_DEVIATION.value][complete_windows] = np.where(has_missing, np.nan, np.sqrt(variance))
+
+    if Metric.MIN.value in metrics:
+        output[Metric.MIN.value][complete_windows] = windows.min(axis=1)
+    if Metric.MAX.value in metrics:
+        output[Metric.MAX.value][complete_windows] = windows.max(axis=1)
+    if Metric.MEDIAN.value in metrics:
+        output[Metric.MEDIAN.value][complete_windows] = np.median(windows, axis=1)
+
+    return output
+
+
+def validate_query_parameters(
+    start: str,
+    end: str,
+    price_column: str,
+    metric: Metric,
+    rolling_window: int,
+    max_rolling_window: int = MAX_ROLLING_WINDOW,
+):
 
     validations = [
         ComparisonValidation(field_name='start', field_value=start, min_value=START_DATE),
@@ -60,7 +158,7 @@ def validate_query_parameters(start: str, end: str, price_column: str, metric: M
         ComparisonValidation(
             field_name='rolling_window',
             field_value=rolling_window,
-            max_value=MAX_ROLLING_WINDOW,
+            max_value=max_rolling_window,
             min_value=MIN_ROLLING_WINDOW,
         ),
         TwoElementsComparisonValidation(
@@ -79,12 +177,347 @@ def validate_query_parameters(start: str, end: str, price_column: str, metric: M
             raise validation.http_exception
 
 
-def format_to_float(input: str) -> Optional[float]:
-    try:
-        return round(float(input), 2)
-    except ValueError:
+def parse_iso_date(value: str) -> date:
+    """
+    The dates are compared as dates in the queries: asyncpg doesn't cast the string parameters like psycopg2
+    """
+    return datetime.strptime(value, ISO_DATE_FORMAT).date()
+
+
+def get_rolling_window_start_date(db_session: Session, ticker: str, start: str, rolling_window: int) -> Optional[date]:
+    """
+    Returns the date of the first row needed to compute the rolling window metric at start: the date of the
+    (rolling_window - 1)th row before start. Returns None if there are not enough rows before start.
+    Filtering on this date allows Postgres to prune the date partitions of the stock table. The date isn't looked up
+    (None is returned) when the stock table isn't partitioned, the extra query would cost more than it saves.
+    """
+    if rolling_window == 1:
+        return parse_iso_date(start)
+    if not settings.PARTITION_INTERVAL:
         return None
 
+    return (
+        db_session.query(Stock.date)
+        .filter(Stock.name == ticker)
+        .filter(Stock.date < parse_iso_date(start))
+        .order_by(Stock.date.desc())
+        .offset(rolling_window - 2)
+        .limit(1)
+        .scalar()
+    )
+
+
+def get_db_window_prices(
+    db_session: Session, ticker: str, start: str, end: str, price_column: str, rolling_window: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reads the prices needed by the rolling window: returns the dates between start and end and the prices from
+    the (rolling_window - 1)th row before start up to end, the last prices are the ones of the dates
+    """
+    query = (
+        db_session.query(Stock.date, getattr(Stock, price_column).label(price_column))
+        .filter(Stock.name == ticker)
+        .filter(Stock.date <= parse_iso_date(end))
+        .order_by(Stock.date.asc())
+    )
+    rolling_window_start_date = get_rolling_window_start_date(db_session, ticker, start, rolling_window)
+    if rolling_window_start_date is not None:
+        query = query.filter(Stock.date >= rolling_window_start_date)
+
+    df = pd.read_sql_query(query.statement, db_session.connection())
+
+    # Keep only the desired dates
+    dates = df['date'].to_numpy()
+    return dates[dates >= parse_iso_date(start)], df[price_column].to_numpy()
+
+
+def slice_window_prices(
+    ticker_prices: TickerPrices, start: str, end: str, price_column: str, rolling_window: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Same output as get_db_window_prices, sliced from the arrays of a ticker without copying them
+    """
+    dates_slice = ticker_prices.get_dates_slice(start, end)
+    # The rolling_window - 1 rows before start are needed to compute the metric at start
+    window_start = max(dates_slice.start - (rolling_window - 1), 0)
+
+    return (
+        ticker_prices.dates[dates_slice],
+        ticker_prices.prices[price_column][window_start : dates_slice.stop],  # noqa: E203
+    )
+
+
+def get_cached_window_prices(
+    db_session: Session, ticker: str, start: str, end: str, price_column: str, rolling_window: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Same as get_db_window_prices but the prices are sliced from the ticker arrays of the price cache,
+    hot tickers are served without querying the DB
+    """
+    return slice_window_prices(price_cache.get(db_session, ticker), start, end, price_column, rolling_window)
+
+
+def get_snapshot_window_prices(
+    db_session: Session, ticker: str, start: str, end: str, price_column: str, rolling_window: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Same as get_db_window_prices but the prices are sliced from the memory mapped stock snapshot, without
+    querying the DB
+    """
+    return slice_window_prices(stock_snapshot.get(ticker), start, end, price_column, rolling_window)
+
+
+def get_window_prices_function() -> Callable[..., Tuple[np.ndarray, np.ndarray]]:
+    """
+    Returns the function reading the window prices: from the stock snapshot, the price cache or the DB
+    """
+    if stock_snapshot.enabled:
+        return get_snapshot_window_prices
+    if price_cache.enabled:
+        return get_cached_window_prices
+    return get_db_window_prices
+
+
+def get_pandas_metric_df(
+    db_session: Session,
+    ticker: str,
+    start: str,
+    end: str,
+    price_column: str,
+    metric: Metric,
+    rolling_window: int,
+) -> pd.DataFrame:
+    """
+    Computes the rolling metric with pandas over the prices of get_db_window_prices, or of the stock snapshot or
+    the price cache when they are enabled. Returns the date and metric columns between start and end.
+    """
+    get_window_prices = get_window_prices_function()
+    dates, prices = get_window_prices(db_session, ticker, start, end, price_column, rolling_window)
+
+    with timed_phase('compute'):
+        metric_values = get_agg_from_rolling_df(pd.Series(prices, dtype=np.float64).rolling(rolling_window), metric)
+
+    return pd.DataFrame({'date': dates, 'metric': metric_values.to_numpy()[len(prices) - len(dates) :]})  # noqa: E203
+
+
+def get_stock_metrics_summary(
+    db_session: Session,
+    ticker: str,
+    start: str,
+    end: str,
+    price_column: str,
+    metrics: List[Metric],
+    rolling_window: int,
+) -> Dict[str, List[StockMetric]]:
+    """
+    Computes several metrics over the prices fetched once (from the stock snapshot or the price cache when they
+    are enabled) with get_rolling_metrics. Returns the records of each metric.
+    """
+    get_window_prices = get_window_prices_function()
+    with timed_phase('query'):
+        dates, prices = get_window_prices(db_session, ticker, start, end, price_column, rolling_window)
+    logger.info(f'Final output length is {len(dates)} for {len(metrics)} metrics')
+
+    with timed_phase('compute'):
+        rolling_metrics = get_rolling_metrics(prices, rolling_window, metrics)
+
+    with timed_phase('serialize'):
+        return {
+            metric: get_stock_metric_records(
+                pd.DataFrame({'date': dates, 'metric': metric_values[len(prices) - len(dates) :]})  # noqa: E203
+            )
+            for metric, metric_values in rolling_metrics.items()
+        }
+
+
+def get_moments_metric_df(
+    db_session: Session,
+    ticker: str,
+    start: str,
+    end: str,
+    price_column: str,
+    metric: Metric,
+    rolling_window: int,
+) -> pd.DataFrame:
+    """
+    Computes the rolling mean or standard deviation between start and end by differencing the stock_moments
+    prefix sums at each date and rolling_window rows before, the cost only depends on the output length.
+    Returns the date and metric columns.
+    """
+    current = aliased(StockMoments)
+    previous = aliased(StockMoments)
+
+    window_sum = getattr(current, f'{price_column}_sum') - func.coalesce(getattr(previous, f'{price_column}_sum'), 0)
+    window_sum_squares = getattr(current, f'{price_column}_sum_squares') - func.coalesce(
+        getattr(previous, f'{price_column}_sum_squares'), 0
+    )
+
+    if metric == Metric.MEAN.value:
+        value = window_sum / rolling_window
+    elif rolling_window > 1:
+        # Sample standard deviation, the variance is clipped at 0 as it can be slightly negative due to rounding
+        variance = (window_sum_squares - window_sum * window_sum / rolling_window) / (rolling_window - 1)
+        value = func.sqrt(func.greatest(variance, 0))
+    else:
+        value = null()
+
+    query = (
+        db_session.query(
+            current.date,
+            # Not enough rows for a complete rolling window
+            case((current.ordinal >= rolling_window, cast(value, Float)), else_=null()).label('metric'),
+        )
+        .outerjoin(
+            previous,
+            and_(previous.name == current.name, previous.ordinal == current.ordinal - rolling_window),
+        )
+        .filter(current.name == ticker)
+        .filter(current.date >= parse_iso_date(start))
+        .filter(current.date <= parse_iso_date(end))
+        .order_by(current.date.asc())
+    )
+
+    return pd.read_sql_query(query.statement, db_session.connection())
+
+
+def get_range_index_metric_df(
+    db_session: Session,
+    ticker: str,
+    start: str,
+    end: str,
+    price_column: str,
+    metric: Metric,
+    rolling_window: int,
+) -> pd.DataFrame:
+    """
+    Computes the rolling min or max between start and end from the stock_range_index sparse tables: the window of
+    rolling_window rows ending at a date is covered by the two ranges of 2^k rows (k = floor(log2(rolling_window)))
+    ending at this date and at rolling_window - 2^k rows before. The cost only depends on the output length.
+    Returns the date and metric columns.
+    """
+    level = rolling_window.bit_length() - 1
+    current = aliased(StockRangeIndex)
+    previous = aliased(StockRangeIndex)
+
+    # The Postgres arrays are 1-based
+    value = RANGE_INDEX_METRICS[metric](
+        getattr(current, f'{price_column}_{metric}')[level + 1],
+        getattr(previous, f'{price_column}_{metric}')[level + 1],
+    )
+
+    query = (
+        db_session.query(
+            current.date,
+            # Not enough rows for a complete rolling window
+            case((current.ordinal >= rolling_window, value), else_=null()).label('metric'),
+        )
+        .outerjoin(
+            previous,
+            and_(previous.name == current.name, previous.ordinal == current.ordinal - rolling_window + 2**level),
+        )
+        .filter(current.name == ticker)
+        .filter(current.date >= parse_iso_date(start))
+        .filter(current.date <= parse_iso_date(end))
+        .order_by(current.date.asc())
+    )
+
+    return pd.read_sql_query(query.statement, db_session.connection())
+
+
+def get_sql_metric_df(
+    db_session: Session,
+    ticker: str,
+    start: str,
+    end: str,
+    price_column: str,
+    metric: Metric,
+    rolling_window: int,
+) -> pd.DataFrame:
+    """
+    Computes the rolling metric in Postgres with window functions over the rows needed by the rolling window,
+    only the date and metric columns between start and end are returned
+    """
+    price = getattr(Stock, price_column)
+    rows = (-(rolling_window - 1), 0)
+
+    if metric == Metric.MEDIAN.value:
+        window_value = func.array_agg(price).over(order_by=Stock.date, rows=rows)
+    else:
+        window_value = SQL_WINDOW_AGGREGATES[metric](price).over(order_by=Stock.date, rows=rows)
+
+    rolling_window_query = (
+        db_session.query(
+            Stock.date,
+            window_value.label('window_value'),
+            func.count().over(order_by=Stock.date, rows=rows).label('window_length'),
+        )
+        .filter(Stock.name == ticker)
+        .filter(Stock.date <= parse_iso_date(end))
+    )
+    rolling_window_start_date = get_rolling_window_start_date(db_session, ticker, start, rolling_window)
+    if rolling_window_start_date is not None:
+        rolling_window_query = rolling_window_query.filter(Stock.date >= rolling_window_start_date)
+    windows = rolling_window_query.subquery()
+
+    if metric == Metric.MEDIAN.value:
+        window_prices = func.unnest(windows.c.window_value).table_valued('price').render_derived()
+        value = (
+            select(func.percentile_cont(0.5).within_group(window_prices.c.price))
+            .select_from(window_prices)
+            .scalar_subquery()
+        )
+    else:
+        value = windows.c.window_value
+
+    query = (
+        db_session.query(
+            windows.c.date,
+            # Not enough rows for a complete rolling window
+            case((windows.c.window_length >= rolling_window, cast(value, Float)), else_=null()).label('metric'),
+        )
+        .filter(windows.c.date >= parse_iso_date(start))
+        .order_by(windows.c.date.asc())
+    )
+
+    return pd.read_sql_query(query.statement, db_session.connection())
+
+
+def parse_metrics(metric: str) -> List[Metric]:
+    """
+    Splits a comma separated list of metrics, ALL_METRICS stands for every metric
+    """
+    if metric == ALL_METRICS:
+        return Metric.keys()
+    return list(dict.fromkeys(metric.split(',')))
+
+
+def get_metric_df_function(metric: str) -> Callable[..., pd.DataFrame]:
+    """
+    Returns the function computing metric with the METRICS_ENGINE, pandas computes the metrics the engine doesn't
+    """
+    if settings.METRICS_ENGINE == MetricsEngine.MOMENTS.value and metric in MOMENTS_METRICS:
+        return get_moments_metric_df
+    if settings.METRICS_ENGINE == MetricsEngine.SQL.value:
+        return get_sql_metric_df
+    if settings.METRICS_ENGINE == MetricsEngine.RANGE_INDEX.value and metric in RANGE_INDEX_METRICS:
+        return get_range_index_metric_df
+    return get_pandas_metric_df
+
+
+def get_stock_metric_dataset_version(db_session: Session, metric: str, dataset_version: Optional[int]) -> Optional[int]:
+    """
+    Returns the version of the stock table that get_stock_metric reads for metric, dataset_version being the version
+    in the DB: the stock snapshot and the price cache serve the previous version until they are reloaded
+    """
+    metrics = parse_metrics(metric)
+    if len(metrics) == 1 and get_metric_df_function(metrics[0]) is not get_pandas_metric_df:
+        return dataset_version
+    if stock_snapshot.enabled:
+        return stock_snapshot.get_dataset_version()
+    if price_cache.enabled:
+        return price_cache.get_dataset_version(db_session)
+    return dataset_version
+
 
 def get_stock_metric(
     db_session: Session,
@@ -94,28 +527,219 @@ def get_stock_metric(
     price_column: str,
     metric: Metric,
     rolling_window: int,
-) -> List[StockMetric]:
+) -> Union[List[StockMetric], Dict[str, List[StockMetric]]]:
+    """
+    Returns the records of the rolling metric between start and end. When metric is a comma separated list of
+    metrics or ALL_METRICS, they are computed together by get_stock_metrics_summary and the records are
+    keyed by metric.
+    """
+    metrics = parse_metrics(metric)
+
+    is_range_index_metric = len(metrics) == 1 and metrics[0] in RANGE_INDEX_METRICS
+    use_range_index = settings.METRICS_ENGINE == MetricsEngine.RANGE_INDEX.value and is_range_index_metric
+    # The range index answers windows longer than the engines reading the raw prices
+    max_rolling_window = settings.RANGE_INDEX_MAX_WINDOW if use_range_index else MAX_ROLLING_WINDOW
 
     # TODO check if pydantic validation is better https://docs.pydantic.dev/usage/validators/
-    validate_query_parameters(
+    with timed_phase('validation'):
+        for requested_metric in metrics:
+            validate_query_parameters(
+                start=start,
+                end=end,
+                price_column=price_column,
+                metric=requested_metric,
+                rolling_window=rolling_window,
+                max_rolling_window=max_rolling_window,
+            )
+
+    if len(metrics) > 1:
+        return get_stock_metrics_summary(
+            db_session,
+            ticker=ticker,
+            start=start,
+            end=end,
+            price_column=price_column,
+            metrics=metrics,
+            rolling_window=rolling_window,
+        )
+    (metric,) = metrics
+
+    get_metric_df = get_metric_df_function(metric)
+
+    # The rolling computation of the pandas engine is timed apart in the compute phase
+    with timed_phase('query'):
+        df = get_metric_df(
+            db_session,
+            ticker=ticker,
+            start=start,
+            end=end,
+            price_column=price_column,
+            metric=metric,
+            rolling_window=rolling_window,
+        )
+    logger.info(f'Final output length is {len(df)}')
+
+    with timed_phase('serialize'):
+        return get_stock_metric_records(df)
+
+
+def validate_batch_query_parameters(
+    tickers: List[str], start: str, end: str, price_column: str, metrics: List[Metric], rolling_windows: List[int]
+):
+    validations = [
+        ComparisonValidation(
+            field_name='number of tickers', field_value=len(tickers), max_value=MAX_BATCH_TICKERS, min_value=1
+        ),
+        ComparisonValidation(field_name='number of metrics', field_value=len(metrics), min_value=1),
+        ComparisonValidation(
+            field_name='number of rolling windows',
+            field_value=len(rolling_windows),
+            max_value=MAX_BATCH_ROLLING_WINDOWS,
+            min_value=1,
+        ),
+    ]
+
+    for validation in validations:
+        if not validation.is_valid:
+            raise validation.http_exception
+
+    for metric in metrics:
+        for rolling_window in rolling_windows:
+            validate_query_parameters(
+                start=start, end=end, price_column=price_column, metric=metric, rolling_window=rolling_window
+            )
+
+
+def get_batch_prices_df(
+    db_session: Session, tickers: List[str], start: str, end: str, price_column: str, max_rolling_window: int
+) -> pd.DataFrame:
+    """
+    Reads in a single query the prices of all the tickers needed by the rolling windows: the rows between start
+    and end and the max_rolling_window - 1 rows before start of each ticker. Returns the name, date and
+    price_column columns sorted by (name, date).
+    """
+    # Number of rows of the ticker from the row up to start (excluded), 0 for the rows after start
+    rows_before_start = (
+        func.count()
+        .filter(Stock.date < start)
+        .over(partition_by=Stock.name, order_by=Stock.date.desc())
+        .label('rows_before_start')
+    )
+    prices = (
+        db_session.query(Stock.name, Stock.date, getattr(Stock, price_column).label(price_column), rows_before_start)
+        .filter(Stock.name == any_(literal(tickers, type_=ARRAY(Text))))
+        .filter(Stock.date <= end)
+        .subquery()
+    )
+    query = (
+        db_session.query(prices.c.name, prices.c.date, getattr(prices.c, price_column))
+        .filter(prices.c.rows_before_start <= max_rolling_window - 1)
+        .order_by(prices.c.name.asc(), prices.c.date.asc())
+    )
+
+    return pd.read_sql_query(query.statement, db_session.connection())
+
+
+def get_grouped_rolling_metric(df: pd.DataFrame, price_column: str, metric: Metric, rolling_window: int) -> np.ndarray:
+    """
+    Computes the rolling metric of all the tickers of df at once, the windows don't overlap two tickers.
+    Returns the metric values aligned with the rows of df.
+    """
+    if df.empty:
+        return np.array([], dtype=np.float64)
+
+    rolling_df = df.groupby('name', sort=False)[price_column].rolling(rolling_window)
+    return get_agg_from_rolling_df(rolling_df, metric).droplevel(0).reindex(df.index).to_numpy()
+
+
+def get_stock_metrics_batch(
+    db_session: Session,
+    tickers: List[str],
+    start: str,
+    end: str,
+    price_column: str,
+    metrics: List[Metric],
+    rolling_windows: List[int],
+) -> Dict[str, Dict[str, Dict[str, List[StockMetric]]]]:
+    """
+    Computes each metric for each rolling window of all the tickers from a single query, each (metric, window)
+    is computed for all the tickers at once with a grouped rolling window.
+    Returns the records keyed by ticker, metric and rolling window, a ticker without data has empty records.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    metrics = list(dict.fromkeys(parsed_metric for metric in metrics for parsed_metric in parse_metrics(metric)))
+    rolling_windows = list(dict.fromkeys(rolling_windows))
+    validate_batch_query_parameters(
+        tickers=tickers,
         start=start,
         end=end,
         price_column=price_column,
-        metric=metric,
-        rolling_window=rolling_window,
+        metrics=metrics,
+        rolling_windows=rolling_windows,
     )
 
-    query = db_session.query(Stock).filter(Stock.name == ticker).filter(Stock.date <= end).order_by(Stock.date.asc())
-
-    df = pd.read_sql(query.statement, db_session.bind)
+    df = get_batch_prices_df(
+        db_session,
+        tickers=tickers,
+        start=start,
+        end=end,
+        price_column=price_column,
+        max_rolling_window=max(rolling_windows),
+    )
+    logger.info(f'Batch input length is {len(df)} for {len(tickers)} tickers')
 
-    df['metric'] = get_agg_from_rolling_df(df[price_column].rolling(rolling_window), metric)
-    df = df.fillna('')
+    metric_values = {
+        (metric, rolling_window): get_grouped_rolling_metric(df, price_column, metric, rolling_window)
+        for metric in metrics
+        for rolling_window in rolling_windows
+    }
 
     # Keep only the desired data
-    df = df[df['date'] >= datetime.strptime(start, ISO_DATE_FORMAT).date()]
-    logger.info(f'Final output length is {len(df)}')
+    in_range = (df['date'] >= parse_iso_date(start)).to_numpy()
+    dates = df['date'].to_numpy()[in_range]
+    metric_values = {key: values[in_range] for key, values in metric_values.items()}
+    ticker_positions = df.loc[in_range].groupby('name', sort=False).indices
 
-    df['metric'] = df['metric'].apply(format_to_float)
-    df = df.fillna('')
-    return df[['date', 'metric']].to_dict('records')
+    output = {}
+    for ticker in tickers:
+        positions = ticker_positions.get(ticker, [])
+        output[ticker] = {
+            metric: {
+                str(rolling_window): get_stock_metric_records(
+                    pd.DataFrame(
+                        {'date': dates[positions], 'metric': metric_values[(metric, rolling_window)][positions]}
+                    )
+                )
+                for rolling_window in rolling_windows
+            }
+            for metric in metrics
+        }
+    return output
+
+
+async def get_stock_metric_async(
+    db_session: AsyncSession,
+    ticker: str,
+    start: str,
+    end: str,
+    price_column: str,
+    metric: Metric,
+    rolling_window: int,
+) -> Union[List[StockMetric], Dict[str, List[StockMetric]]]:
+    """
+    Runs get_stock_metric with the sync facade of the async session: the queries are sent through the async
+    driver and awaited, so the event loop serves other requests while waiting for Postgres. The rolling
+    computation and the serialization still run on the event loop thread (in the greenlet of run_sync), the
+    other requests wait for them.
+    """
+    # The greenlet of run_sync doesn't see the context of the request
+    timing = current_timing.get()
+    return await db_session.run_sync(
+        get_stock_metric if timing is None else timing.bind(get_stock_metric),
+        ticker=ticker,
+        start=start,
+        end=end,
+        price_column=price_column,
+        metric=metric,
+        rolling_window=rolling_window,
+    )
@@ -0,0 +1,136 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, Iterator, List, Optional, TypeVar
+
+from apis import settings
+from fastapi import Response
+from prometheus_client import Histogram
+
+T = TypeVar('T')
+
+REQUEST_PHASE_SECONDS = Histogram(
+    'request_phase_seconds',
+    'Time spent in each phase of the /stock_metrics/ requests, excluding the phases nested in it',
+    ['phase', 'metric', 'window'],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+# Upper bounds of the window label buckets, the windows above the last one are labelled with it
+WINDOW_BUCKETS = [1, 5, 10, 20, 50, 100, 250, 500, 1024]
+
+
+class RequestTiming:
+    """
+    Durations of the phases of a request. A phase nested in another one is only counted in the inner phase
+    so that the durations add up to the time spent in the phases.
+    """
+
+    def __init__(self) -> None:
+        self.start_time = time.perf_counter()
+        self.durations: Dict[str, float] = {}
+        # Time spent in the nested phases of each open phase
+        self.nested_seconds: List[float] = []
+
+    def add(self, phase: str, seconds: float):
+        self.durations[phase] = self.durations.get(phase, 0.0) + seconds
+        if self.nested_seconds:
+            self.nested_seconds[-1] += seconds
+
+    @contextmanager
+    def phase(self, phase: str) -> Iterator[None]:
+        start_time = time.perf_counter()
+        self.nested_seconds.append(0.0)
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start_time
+            own_seconds = seconds - self.nested_seconds.pop()
+            self.durations[phase] = self.durations.get(phase, 0.0) + own_seconds
+            # The parent phase excludes the whole duration, nested phases included
+            if self.nested_seconds:
+                self.nested_seconds[-1] += seconds
+
+    def get_server_timing(self) -> str:
+        """
+        Returns the Server-Timing header value of the phases and of the total time so far, in milliseconds
+        """
+        durations = {**self.durations, 'total': time.perf_counter() - self.start_time}
+        return ', '.join(f'{phase};dur={seconds * 1000:.3f}' for phase, seconds in durations.items())
+
+    def bind(self, function: Callable[..., T]) -> Callable[..., T]:
+        """
+        Returns function recording its phases in this timing, for the functions run in a fresh context
+        (eg: the greenlet of AsyncSession.run_sync)
+        """
+
+        @wraps(function)
+        def timed_function(*args, **kwargs) -> T:
+            token = current_timing.set(self)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                current_timing.reset(token)
+
+        return timed_function
+
+
+current_timing: ContextVar[Optional[RequestTiming]] = ContextVar('current_timing', default=None)
+
+
+def get_window_label(rolling_window: int) -> str:
+    """
+    Bucket of the rolling window, labelled with its upper bound to bound the number of histograms
+    """
+    return str(next((bound for bound in WINDOW_BUCKETS if rolling_window <= bound), WINDOW_BUCKETS[-1]))
+
+
+@contextmanager
+def timed_phase(phase: str) -> Iterator[None]:
+    """
+    Records the duration of the block in the timing of the current request, if any
+    """
+    timing = current_timing.get()
+    if timing is None:
+        yield
+        return
+    with timing.phase(phase):
+        yield
+
+
+def record_phase(phase: str, seconds: float):
+    """
+    Adds seconds spent outside of a timed_phase block (eg: measured by the pool) to the current request, if any
+    """
+    timing = current_timing.get()
+    if timing is not None:
+        timing.add(phase, seconds)
+
+
+@contextmanager
+def request_timing() -> Iterator[RequestTiming]:
+    """
+    Times the phases of the request run in the block
+    """
+    timing = RequestTiming()
+    token = current_timing.set(timing)
+    try:
+        yield timing
+    finally:
+        current_timing.reset(token)
+
+
+def finish_request_timing(
+    timing: RequestTiming, response: Response, metric_label: str, rolling_window: int
+) -> Response:
+    """
+    Records the phases of a served request in the REQUEST_PHASE_SECONDS histograms and sends them in the
+    Server-Timing header of its response
+    """
+    window_label = get_window_label(rolling_window)
+    for phase, seconds in timing.durations.items():
+        REQUEST_PHASE_SECONDS.labels(phase, metric_label, window_label).observe(seconds)
+    if settings.SERVER_TIMING:
+        response.headers['Server-Timing'] = timing.get_server_timing()
+    return response
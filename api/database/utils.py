@@ -25,6 +25,10 @@ class DbConfig:
     def uri(self) -> str:
         return f'postgresql://{self.username}:{self.password}@{self.host}:{self.port}/{self.database}'  # noqa
 
+    @property
+    def async_uri(self) -> str:
+        return f'postgresql+asyncpg://{self.username}:{self.password}@{self.host}:{self.port}/{self.database}'  # noqa
+
     @property
     def psycopg2_compatible_dict(self) -> Dict[str, str]:
         return {
@@ -0,0 +1,14 @@
+from apis.database import Base
+from sqlalchemy import BigInteger, Column, DateTime, Text
+
+
+class DatasetVersion(Base):
+    """
+    Version of each loaded table, incremented by the pipeline at every load
+    """
+
+    __tablename__ = 'dataset_version'
+
+    table_name = Column(Text, primary_key=True)
+    version = Column(BigInteger)
+    loaded_at = Column(DateTime)
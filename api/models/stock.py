@@ -1,9 +1,65 @@
+from apis import settings
 from apis.database import Base
-from sqlalchemy import Column, Date, Float, Integer, Text
+from sqlalchemy import BigInteger, Column, Date, Float, Integer, MetaData, SmallInteger, Table, Text, case, cast, select
+from sqlalchemy.sql.expression import Subquery
 
+STOCK_TABLE_NAME = 'stock'
+PRICE_COLUMNS = ['open_price', 'close_price', 'high_price', 'low_price']
+# Codes of the market column of the compact stock table, see the pipeline MARKET_CODES
+MARKETS = {1: 'NASDAQ', 2: 'NYSE'}
 
-class Stock(Base):
-    __tablename__ = 'stock'
+# Tables of the compact schema, in their own metadata since they are only read through the compact Stock mapping
+compact_metadata = MetaData()
+ticker_table = Table(
+    'ticker',
+    compact_metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', Text, unique=True),
+)
+stock_compact_table = Table(
+    STOCK_TABLE_NAME,
+    compact_metadata,
+    Column('ticker_id', Integer, primary_key=True),
+    Column('date', Date, primary_key=True),
+    *[Column(price_column, Integer) for price_column in PRICE_COLUMNS],
+    Column('volume', BigInteger),
+    Column('market', SmallInteger),
+)
+
+
+def get_compact_stock_subquery(price_decimals: int) -> Subquery:
+    """
+    Decodes the compact stock table to the columns of the default stock table: the ticker name is joined from the
+    ticker table, the market decoded from its code and the prices divided by 10^price_decimals. Postgres flattens
+    the subquery, a filter on the name is a lookup of the ticker id followed by the (ticker_id, date) key.
+    """
+    return (
+        select(
+            ticker_table.c.name,
+            stock_compact_table.c.date,
+            *[
+                (cast(stock_compact_table.c[price_column], Float) / 10**price_decimals).label(price_column)
+                for price_column in PRICE_COLUMNS
+            ],
+            stock_compact_table.c.volume,
+            case(MARKETS, value=stock_compact_table.c.market).label('market'),
+        )
+        .select_from(stock_compact_table.join(ticker_table, ticker_table.c.id == stock_compact_table.c.ticker_id))
+        .subquery(STOCK_TABLE_NAME)
+    )
+
+
+class CompactStock(Base):
+    """
+    Read only mapping of the compact stock table with the same attributes as the default one
+    """
+
+    __table__ = get_compact_stock_subquery(settings.PRICE_DECIMALS)
+    __mapper_args__ = {'primary_key': [__table__.c.name, __table__.c.date]}
+
+
+class DefaultStock(Base):
+    __tablename__ = STOCK_TABLE_NAME
 
     name = Column(Text, primary_key=True)
     date = Column(Date, primary_key=True)
@@ -13,3 +69,7 @@ class Stock(Base):
     low_price = Column(Float)
     volume = Column(Integer)
     market = Column(Text)
+
+
+# Mapping of the stock table in the STOCK_SCHEMA loaded by the pipeline
+Stock = CompactStock if settings.STOCK_SCHEMA == 'compact' else DefaultStock
@@ -0,0 +1,22 @@
+from apis.database import Base
+from sqlalchemy import Column, Date, Integer, Numeric, Text
+
+
+class StockMoments(Base):
+    """
+    Per ticker prefix sums of the prices and of their squares, up to the row of rank ordinal ordered by date
+    """
+
+    __tablename__ = 'stock_moments'
+
+    name = Column(Text, primary_key=True)
+    ordinal = Column(Integer, primary_key=True)
+    date = Column(Date)
+    open_price_sum = Column(Numeric)
+    open_price_sum_squares = Column(Numeric)
+    close_price_sum = Column(Numeric)
+    close_price_sum_squares = Column(Numeric)
+    high_price_sum = Column(Numeric)
+    high_price_sum_squares = Column(Numeric)
+    low_price_sum = Column(Numeric)
+    low_price_sum_squares = Column(Numeric)
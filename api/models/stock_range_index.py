@@ -0,0 +1,24 @@
+from apis.database import Base
+from sqlalchemy import Column, Date, Float, Integer, Text
+from sqlalchemy.dialects.postgresql import ARRAY
+
+
+class StockRangeIndex(Base):
+    """
+    Per ticker sparse tables of the prices: element k + 1 of the arrays of the row of rank ordinal ordered by date
+    holds the min (max) of the prices of the 2^k rows ending at ordinal
+    """
+
+    __tablename__ = 'stock_range_index'
+
+    name = Column(Text, primary_key=True)
+    ordinal = Column(Integer, primary_key=True)
+    date = Column(Date)
+    open_price_min = Column(ARRAY(Float))
+    open_price_max = Column(ARRAY(Float))
+    close_price_min = Column(ARRAY(Float))
+    close_price_max = Column(ARRAY(Float))
+    high_price_min = Column(ARRAY(Float))
+    high_price_max = Column(ARRAY(Float))
+    low_price_min = Column(ARRAY(Float))
+    low_price_max = Column(ARRAY(Float))
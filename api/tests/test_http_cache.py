@@ -0,0 +1,21 @@
+from apis.http_cache import DatasetVersionCache, matches_if_none_match
+
+
+def test_matches_if_none_match():
+    etag = '"7-abc"'
+
+    assert matches_if_none_match('"7-abc"', etag)
+    assert matches_if_none_match('"6-abc", W/"7-abc"', etag)
+    assert matches_if_none_match('*', etag)
+    assert not matches_if_none_match('"6-abc"', etag)
+    assert not matches_if_none_match(None, etag)
+
+
+def test_dataset_version_cache_is_stale():
+    dataset_version_cache = DatasetVersionCache(version_check_seconds=60)
+    assert dataset_version_cache.is_stale()
+
+    dataset_version_cache.set(3)
+
+    assert not dataset_version_cache.is_stale()
+    assert dataset_version_cache.get(db_session=None) == 3
@@ -1,17 +1,39 @@
 # isort: skip_file
+import asyncio
 import unittest
 from dataclasses import dataclass
 from typing import Any, List
+from urllib.parse import urlencode, urlsplit
 
+import numpy as np
+import orjson
+import pandas as pd
 import pytest
 from sqlalchemy.orm import sessionmaker
+from fastapi import Request
 from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import NullPool
 
-from apis.dependencies import get_db_session
-from apis.main import app
+from apis.dependencies import get_async_db_session, get_async_session_factory, get_db_session
+from apis import main
+from apis.main import app, on_stock_loaded
 from database.utils import create_database_if_not_exists, create_table, drop_table, get_db_config
+from apis import settings
+from apis.http_cache import dataset_version_cache
+from apis.price_cache import price_cache
+from apis.result_cache import MemoryResultCacheBackend, result_cache
+from apis.similarity import price_matrix_cache
+from apis.single_flight import async_stock_metrics_flight
+from apis.stock_functions import MAX_BATCH_ROLLING_WINDOWS, MAX_BATCH_TICKERS, get_stock_metric_async, parse_metrics
+from apis.timing import get_window_label
+from models.dataset_version import DatasetVersion
 from models.stock import Stock
+from models.stock_moments import StockMoments
+from models.stock_range_index import StockRangeIndex
+from tests.test_utils import import_pipeline_module
 from tests.test_input import TEST_INPUT  # isort:skip
 
 
@@ -33,7 +55,21 @@ def get_db_test_session():
         db.close()
 
 
+# The test client runs each request in a new event loop, the asyncpg connections can't be reused across them
+test_async_db_engine = create_async_engine(get_db_config(db_name='test').async_uri, poolclass=NullPool)
+AsyncTestingSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=test_async_db_engine, class_=AsyncSession
+)
+
+
+async def get_async_db_test_session():
+    async with AsyncTestingSessionLocal() as db:
+        yield db
+
+
 app.dependency_overrides[get_db_session] = get_db_test_session
+app.dependency_overrides[get_async_db_session] = get_async_db_test_session
+app.dependency_overrides[get_async_session_factory] = lambda: AsyncTestingSessionLocal
 client = TestClient(app)
 
 
@@ -55,6 +91,71 @@ def populate_db_test():
     drop_table(test_db_engine, Stock.__table__)
 
 
+@pytest.fixture()
+def populate_moments_db_test(populate_db_test, monkeypatch):
+
+    query = import_pipeline_module('pipeline.tables.stock_moments').get_stock_moments_query(stock_source='stock')
+    create_table(test_db_engine, StockMoments.__table__)
+    test_db_engine.execute(f'INSERT INTO stock_moments {query}')
+    monkeypatch.setattr(settings, 'METRICS_ENGINE', 'moments')
+
+    yield
+
+    drop_table(test_db_engine, StockMoments.__table__)
+
+
+def populate_range_index():
+    stock_range_index = import_pipeline_module('pipeline.tables.stock_range_index')
+    query = stock_range_index.get_stock_range_index_query(
+        levels=stock_range_index.get_range_index_levels(settings.RANGE_INDEX_MAX_WINDOW)
+    )
+    create_table(test_db_engine, StockRangeIndex.__table__)
+    test_db_engine.execute(f'INSERT INTO stock_range_index {query}')
+
+
+@pytest.fixture()
+def populate_range_index_db_test(populate_db_test, monkeypatch):
+
+    populate_range_index()
+    monkeypatch.setattr(settings, 'METRICS_ENGINE', 'range_index')
+
+    yield
+
+    drop_table(test_db_engine, StockRangeIndex.__table__)
+
+
+# Longer than the windows of the engines reading the raw prices
+LONG_TICKER_ROWS = 400
+
+
+@pytest.fixture()
+def populate_long_range_index_db_test(populate_db_test, monkeypatch):
+
+    high_prices = 100 + np.cumsum(np.random.default_rng(0).normal(0, 1, size=LONG_TICKER_ROWS)).round(2)
+    dates = pd.bdate_range(start='2010-01-04', periods=LONG_TICKER_ROWS)
+    session = next(get_db_test_session())
+    session.add_all(
+        Stock(
+            name='LONG',
+            date=date.date(),
+            open_price=high_price,
+            close_price=high_price,
+            high_price=high_price,
+            low_price=high_price,
+            volume=100,
+            market='NYSE',
+        )
+        for date, high_price in zip(dates, high_prices)
+    )
+    session.commit()
+    populate_range_index()
+    monkeypatch.setattr(settings, 'METRICS_ENGINE', 'range_index')
+
+    yield pd.Series(high_prices, index=dates.strftime('%Y-%m-%d'))
+
+    drop_table(test_db_engine, StockRangeIndex.__table__)
+
+
 @dataclass
 class StockMetricTestCase:
     price_column: str
@@ -167,14 +268,12 @@ TEST_CASES = [
 ]
 
 PATH = '/stock_metrics/?price_column={price_column}&metric={metric}&rolling_window={rolling_window}&ticker={ticker}&start={start}&end={end}'  # noqa
+ASYNC_PATH = f'/async{PATH}'
 
 
-def test_read_main(populate_db_test):
-
-    """"""
-
-    for test_case in TEST_CASES:
-        path = PATH.format(
+def check_test_cases(test_cases: List[StockMetricTestCase], path_template: str = PATH):
+    for test_case in test_cases:
+        path = path_template.format(
             price_column=test_case.price_column,
             metric=test_case.metric,
             rolling_window=test_case.rolling_window,
@@ -186,3 +285,403 @@ def test_read_main(populate_db_test):
         assert response.status_code == test_case.expected_status_code
         if test_case.expected_result:
             assert response.json() == test_case.expected_result
+
+
+def test_read_main(populate_db_test):
+
+    """"""
+
+    check_test_cases(TEST_CASES)
+
+
+def test_read_main_moments_engine(populate_moments_db_test):
+    check_test_cases([test_case for test_case in TEST_CASES if test_case.metric in ('mean', 'standard_deviation')])
+
+
+def test_read_main_range_index_engine(populate_range_index_db_test):
+    check_test_cases(TEST_CASES)
+
+
+@pytest.mark.parametrize('metric', ['min', 'max'])
+@pytest.mark.parametrize('rolling_window', [1, 2, 3, 5, 10, 13])
+def test_range_index_engine_parity_with_pandas(populate_range_index_db_test, monkeypatch, metric, rolling_window):
+    path = PATH.format(
+        price_column='high_price',
+        metric=metric,
+        rolling_window=rolling_window,
+        ticker='AA',
+        start='2010-01-04',
+        end='2010-01-17',
+    )
+    range_index_response = client.get(path)
+    monkeypatch.setattr(settings, 'METRICS_ENGINE', 'pandas')
+    pandas_response = client.get(path)
+
+    assert range_index_response.status_code == pandas_response.status_code == 200
+    assert range_index_response.json() == pandas_response.json()
+
+
+def test_range_index_engine_long_windows(populate_range_index_db_test):
+    path = PATH.format(
+        price_column='high_price', metric='max', rolling_window=150, ticker='AA', start='2010-01-04', end='2010-01-05'
+    )
+    response = client.get(path)
+
+    assert response.status_code == 200
+    assert response.json() == [{'date': '2010-01-04', 'metric': ''}, {'date': '2010-01-05', 'metric': ''}]
+    # The engines reading the raw prices are still limited to MAX_ROLLING_WINDOW
+    assert client.get(path.replace('metric=max', 'metric=mean')).status_code == 422
+
+
+@pytest.mark.parametrize('metric', ['min', 'max'])
+@pytest.mark.parametrize('rolling_window', [150, 256, 300])
+def test_range_index_engine_long_windows_match_pandas(populate_long_range_index_db_test, metric, rolling_window):
+    high_prices = populate_long_range_index_db_test
+    path = PATH.format(
+        price_column='high_price',
+        metric=metric,
+        rolling_window=rolling_window,
+        ticker='LONG',
+        start=high_prices.index[rolling_window - 10],
+        end=high_prices.index[-1],
+    )
+    response = client.get(path)
+
+    assert response.status_code == 200
+    expected = getattr(high_prices.rolling(rolling_window), metric)()[rolling_window - 10 :]  # noqa: E203
+    assert [record['date'] for record in response.json()] == expected.index.tolist()
+    # Not enough rows for the first windows
+    assert [record['metric'] for record in response.json()] == ['' if np.isnan(value) else value for value in expected]
+
+
+def test_read_main_sql_engine(populate_db_test, monkeypatch):
+    monkeypatch.setattr(settings, 'METRICS_ENGINE', 'sql')
+    check_test_cases(TEST_CASES)
+
+
+@pytest.mark.parametrize('metric', ['median', 'mean', 'min', 'max', 'standard_deviation'])
+@pytest.mark.parametrize('rolling_window', [1, 2, 3, 10])
+def test_sql_engine_parity_with_pandas(populate_db_test, monkeypatch, metric, rolling_window):
+    path = PATH.format(
+        price_column='high_price',
+        metric=metric,
+        rolling_window=rolling_window,
+        ticker='AA',
+        start='2010-01-06',
+        end='2010-01-17',
+    )
+    monkeypatch.setattr(settings, 'METRICS_ENGINE', 'pandas')
+    pandas_response = client.get(path)
+    monkeypatch.setattr(settings, 'METRICS_ENGINE', 'sql')
+    sql_response = client.get(path)
+
+    assert sql_response.status_code == pandas_response.status_code == 200
+    assert sql_response.json() == pandas_response.json()
+
+
+@pytest.mark.parametrize('metrics_engine', ['pandas', 'sql'])
+@pytest.mark.parametrize('rolling_window', [1, 2, 3, 10])
+def test_partitioned_table_window_start_date_parity(populate_db_test, monkeypatch, metrics_engine, rolling_window):
+    path = PATH.format(
+        price_column='close_price',
+        metric='mean',
+        rolling_window=rolling_window,
+        ticker='AA',
+        start='2010-01-06',
+        end='2010-01-17',
+    )
+    monkeypatch.setattr(settings, 'METRICS_ENGINE', metrics_engine)
+    monkeypatch.setattr(settings, 'PARTITION_INTERVAL', None)
+    unpartitioned_response = client.get(path)
+    monkeypatch.setattr(settings, 'PARTITION_INTERVAL', 'month')
+    partitioned_response = client.get(path)
+
+    assert partitioned_response.status_code == unpartitioned_response.status_code == 200
+    assert partitioned_response.json() == unpartitioned_response.json()
+
+
+def test_read_main_price_cache(populate_db_test, monkeypatch):
+    monkeypatch.setattr(price_cache, 'max_bytes', 10_000_000)
+    price_cache.clear()
+
+    check_test_cases(TEST_CASES)
+    check_test_cases(TEST_CASES)
+
+    assert price_cache.hits > 0
+    price_cache.clear()
+
+
+def test_read_main_conditional_requests(populate_db_test, monkeypatch):
+    monkeypatch.setattr(dataset_version_cache, 'get', lambda db_session: 7)
+    path = PATH.format(**vars(TEST_CASES[0]))
+
+    response = client.get(path)
+    etag = response.headers['etag']
+    assert response.status_code == 200
+    assert etag.startswith('"7-')
+    assert response.headers['cache-control'] == f'public, max-age={settings.HTTP_CACHE_MAX_AGE}'
+
+    not_modified_response = client.get(path, headers={'If-None-Match': etag})
+    assert not_modified_response.status_code == 304
+    assert not_modified_response.content == b''
+    assert not_modified_response.headers['etag'] == etag
+
+    # A new load of the data changes the ETag
+    monkeypatch.setattr(dataset_version_cache, 'get', lambda db_session: 8)
+    assert client.get(path, headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_read_main_result_cache(populate_db_test, monkeypatch):
+    monkeypatch.setattr(dataset_version_cache, 'get', lambda db_session: 7)
+    monkeypatch.setattr(result_cache, 'backend', MemoryResultCacheBackend(max_bytes=1024 * 1024))
+    path = PATH.format(**vars(TEST_CASES[0]))
+
+    computed_response = client.get(path)
+    cached_response = client.get(path)
+
+    assert cached_response.status_code == 200
+    assert cached_response.json() == computed_response.json() == TEST_CASES[0].expected_result
+    assert cached_response.headers['etag'] == computed_response.headers['etag']
+    assert len(result_cache.backend.entries) == 1
+
+    result_cache.invalidate()
+    assert len(result_cache.backend.entries) == 0
+
+
+@pytest.fixture()
+def dataset_version_db_test():
+
+    create_table(test_db_engine, DatasetVersion.__table__)
+    test_db_engine.execute("INSERT INTO dataset_version (table_name, version) VALUES ('stock', 1)")
+
+    yield
+
+    drop_table(test_db_engine, DatasetVersion.__table__)
+
+
+def test_stock_loaded_notification_invalidates_the_warm_price_cache(
+    populate_db_test, dataset_version_db_test, monkeypatch
+):
+    # Only the notification tells the caches about the new load
+    monkeypatch.setattr(dataset_version_cache, 'version_check_seconds', 3600)
+    monkeypatch.setattr(price_cache, 'version_check_seconds', 3600)
+    monkeypatch.setattr(price_cache, 'max_bytes', 10_000_000)
+    monkeypatch.setattr(result_cache, 'backend', MemoryResultCacheBackend(max_bytes=1024 * 1024))
+    on_stock_loaded(1)
+    test_case = TEST_CASES[0]
+    path = PATH.format(**vars(test_case))
+
+    assert client.get(path).json() == test_case.expected_result
+    assert 'AA' in price_cache.entries
+    assert price_cache.dataset_version == 1
+
+    test_db_engine.execute("UPDATE stock SET open_price = 2 * open_price WHERE name = 'AA'")
+    test_db_engine.execute("UPDATE dataset_version SET version = 2 WHERE table_name = 'stock'")
+    on_stock_loaded(2)
+    response = client.get(path)
+
+    assert response.json() == [{**record, 'metric': 2 * record['metric']} for record in test_case.expected_result]
+    assert response.headers['etag'].startswith('"2-')
+    assert price_cache.dataset_version == 2
+    price_cache.clear()
+
+
+def test_lagging_price_cache_keys_the_responses_by_its_version(populate_db_test, dataset_version_db_test, monkeypatch):
+    # The DB version is read at every request, the price cache reads it again only after an hour
+    monkeypatch.setattr(dataset_version_cache, 'version_check_seconds', 0)
+    monkeypatch.setattr(price_cache, 'version_check_seconds', 3600)
+    monkeypatch.setattr(price_cache, 'max_bytes', 10_000_000)
+    monkeypatch.setattr(result_cache, 'backend', MemoryResultCacheBackend(max_bytes=1024 * 1024))
+    price_cache.invalidate()
+    test_case = TEST_CASES[0]
+    path = PATH.format(**vars(test_case))
+    assert client.get(path).headers['etag'].startswith('"1-')
+
+    # Loaded without notification
+    test_db_engine.execute("UPDATE stock SET open_price = 2 * open_price WHERE name = 'AA'")
+    test_db_engine.execute("UPDATE dataset_version SET version = 2 WHERE table_name = 'stock'")
+    response = client.get(path)
+
+    # The response holds the prices of the version 1 still cached
+    assert response.json() == test_case.expected_result
+    assert response.headers['etag'].startswith('"1-')
+    assert price_cache.dataset_version == 1
+    assert [key.split(':')[0] for key in result_cache.backend.entries] == ['1']
+    price_cache.invalidate()
+
+
+def test_read_main_server_timing(populate_db_test):
+    test_case = TEST_CASES[0]
+    labels = {'phase': 'query', 'metric': test_case.metric, 'window': get_window_label(test_case.rolling_window)}
+    observed_queries = REGISTRY.get_sample_value('request_phase_seconds_count', labels) or 0
+
+    response = client.get(PATH.format(**vars(test_case)))
+
+    phases = dict(entry.split(';dur=') for entry in response.headers['server-timing'].split(', '))
+    assert {'validation', 'query', 'compute', 'serialize', 'encode', 'total'} <= set(phases)
+    assert all(float(duration) >= 0 for duration in phases.values())
+    assert REGISTRY.get_sample_value('request_phase_seconds_count', labels) == observed_queries + 1
+
+
+def test_read_main_async(populate_db_test):
+    check_test_cases(TEST_CASES, path_template=ASYNC_PATH)
+
+
+def test_read_main_async_sql_engine(populate_db_test, monkeypatch):
+    monkeypatch.setattr(settings, 'METRICS_ENGINE', 'sql')
+    check_test_cases(TEST_CASES, path_template=ASYNC_PATH)
+
+
+def get_coalesced_async_requests() -> float:
+    labels = {'flight': async_stock_metrics_flight.name, 'outcome': 'coalesced'}
+    return REGISTRY.get_sample_value('single_flight_requests_total', labels) or 0
+
+
+def test_async_single_flight_outlives_the_leader_request(populate_db_test, monkeypatch):
+    monkeypatch.setattr(async_stock_metrics_flight, 'enabled', True)
+    test_case = TEST_CASES[0]
+    # Created in the event loop of the test
+    events = {}
+
+    async def get_released_stock_metric_async(db_session, **kwargs):
+        events['started'].set()
+        await events['release'].wait()
+        return await get_stock_metric_async(db_session, **kwargs)
+
+    monkeypatch.setattr(main, 'get_stock_metric_async', get_released_stock_metric_async)
+
+    def get_stock_metric_response(db_session: AsyncSession):
+        url = urlsplit(ASYNC_PATH.format(**vars(test_case)))
+        request = Request({'type': 'http', 'path': url.path, 'query_string': url.query.encode(), 'headers': []})
+        return main.get_stock_metric_response_async(
+            request,
+            test_case.price_column,
+            test_case.metric,
+            test_case.rolling_window,
+            test_case.ticker,
+            test_case.start,
+            test_case.end,
+            db_session,
+            AsyncTestingSessionLocal,
+        )
+
+    async def run():
+        events.update(started=asyncio.Event(), release=asyncio.Event())
+        leader_session, follower_session = AsyncTestingSessionLocal(), AsyncTestingSessionLocal()
+        leader = asyncio.ensure_future(get_stock_metric_response(leader_session))
+        await events['started'].wait()
+        coalesced_requests = get_coalesced_async_requests()
+        follower = asyncio.ensure_future(get_stock_metric_response(follower_session))
+        while get_coalesced_async_requests() == coalesced_requests:
+            await asyncio.sleep(0.01)
+
+        # The leader request is cancelled and its session closed while the follower waits for the computation
+        leader.cancel()
+        await leader_session.close()
+        events['release'].set()
+        response = await follower
+        # A computation reading with the closed session would reopen a transaction that nothing closes
+        leader_in_transaction = leader_session.sync_session.in_transaction()
+        await leader_session.close()
+        await follower_session.close()
+        return response, leader_in_transaction
+
+    response, leader_in_transaction = asyncio.run(run())
+
+    assert response.status_code == 200
+    assert orjson.loads(response.body) == test_case.expected_result
+    assert not leader_in_transaction
+
+
+BATCH_PATH = '/batch/stock_metrics/?price_column=high_price&start=2010-01-06&end=2010-01-17'
+
+
+def test_read_batch_matches_single_requests(populate_db_test):
+    session = next(get_db_test_session())
+    for row in TEST_INPUT:
+        session.add(Stock(**{**row, 'name': 'BB', 'high_price': row['high_price'] * 2}))
+    session.commit()
+
+    tickers, metrics, rolling_windows = ['AA', 'BB', 'ZZ'], ['max', 'mean', 'median'], [1, 3, 10]
+    query = urlencode({'tickers': tickers, 'metrics': metrics, 'rolling_windows': rolling_windows}, doseq=True)
+    path = f'{BATCH_PATH}&{query}'
+    response = client.get(path)
+
+    assert response.status_code == 200
+    batch_result = response.json()
+    assert batch_result['ZZ'] == {metric: {str(window): [] for window in rolling_windows} for metric in metrics}
+    for ticker in ['AA', 'BB']:
+        for metric in metrics:
+            for rolling_window in rolling_windows:
+                single_response = client.get(
+                    PATH.format(
+                        price_column='high_price',
+                        metric=metric,
+                        rolling_window=rolling_window,
+                        ticker=ticker,
+                        start='2010-01-06',
+                        end='2010-01-17',
+                    )
+                )
+                assert batch_result[ticker][metric][str(rolling_window)] == single_response.json()
+
+
+def test_read_batch_validation(populate_db_test):
+    assert client.get(BATCH_PATH + '&tickers=AA&metrics=max&rolling_windows=1000').status_code == 422
+    assert client.get(BATCH_PATH + '&tickers=AA&metrics=unknown&rolling_windows=10').status_code == 422
+    assert client.get(BATCH_PATH + '&metrics=max&rolling_windows=10').status_code == 422
+    assert client.get(BATCH_PATH + '&tickers=&metrics=max&rolling_windows=10').status_code == 422
+    assert client.get(BATCH_PATH + '&tickers=TOOLONG&metrics=max&rolling_windows=10').status_code == 422
+
+    too_many_tickers = ''.join(f'&tickers=T{i}' for i in range(MAX_BATCH_TICKERS + 1))
+    assert client.get(BATCH_PATH + too_many_tickers + '&metrics=max&rolling_windows=10').status_code == 422
+    too_many_windows = ''.join(f'&rolling_windows={i}' for i in range(1, MAX_BATCH_ROLLING_WINDOWS + 2))
+    assert client.get(BATCH_PATH + '&tickers=AA&metrics=max' + too_many_windows).status_code == 422
+
+
+@pytest.mark.parametrize('metric', ['all', 'max,mean'])
+def test_read_several_metrics_matches_single_requests(populate_db_test, metric):
+    path_template = PATH.replace('metric={metric}', f'metric={metric}')
+    path = path_template.format(
+        price_column='high_price', rolling_window=3, ticker='AA', start='2010-01-06', end='2010-01-17'
+    )
+    response = client.get(path)
+
+    assert response.status_code == 200
+    summary = response.json()
+    assert list(summary) == parse_metrics(metric)
+    for single_metric, records in summary.items():
+        single_response = client.get(
+            PATH.format(
+                price_column='high_price',
+                metric=single_metric,
+                rolling_window=3,
+                ticker='AA',
+                start='2010-01-06',
+                end='2010-01-17',
+            )
+        )
+        assert records == single_response.json()
+
+    assert client.get(path.replace(f'metric={metric}', 'metric=max,unknown')).status_code == 422
+
+
+def test_read_most_similar_stocks(populate_db_test):
+    session = next(get_db_test_session())
+    for row in TEST_INPUT:
+        session.add(Stock(**{**row, 'name': 'BB', 'high_price': row['high_price'] * 2 + 1}))
+        session.add(Stock(**{**row, 'name': 'CC', 'high_price': -row['high_price']}))
+    session.commit()
+    price_matrix_cache.clear()
+
+    path = '/most_similar_stocks/?ticker=AA&start=2010-01-06&end=2010-01-17&price_column=high_price&metric=mean'
+    response = client.get(path + '&rolling_window=3&top_k=2')
+
+    assert response.status_code == 200
+    assert response.json() == [
+        {'ticker': 'BB', 'correlation': 1.0, 'common_dates': 12},
+        {'ticker': 'CC', 'correlation': -1.0, 'common_dates': 12},
+    ]
+    assert client.get(path.replace('ticker=AA', 'ticker=ZZ') + '&rolling_window=3').status_code == 404
+    assert client.get(path + '&rolling_window=1000').status_code == 422
+    price_matrix_cache.clear()
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+import pytest
+from apis import settings, stock_functions
+from apis.stock_functions import get_stock_metric
+from database.utils import create_database_if_not_exists, get_db_config
+from models.stock import CompactStock, DefaultStock, get_compact_stock_subquery
+from models.stock_moments import StockMoments
+from models.stock_range_index import StockRangeIndex
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+from tests.test_utils import import_pipeline_module
+
+SCHEMA_TEST_DBS = {'default': 'test_default_schema', 'compact': 'test_compact_schema'}
+SCHEMA_TEST_TICKERS = ['AA', 'BF-B']
+SCHEMA_TEST_DAYS = 60
+
+
+def test_compact_stock_subquery_decodes_the_columns():
+    subquery = get_compact_stock_subquery(price_decimals=4)
+    sql = str(subquery.select().compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+
+    assert [column.name for column in subquery.c] == [
+        'name',
+        'date',
+        'open_price',
+        'close_price',
+        'high_price',
+        'low_price',
+        'volume',
+        'market',
+    ]
+    assert 'JOIN ticker ON ticker.id = stock.ticker_id' in sql
+    assert 'CAST(stock.close_price AS FLOAT) / 10000' in sql
+    assert "WHEN 2 THEN 'NYSE'" in sql
+
+
+def get_schema_test_df() -> pd.DataFrame:
+    """
+    Prices with at most PRICE_DECIMALS decimals, stored exactly by the compact schema
+    """
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range(start='2010-01-04', periods=SCHEMA_TEST_DAYS).strftime('%Y-%m-%d')
+    dfs = []
+    for ticker in SCHEMA_TEST_TICKERS:
+        prices = 100 + np.cumsum(rng.normal(0, 1, size=(SCHEMA_TEST_DAYS, 4)), axis=0).round(2)
+        dfs.append(
+            pd.DataFrame(
+                {
+                    'name': ticker,
+                    'date': dates,
+                    'open_price': prices[:, 0],
+                    'close_price': prices[:, 1],
+                    'high_price': prices[:, 2],
+                    'low_price': prices[:, 3],
+                    'volume': rng.integers(100, 1000, size=SCHEMA_TEST_DAYS),
+                    'market': 'NYSE',
+                }
+            )
+        )
+    return pd.concat(dfs, ignore_index=True)
+
+
+@pytest.fixture(scope='module')
+def schema_db_engines():
+    """
+    Loads the same rows with the pipeline to a DB per stock schema, with the stock_moments and stock_range_index
+    tables built from the stock table of the schema
+    """
+    populator = import_pipeline_module('pipeline.core.populator')
+    compact = import_pipeline_module('pipeline.core.compact')
+    stock = import_pipeline_module('pipeline.tables.stock')
+    stock_compact = import_pipeline_module('pipeline.tables.stock_compact')
+    stock_moments = import_pipeline_module('pipeline.tables.stock_moments')
+    stock_range_index = import_pipeline_module('pipeline.tables.stock_range_index')
+
+    df = get_schema_test_df()
+    db_engines = {}
+    for schema, db_name in SCHEMA_TEST_DBS.items():
+        create_database_if_not_exists(db_name)
+        db_engine = create_engine(get_db_config(db_name=db_name).uri)
+        if schema == 'compact':
+            ticker_dictionary = compact.TickerDictionary(db_engine)
+            pandas_df = compact.encode_compact_stock_df(df, ticker_dictionary, settings.PRICE_DECIMALS)
+            table_definition = stock_compact.stock_compact_table_definition
+            stock_source = stock_compact.get_stock_compact_source_sql(settings.PRICE_DECIMALS)
+        else:
+            pandas_df, table_definition, stock_source = df, stock.stock_table_definition, 'stock'
+        populator.PandasDfChunksPopulator(
+            table_definition=table_definition, db_engine=db_engine, pandas_dfs=[pandas_df]
+        ).populate()
+
+        levels = stock_range_index.get_range_index_levels(settings.RANGE_INDEX_MAX_WINDOW)
+        for table, query in [
+            (StockMoments.__table__, stock_moments.get_stock_moments_query(stock_source)),
+            (StockRangeIndex.__table__, stock_range_index.get_stock_range_index_query(levels, stock_source)),
+        ]:
+            table.drop(db_engine, checkfirst=True)
+            table.create(db_engine)
+            db_engine.execute(f'INSERT INTO {table.name} {query}')
+        db_engines[schema] = db_engine
+
+    yield db_engines
+
+    for db_engine in db_engines.values():
+        db_engine.execute('DROP TABLE IF EXISTS stock_range_index, stock_moments, stock, ticker, dataset_version')
+        db_engine.dispose()
+
+
+@pytest.mark.parametrize(
+    'metrics_engine,metric',
+    [
+        ('pandas', 'median'),
+        ('pandas', 'all'),
+        ('sql', 'standard_deviation'),
+        ('moments', 'mean'),
+        ('moments', 'standard_deviation'),
+        ('range_index', 'min'),
+        ('range_index', 'max'),
+    ],
+)
+@pytest.mark.parametrize('ticker', SCHEMA_TEST_TICKERS)
+def test_compact_schema_metrics_match_the_default_schema(
+    schema_db_engines, monkeypatch, metrics_engine, metric, ticker
+):
+    monkeypatch.setattr(settings, 'METRICS_ENGINE', metrics_engine)
+    results = {}
+    for schema, stock_model in [('default', DefaultStock), ('compact', CompactStock)]:
+        monkeypatch.setattr(stock_functions, 'Stock', stock_model)
+        with Session(schema_db_engines[schema]) as db_session:
+            results[schema] = get_stock_metric(
+                db_session,
+                ticker=ticker,
+                start='2010-01-15',
+                end='2010-03-15',
+                price_column='high_price',
+                metric=metric,
+                rolling_window=10,
+            )
+
+    assert results['default']
+    assert results['compact'] == results['default']
@@ -0,0 +1,77 @@
+import pytest
+from apis.pool import (
+    POOL_CHECKED_OUT,
+    POOL_IDLE,
+    POOL_OVERFLOW,
+    POOL_SATURATION,
+    InstrumentedQueuePool,
+    register_pool_metrics,
+    warm_up_pool,
+)
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, exc
+
+ENGINE_LABEL = 'test'
+
+
+class LabelledQueuePool(InstrumentedQueuePool):
+    # Not reported under the labels of the engines of the API
+    engine_label = ENGINE_LABEL
+
+
+@pytest.fixture
+def pool_gauges():
+    yield
+    for gauge in [POOL_CHECKED_OUT, POOL_IDLE, POOL_OVERFLOW, POOL_SATURATION]:
+        gauge.remove(ENGINE_LABEL)
+
+
+def get_sqlite_engine(pool_size: int, max_overflow: int):
+    return create_engine(
+        'sqlite://',
+        poolclass=LabelledQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=0.01,
+    )
+
+
+def get_sample_value(name: str) -> float:
+    return REGISTRY.get_sample_value(name, {'engine': ENGINE_LABEL})
+
+
+def test_pool_checkout_timeout_is_counted():
+    db_engine = get_sqlite_engine(pool_size=1, max_overflow=0)
+    timeouts = get_sample_value('db_pool_checkout_timeouts_total') or 0
+
+    conn = db_engine.connect()
+    with pytest.raises(exc.TimeoutError):
+        db_engine.connect()
+    conn.close()
+
+    assert get_sample_value('db_pool_checkout_timeouts_total') == timeouts + 1
+
+
+def test_pool_metrics_and_warm_up(pool_gauges):
+    db_engine = get_sqlite_engine(pool_size=2, max_overflow=2)
+    register_pool_metrics(db_engine, max_overflow=2)
+
+    # Never opens more than the pool size
+    warm_up_pool(db_engine, connections=5)
+    assert get_sample_value('db_pool_idle_connections') == 2
+    assert get_sample_value('db_pool_checked_out_connections') == 0
+
+    connections = [db_engine.connect() for _ in range(3)]
+    assert get_sample_value('db_pool_checked_out_connections') == 3
+    assert get_sample_value('db_pool_overflow_connections') == 1
+    assert get_sample_value('db_pool_saturation') == 0.75
+
+    for conn in connections:
+        conn.close()
+
+
+def test_pool_metrics_keep_the_api_engines_gauges(pool_gauges):
+    api_saturation = REGISTRY.get_sample_value('db_pool_saturation', {'engine': 'sync'})
+    register_pool_metrics(get_sqlite_engine(pool_size=1, max_overflow=0), max_overflow=0)
+
+    assert REGISTRY.get_sample_value('db_pool_saturation', {'engine': 'sync'}) == api_saturation
@@ -0,0 +1,104 @@
+import numpy as np
+from apis.price_cache import PriceCache, TickerPrices
+
+
+def get_ticker_prices(n_rows: int) -> TickerPrices:
+    return TickerPrices(
+        dates=np.arange(np.datetime64('2010-01-04'), np.datetime64('2010-01-04') + n_rows),
+        prices={'close_price': np.arange(n_rows, dtype=np.float64)},
+    )
+
+
+class FakeLoader:
+    def __init__(self) -> None:
+        self.loaded = []
+
+    def __call__(self, db_session, ticker: str) -> TickerPrices:
+        self.loaded.append(ticker)
+        return get_ticker_prices(10)
+
+
+def get_price_cache(max_bytes: int, dataset_version: list) -> PriceCache:
+    return PriceCache(
+        max_bytes=max_bytes,
+        version_check_seconds=0,
+        load_ticker_prices=FakeLoader(),
+        load_dataset_version=lambda db_session: dataset_version[0],
+    )
+
+
+def test_ticker_prices_dates_slice():
+    ticker_prices = get_ticker_prices(10)
+
+    assert ticker_prices.get_dates_slice('2010-01-05', '2010-01-07') == slice(1, 4)
+    assert ticker_prices.get_dates_slice('2009-01-01', '2010-01-04') == slice(0, 1)
+    assert ticker_prices.get_dates_slice('2011-01-01', '2011-01-02') == slice(10, 10)
+
+
+def test_price_cache_hits_and_lru_eviction():
+    entry_nbytes = get_ticker_prices(10).nbytes
+    price_cache = get_price_cache(max_bytes=2 * entry_nbytes, dataset_version=[1])
+
+    price_cache.get(None, 'AA')
+    price_cache.get(None, 'BB')
+    price_cache.get(None, 'AA')
+    # Evicts BB, the least recently used ticker
+    price_cache.get(None, 'CC')
+    price_cache.get(None, 'AA')
+    price_cache.get(None, 'BB')
+
+    assert price_cache.load_ticker_prices.loaded == ['AA', 'BB', 'CC', 'BB']
+    assert (price_cache.hits, price_cache.misses, price_cache.evictions) == (2, 4, 2)
+    assert list(price_cache.entries) == ['AA', 'BB']
+    assert price_cache.nbytes == 2 * entry_nbytes
+
+
+def test_price_cache_too_big_entry_is_not_cached():
+    price_cache = get_price_cache(max_bytes=10, dataset_version=[1])
+
+    price_cache.get(None, 'AA')
+    price_cache.get(None, 'AA')
+
+    assert price_cache.load_ticker_prices.loaded == ['AA', 'AA']
+    assert price_cache.nbytes == 0
+
+
+def test_price_cache_is_cleared_when_dataset_version_changes():
+    dataset_version = [1]
+    price_cache = get_price_cache(max_bytes=10_000, dataset_version=dataset_version)
+
+    price_cache.get(None, 'AA')
+    price_cache.get(None, 'AA')
+    dataset_version[0] = 2
+    price_cache.get(None, 'AA')
+
+    assert price_cache.load_ticker_prices.loaded == ['AA', 'AA']
+    assert price_cache.dataset_version == 2
+
+
+def test_price_cache_version_is_the_version_of_the_cached_prices():
+    dataset_version = [1]
+    price_cache = get_price_cache(max_bytes=10_000, dataset_version=dataset_version)
+    price_cache.version_check_seconds = 3600
+
+    price_cache.get(None, 'AA')
+    dataset_version[0] = 2
+
+    # The version isn't read again before version_check_seconds, the cached prices are still the version 1
+    assert price_cache.get_dataset_version(None) == 1
+    assert 'AA' in price_cache.entries
+
+
+def test_price_cache_invalidate_reads_the_version_again():
+    dataset_version = [1]
+    price_cache = get_price_cache(max_bytes=10_000, dataset_version=dataset_version)
+    price_cache.version_check_seconds = 3600
+
+    price_cache.get(None, 'AA')
+    dataset_version[0] = 2
+    price_cache.invalidate()
+
+    assert price_cache.nbytes == 0
+    assert price_cache.get_dataset_version(None) == 2
+    price_cache.get(None, 'AA')
+    assert price_cache.load_ticker_prices.loaded == ['AA', 'AA']
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+from apis.invalidation import DatasetVersionListener
+from apis.result_cache import MemoryResultCacheBackend, ResultCache, SQLiteResultCacheBackend
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryResultCacheBackend(max_bytes=10)
+    return SQLiteResultCacheBackend(max_bytes=10, path=str(tmp_path / 'result_cache.sqlite3'))
+
+
+def test_backend_evicts_least_recently_read(backend):
+    backend.set('a', b'1234')
+    backend.set('b', b'1234')
+    assert backend.get('a') == b'1234'
+    # Evicts b, the least recently read response
+    backend.set('c', b'1234')
+
+    assert backend.get('b') is None
+    assert backend.get('a') == b'1234'
+    assert backend.nbytes == 8
+
+    backend.set('too_big', b'12345678901')
+    assert backend.get('too_big') is None
+
+    backend.clear()
+    assert backend.get('a') is None
+    assert backend.nbytes == 0
+
+
+def test_result_cache_hit_ratio():
+    result_cache = ResultCache(MemoryResultCacheBackend(max_bytes=100))
+    key = ResultCache.get_key(1, 'AA', 'open_price', 'max', 10, '2010-01-04', '2010-01-06')
+
+    assert result_cache.get(key) is None
+    result_cache.set(key, b'[]')
+    assert result_cache.get(key) == b'[]'
+    assert result_cache.get_hit_ratio() == 0.5
+
+    result_cache.invalidate()
+    assert result_cache.get(key) is None
+
+
+def test_result_cache_without_dataset_version():
+    result_cache = ResultCache(MemoryResultCacheBackend(max_bytes=100))
+    key = ResultCache.get_key(None, 'AA', 'open_price', 'max', 10, '2010-01-04', '2010-01-06')
+
+    result_cache.set(key, b'[]')
+
+    assert key is None
+    assert result_cache.get(key) is None
+    assert result_cache.hits + result_cache.misses == 0
+
+
+def test_dataset_version_listener_calls_the_table_callbacks():
+    versions = []
+    listener = DatasetVersionListener(connection_kwargs={}, callbacks={'stock': [versions.append]})
+
+    listener.notify(json.dumps({'table': 'stock', 'version': 3}))
+    listener.notify(json.dumps({'table': 'stock_moments', 'version': 1}))
+
+    assert versions == [3]
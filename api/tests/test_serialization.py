@@ -0,0 +1,37 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from apis.serialization import get_stock_metric_records
+
+
+def test_get_stock_metric_records():
+    df = pd.DataFrame(
+        {
+            'date': [date(2010, 1, 4), date(2010, 1, 5), date(2010, 1, 6)],
+            'metric': [np.nan, 11.1111, 43.4367],
+        }
+    )
+
+    assert get_stock_metric_records(df) == [
+        {'date': '2010-01-04', 'metric': ''},
+        {'date': '2010-01-05', 'metric': 11.11},
+        {'date': '2010-01-06', 'metric': 43.44},
+    ]
+
+
+def test_get_stock_metric_records_datetime64_dates_and_empty():
+    df = pd.DataFrame({'date': np.array(['2010-01-04'], dtype='datetime64[D]'), 'metric': [None]})
+
+    assert get_stock_metric_records(df) == [{'date': '2010-01-04', 'metric': ''}]
+    assert get_stock_metric_records(df.iloc[:0]) == []
+
+
+def test_get_stock_metric_records_rounds_the_halfway_values_like_python():
+    metrics = [729.655, 1.005, 2.675, 0.125, -1.005]
+    df = pd.DataFrame({'date': [date(2010, 1, 4)] * len(metrics), 'metric': metrics})
+
+    records = get_stock_metric_records(df)
+
+    assert [record['metric'] for record in records] == [round(metric, 2) for metric in metrics]
+    assert [record['metric'] for record in records] == [729.65, 1.0, 2.67, 0.12, -1.0]
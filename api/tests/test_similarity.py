@@ -0,0 +1,121 @@
+import gc
+import threading
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pytest
+from apis.similarity import (
+    PriceMatrix,
+    PriceMatrixCache,
+    get_pearson_correlations,
+    get_shard_correlations,
+    get_shared_shard_correlations,
+)
+
+
+def get_shared_price_matrix(prices: np.ndarray) -> PriceMatrix:
+    shared_memory = SharedMemory(create=True, size=prices.nbytes)
+    shared_prices = np.ndarray(prices.shape, dtype=np.float64, buffer=shared_memory.buf)
+    shared_prices[:] = prices
+    return PriceMatrix(
+        tickers=np.array([f'T{i}' for i in range(prices.shape[0])]),
+        dates=np.arange(np.datetime64('2010-01-04'), np.datetime64('2010-01-04') + prices.shape[1]),
+        prices=shared_prices,
+        shared_memory=shared_memory,
+    )
+
+
+def test_pearson_correlations_skip_missing_dates():
+    target = np.array([1.0, 2.0, 3.0, np.nan, 5.0])
+    metrics = np.array(
+        [
+            [2.0, 4.0, 6.0, 100.0, 10.0],
+            [5.0, 4.0, np.nan, 2.0, 1.0],
+            [1.0, np.nan, np.nan, np.nan, 2.0],
+            [3.0, 3.0, 3.0, 3.0, 3.0],
+        ]
+    )
+
+    correlations, common_dates = get_pearson_correlations(target, metrics)
+
+    np.testing.assert_allclose(correlations[:2], [1.0, -1.0])
+    # Not enough common dates and constant series aren't scored
+    assert np.isnan(correlations[2:]).all()
+    assert common_dates.tolist() == [4, 3, 2, 4]
+
+
+def test_shard_correlations_match_per_ticker_pearson():
+    rng = np.random.default_rng(0)
+    prices = 100 + np.cumsum(rng.normal(0, 1, size=(6, 40)), axis=1)
+    prices[2, 10] = np.nan
+    price_matrix = PriceMatrix(
+        tickers=np.array(['AA', 'BB', 'CC', 'DD', 'EE', 'FF']),
+        dates=np.arange(np.datetime64('2010-01-04'), np.datetime64('2010-01-04') + 40),
+        prices=prices,
+    )
+    rolling_window, output_start = 5, 4
+    target = np.convolve(prices[0], np.ones(rolling_window) / rolling_window, mode='valid')
+
+    correlations, _ = get_shard_correlations(price_matrix.prices, target, 'mean', rolling_window, output_start)
+
+    for row in [0, 1, 3, 4, 5]:
+        metric = np.convolve(prices[row], np.ones(rolling_window) / rolling_window, mode='valid')
+        np.testing.assert_allclose(correlations[row], np.corrcoef(target, metric)[0, 1])
+    # The windows holding the missing price are skipped
+    metric = np.convolve(prices[2], np.ones(rolling_window) / rolling_window, mode='valid')
+    common = ~np.isnan(metric)
+    np.testing.assert_allclose(correlations[2], np.corrcoef(target[common], metric[common])[0, 1])
+
+
+def test_cleared_shared_matrix_is_unlinked_when_released():
+    rng = np.random.default_rng(0)
+    price_matrix_cache = PriceMatrixCache(
+        version_check_seconds=0,
+        shared=True,
+        load_price_matrix=lambda db_session, price_column, shared: get_shared_price_matrix(
+            100 + rng.normal(0, 1, size=(3, 20))
+        ),
+        get_dataset_version=lambda db_session: 1,
+    )
+    price_matrix = price_matrix_cache.get(None, 'close_price')
+    name, shape = price_matrix.shared_memory.name, price_matrix.prices.shape
+    target = price_matrix.prices[0, 4:]
+
+    # A new dataset version is loaded while a request still holds the matrix
+    price_matrix_cache.get_dataset_version = lambda db_session: 2
+    assert price_matrix_cache.get(None, 'close_price') is not price_matrix
+
+    correlations, _ = get_shared_shard_correlations(name, shape, slice(0, 3), slice(None), target, 'mean', 1, 4)
+    np.testing.assert_allclose(correlations[0], 1.0)
+
+    del price_matrix, target
+    gc.collect()
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=name)
+
+
+def test_price_matrix_is_loaded_outside_of_the_lock():
+    loading = threading.Event()
+    loaded = threading.Event()
+
+    def load_price_matrix(db_session, price_column, shared):
+        if price_column == 'close_price':
+            loading.set()
+            assert loaded.wait(5)
+        return PriceMatrix(tickers=np.array([]), dates=np.array([], dtype='datetime64[D]'), prices=np.empty((0, 0)))
+
+    price_matrix_cache = PriceMatrixCache(
+        version_check_seconds=60,
+        shared=False,
+        load_price_matrix=load_price_matrix,
+        get_dataset_version=lambda db_session: 1,
+    )
+    thread = threading.Thread(target=price_matrix_cache.get, args=(None, 'close_price'))
+    thread.start()
+    assert loading.wait(5)
+
+    # Not blocked by the loading of the close prices
+    price_matrix_cache.get(None, 'open_price')
+    loaded.set()
+    thread.join()
+    assert set(price_matrix_cache.matrices) == {'close_price', 'open_price'}
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from apis.single_flight import AsyncSingleFlight, SingleFlight
+
+
+def test_single_flight_shares_the_concurrent_computation():
+    single_flight = SingleFlight('test')
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return b'result'
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(single_flight.do, 'key', compute)
+        started.wait()
+        followers = [executor.submit(single_flight.do, 'key', compute) for _ in range(3)]
+        # Let the followers join the call before it completes
+        while single_flight.calls['key'].waiters < len(followers):
+            pass
+        release.set()
+
+        assert [future.result() for future in [leader, *followers]] == [b'result'] * 4
+    assert len(calls) == 1
+    assert single_flight.calls == {}
+
+    # Nothing is kept once the computation is done
+    single_flight.do('key', compute)
+    assert len(calls) == 2
+
+
+def test_single_flight_shares_the_error():
+    single_flight = SingleFlight('test')
+
+    def fail():
+        raise ValueError('failed')
+
+    with pytest.raises(ValueError):
+        single_flight.do('key', fail)
+    assert single_flight.calls == {}
+
+
+def test_async_single_flight_shares_the_concurrent_computation():
+    single_flight = AsyncSingleFlight('test')
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return b'result'
+
+    async def run():
+        return await asyncio.gather(*[single_flight.do('key', compute) for _ in range(5)])
+
+    assert asyncio.run(run()) == [b'result'] * 5
+    assert len(calls) == 1
+    assert single_flight.tasks == {}
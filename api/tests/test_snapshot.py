@@ -0,0 +1,69 @@
+import json
+import os
+
+import numpy as np
+from apis.price_cache import PRICE_COLUMNS
+from apis.snapshot import CURRENT_FILE, METADATA_FILE, StockSnapshot
+from apis.stock_functions import slice_window_prices
+
+
+def write_snapshot(snapshot_dir: str, name: str, tickers: dict, dataset_version: int = 1):
+    """
+    Writes a snapshot in the format of the pipeline: tickers maps each ticker name to its number of rows
+    """
+    path = os.path.join(snapshot_dir, name)
+    os.makedirs(path)
+    dates = np.concatenate([np.datetime64('2010-01-04') + np.arange(rows) for rows in tickers.values()])
+    np.save(os.path.join(path, 'date.npy'), dates)
+    for offset, column in enumerate(PRICE_COLUMNS):
+        np.save(os.path.join(path, f'{column}.npy'), np.arange(len(dates), dtype=np.float64) + offset)
+    np.save(os.path.join(path, 'tickers.npy'), np.array(list(tickers), dtype=str))
+    np.save(os.path.join(path, 'offsets.npy'), np.concatenate(([0], np.cumsum(list(tickers.values())))))
+    with open(os.path.join(path, METADATA_FILE), 'w') as f:
+        json.dump({'dataset_version': dataset_version, 'rows': len(dates), 'tickers': len(tickers)}, f)
+    with open(os.path.join(snapshot_dir, CURRENT_FILE), 'w') as f:
+        f.write(name)
+
+
+def test_snapshot_ticker_views(tmp_path):
+    write_snapshot(str(tmp_path), 'stock_v1', {'AA': 3, 'BB': 5})
+    snapshot = StockSnapshot(snapshot_dir=str(tmp_path), reload_check_seconds=0)
+
+    ticker_prices = snapshot.get('BB')
+
+    assert ticker_prices.dates[0] == np.datetime64('2010-01-04')
+    assert ticker_prices.prices['close_price'].tolist() == [4.0, 5.0, 6.0, 7.0, 8.0]
+    # Views on the memory mapped column, not copies
+    assert isinstance(ticker_prices.prices['close_price'], np.memmap)
+    assert len(snapshot.get('CC').dates) == 0
+
+
+def test_snapshot_window_prices(tmp_path):
+    write_snapshot(str(tmp_path), 'stock_v1', {'AA': 10})
+    snapshot = StockSnapshot(snapshot_dir=str(tmp_path), reload_check_seconds=0)
+
+    dates, prices = slice_window_prices(snapshot.get('AA'), '2010-01-06', '2010-01-08', 'open_price', 3)
+
+    assert dates.tolist() == np.arange(np.datetime64('2010-01-06'), np.datetime64('2010-01-09')).tolist()
+    assert prices.tolist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+
+
+def test_snapshot_reloads_new_current(tmp_path):
+    write_snapshot(str(tmp_path), 'stock_v1', {'AA': 3})
+    snapshot = StockSnapshot(snapshot_dir=str(tmp_path), reload_check_seconds=0)
+    previous = snapshot.get('AA')
+
+    write_snapshot(str(tmp_path), 'stock_v2', {'AA': 4})
+
+    assert len(snapshot.get('AA').dates) == 4
+    # The views handed out before the reload still read the previous snapshot
+    assert len(previous.dates) == 3
+
+
+def test_snapshot_dataset_version_is_the_exported_version(tmp_path):
+    write_snapshot(str(tmp_path), 'stock_v1', {'AA': 3}, dataset_version=1)
+    snapshot = StockSnapshot(snapshot_dir=str(tmp_path), reload_check_seconds=0)
+
+    assert snapshot.get_dataset_version() == 1
+    write_snapshot(str(tmp_path), 'stock_v2', {'AA': 4}, dataset_version=2)
+    assert snapshot.get_dataset_version() == 2
@@ -1,9 +1,39 @@
-from apis.stock_functions import format_to_float
+from datetime import date
 
+import numpy as np
+import pandas as pd
+import pytest
+from apis import settings
+from apis.stock_functions import (
+    Metric,
+    get_agg_from_rolling_df,
+    get_rolling_metrics,
+    get_rolling_window_start_date,
+    parse_metrics,
+)
 
-def test_format_to_float():
-    assert format_to_float('43.43') == 43.43
 
-    assert format_to_float('11.1111') == 11.11
+def test_parse_metrics():
+    assert parse_metrics('max') == ['max']
+    assert parse_metrics('max,mean,max') == ['max', 'mean']
+    assert parse_metrics('all') == Metric.keys()
 
-    assert format_to_float('anything') is None
+
+@pytest.mark.parametrize('rolling_window', [1, 2, 5, 30, 60])
+def test_get_rolling_metrics_matches_pandas(rolling_window):
+    prices = 100 + np.cumsum(np.random.default_rng(0).normal(0, 1, size=50))
+    prices[20] = np.nan
+
+    metrics = get_rolling_metrics(prices, rolling_window, Metric.keys())
+
+    for metric in Metric.keys():
+        expected = get_agg_from_rolling_df(pd.Series(prices).rolling(rolling_window), metric).to_numpy()
+        np.testing.assert_allclose(metrics[metric], expected, rtol=1e-9, atol=1e-9, equal_nan=True)
+
+
+def test_rolling_window_start_date_is_only_looked_up_for_partitioned_tables(monkeypatch):
+    monkeypatch.setattr(settings, 'PARTITION_INTERVAL', None)
+
+    # No query, the db_session isn't used
+    assert get_rolling_window_start_date(None, 'AA', '2010-01-06', rolling_window=1) == date(2010, 1, 6)
+    assert get_rolling_window_start_date(None, 'AA', '2010-01-06', rolling_window=10) is None
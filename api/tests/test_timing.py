@@ -0,0 +1,67 @@
+import time
+
+from apis.timing import (
+    RequestTiming,
+    current_timing,
+    finish_request_timing,
+    get_window_label,
+    record_phase,
+    request_timing,
+    timed_phase,
+)
+from fastapi import Response
+
+
+def test_nested_phases_are_only_counted_in_the_inner_phase():
+    with request_timing() as timing:
+        with timed_phase('query'):
+            time.sleep(0.01)
+            with timed_phase('compute'):
+                time.sleep(0.02)
+            # Measured elsewhere, eg: by the pool
+            time.sleep(0.005)
+            record_phase('db_checkout', 0.005)
+        with timed_phase('encode'):
+            pass
+
+    assert set(timing.durations) == {'query', 'compute', 'db_checkout', 'encode'}
+    assert 0.01 <= timing.durations['query'] < 0.02
+    assert timing.durations['compute'] >= 0.02
+    assert timing.durations['db_checkout'] == 0.005
+    assert current_timing.get() is None
+
+
+def test_phases_outside_of_a_request_are_ignored():
+    with timed_phase('query'):
+        record_phase('db_checkout', 1)
+    assert current_timing.get() is None
+
+
+def test_bind_records_the_phases_in_another_context():
+    timing = RequestTiming()
+
+    def compute():
+        with timed_phase('compute'):
+            return 1
+
+    assert timing.bind(compute)() == 1
+    assert set(timing.durations) == {'compute'}
+    assert current_timing.get() is None
+
+
+def test_server_timing_header():
+    timing = RequestTiming()
+    timing.add('query', 0.0125)
+    response = Response()
+
+    finish_request_timing(timing, response, metric_label='mean', rolling_window=10)
+    query, total = response.headers['server-timing'].split(', ')
+    assert query == 'query;dur=12.500'
+    assert total.startswith('total;dur=')
+
+
+def test_window_label():
+    assert get_window_label(1) == '1'
+    assert get_window_label(7) == '10'
+    assert get_window_label(100) == '100'
+    assert get_window_label(5000) == '1024'
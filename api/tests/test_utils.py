@@ -0,0 +1,18 @@
+import os
+import sys
+from types import ModuleType
+
+import pytest
+
+# The pipeline package is next to the api directory in the repository (mounted next to it by api-tests-local),
+# it isn't in the api image
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def import_pipeline_module(name: str) -> ModuleType:
+    """
+    Imports a module of the pipeline package, the test is skipped when the pipeline isn't available
+    """
+    if REPOSITORY_DIR not in sys.path:
+        sys.path.append(REPOSITORY_DIR)
+    return pytest.importorskip(name)
@@ -0,0 +1,104 @@
+"""
+Compares the latency and throughput of the sync `/stock_metrics/` route with the async `/async/stock_metrics/`
+route of a running API at a given concurrency.
+
+Usage (from the repository root, with the docker-compose api running):
+    python -m benchmarks.async_api --url http://localhost:8000 --tickers AAPL,MSFT --concurrency 200 --requests 5000
+
+Each of the --concurrency client threads sends requests back to back, picking a ticker and a rolling window at random.
+"""
+
+import argparse
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+
+ROUTES = ['/stock_metrics/', '/async/stock_metrics/']
+QUERY = 'price_column=close_price&metric={metric}&rolling_window={rolling_window}&ticker={ticker}&start={start}&end={end}'  # noqa
+
+
+def send_request(url: str) -> Tuple[float, bool]:
+    """
+    Returns the latency of the request and whether it succeeded
+    """
+    start_time = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=60) as response:
+            response.read()
+            succeeded = response.status == 200
+    except (urllib.error.URLError, OSError):
+        succeeded = False
+    return time.perf_counter() - start_time, succeeded
+
+
+def run_load(urls: List[str], concurrency: int) -> Tuple[float, np.ndarray, int]:
+    """
+    Sends all the urls with concurrency client threads.
+    Returns the wall time, the latencies of the successful requests and the number of errors.
+    """
+    results = []
+    lock = threading.Lock()
+    urls_iterator = iter(urls)
+
+    def worker():
+        while True:
+            with lock:
+                url = next(urls_iterator, None)
+            if url is None:
+                return
+            result = send_request(url)
+            with lock:
+                results.append(result)
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(worker)
+    duration = time.perf_counter() - start_time
+
+    latencies = np.array([latency for latency, succeeded in results if succeeded])
+    errors = sum(1 for _, succeeded in results if not succeeded)
+    return duration, latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--tickers', default='AA', help='comma separated tickers')
+    parser.add_argument('--metric', default='mean')
+    parser.add_argument('--start', default='2010-06-01')
+    parser.add_argument('--end', default='2011-12-30')
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    queries = [
+        QUERY.format(
+            metric=args.metric,
+            rolling_window=rng.randint(1, 100),
+            ticker=rng.choice(args.tickers.split(',')),
+            start=args.start,
+            end=args.end,
+        )
+        for _ in range(args.requests)
+    ]
+
+    print(f'{"route":<24} {"req/sec":>10} {"p50 ms":>10} {"p99 ms":>10} {"errors":>8}')
+    for route in ROUTES:
+        # Warm up the connections and caches of the route before measuring it
+        run_load([f'{args.url}{route}?{query}' for query in queries[: args.concurrency]], args.concurrency)
+        duration, latencies, errors = run_load([f'{args.url}{route}?{query}' for query in queries], args.concurrency)
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000 if len(latencies) else (float('nan'), float('nan'))
+        print(f'{route:<24} {len(latencies) / duration:>10.1f} {p50:>10.1f} {p99:>10.1f} {errors:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Compares the csv and the binary COPY of copy_pandas_df_to_table on the `stock` table.
+
+Usage (from the repository root, with the docker-compose db running):
+    POSTGRES_HOST=localhost POSTGRES_PASSWORD=postgres python -m benchmarks.copy_formats --tickers 1000 --days 500
+
+With --encode-only the DB isn't needed and only the serialization throughput is measured.
+"""
+
+import argparse
+import io
+import time
+
+from benchmarks.synthetic_data import generate_ohlcv_df
+from pipeline.core.binary_copy import copy_pandas_df_to_table_binary, encode_pandas_df_to_pg_binary
+from pipeline.core.db_utils import copy_pandas_df_to_table, create_database_if_not_exists, get_db_engine
+from pipeline.tables.stock import stock_table
+
+BENCHMARK_DB = 'benchmark'
+
+
+def time_it(function, repeat: int) -> float:
+    """
+    Returns the best wall time of repeat calls to function
+    """
+    durations = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start_time)
+    return min(durations)
+
+
+def report(name: str, rows: int, duration: float, baseline: float):
+    print(f'{name:<20} {duration:>8.3f}s {rows / duration:>14,.0f} rows/sec {baseline / duration:>6.2f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--encode-only', action='store_true')
+    args = parser.parse_args()
+
+    df = generate_ohlcv_df(n_tickers=args.tickers, n_days=args.days)
+    rows = len(df)
+    print(f'{rows:,} rows')
+
+    csv_encode = time_it(lambda: df.to_csv(io.StringIO(), sep=',', header=False, index=False), args.repeat)
+    binary_encode = time_it(lambda: encode_pandas_df_to_pg_binary(df, stock_table), args.repeat)
+    report('csv encode', rows, csv_encode, csv_encode)
+    report('binary encode', rows, binary_encode, csv_encode)
+
+    if args.encode_only:
+        return
+
+    create_database_if_not_exists(BENCHMARK_DB)
+    db_engine = get_db_engine(BENCHMARK_DB)
+
+    def recreate_table():
+        stock_table.drop(db_engine, checkfirst=True)
+        stock_table.create(db_engine)
+
+    def copy_csv():
+        recreate_table()
+        copy_pandas_df_to_table(pandas_df=df, table_name=stock_table.name, db_engine=db_engine)
+
+    def copy_binary():
+        recreate_table()
+        copy_pandas_df_to_table_binary(pandas_df=df, table=stock_table, db_engine=db_engine)
+
+    recreate_duration = time_it(recreate_table, args.repeat)
+    csv_copy = time_it(copy_csv, args.repeat) - recreate_duration
+    binary_copy = time_it(copy_binary, args.repeat) - recreate_duration
+    report('csv copy', rows, csv_copy, csv_copy)
+    report('binary copy', rows, binary_copy, csv_copy)
+
+    stock_table.drop(db_engine, checkfirst=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""
+End-to-end load test of `/stock_metrics/`: optionally seeds the `stock` table with synthetic data, starts the API
+under uvicorn with --workers worker processes and sends requests at each of the target --rps rates (open loop),
+reporting the throughput, the p50/p95/p99 latencies and the error rate of each rate to find the knee of the curve.
+
+Usage (from the repository root, against a local throwaway Postgres, eg: the docker-compose db; --seed REPLACES the
+`stock` table of the `stock_market_data` database):
+    POSTGRES_HOST=localhost POSTGRES_PASSWORD=postgres PYTHONPATH=api python -m benchmarks.load_test \\
+        --seed --tickers 500 --days 2520 --workers 4 --rps 50 100 200 400 800 --duration 30 --output load.json
+
+With --no-start-api the requests are sent to an API already running at --url. The latencies are measured from the
+time each request was scheduled at, so the requests waiting for a free client thread when the API falls behind
+count in the latency instead of lowering the sent rate.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.async_api import QUERY, send_request
+from benchmarks.synthetic_data import get_ticker_names, iter_ohlcv_dfs
+from pipeline.core.constants import STOCK_MARKET_DATA
+from pipeline.core.db_utils import create_database_if_not_exists, get_db_engine
+from pipeline.core.populator import PandasDfChunksPopulator
+from pipeline.tables.stock import stock_table_definition
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api')
+# Start date of the synthetic data
+FIRST_DATE = '2010-01-04'
+
+
+def seed_stock_table(n_tickers: int, n_days: int):
+    """
+    Replaces the stock table with n_tickers synthetic tickers of n_days rows, and records a new dataset version
+    """
+    create_database_if_not_exists(STOCK_MARKET_DATA)
+    PandasDfChunksPopulator(
+        table_definition=stock_table_definition,
+        db_engine=get_db_engine(STOCK_MARKET_DATA),
+        pandas_dfs=iter_ohlcv_dfs(n_rows=n_tickers * n_days, n_days=n_days),
+    ).populate()
+
+
+def wait_until_ready(url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f'{url}/metrics', timeout=1) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f'The API at {url} is not ready after {timeout} seconds')
+
+
+@contextmanager
+def run_api(port: int, workers: int, startup_timeout: float) -> Iterator[str]:
+    """
+    Runs the API under uvicorn with workers worker processes for the duration of the context, yields its url
+    """
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            '-m',
+            'uvicorn',
+            'apis.main:app',
+            '--host',
+            '127.0.0.1',
+            '--port',
+            str(port),
+            '--workers',
+            str(workers),
+            '--no-access-log',
+        ],
+        cwd=API_DIR,
+        env={**os.environ, 'PYTHONPATH': API_DIR},
+    )
+    url = f'http://127.0.0.1:{port}'
+    try:
+        wait_until_ready(url, startup_timeout)
+        yield url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def get_queries(
+    n_queries: int,
+    tickers: List[str],
+    metrics: List[str],
+    windows: List[int],
+    spans: List[int],
+    n_days: int,
+    seed: int,
+) -> List[str]:
+    """
+    Random mix of the tickers, metrics, rolling windows and date ranges of spans business days within the
+    n_days days of the synthetic data
+    """
+    rng = random.Random(seed)
+    dates = pd.bdate_range(start=FIRST_DATE, periods=n_days).strftime('%Y-%m-%d')
+    queries = []
+    for _ in range(n_queries):
+        span = min(rng.choice(spans), n_days)
+        first_day = rng.randrange(n_days - span + 1)
+        queries.append(
+            QUERY.format(
+                metric=rng.choice(metrics),
+                rolling_window=rng.choice(windows),
+                ticker=rng.choice(tickers),
+                start=dates[first_day],
+                end=dates[first_day + span - 1],
+            )
+        )
+    return queries
+
+
+def run_at_rate(urls: List[str], rps: float, max_concurrency: int) -> Dict[str, Any]:
+    """
+    Sends the urls at rps requests per second whatever the response times (open loop), with at most
+    max_concurrency requests in flight. Returns the throughput, latencies percentiles and error rate.
+    """
+    results = []
+    lock = threading.Lock()
+
+    def send(url: str, scheduled_time: float):
+        _, succeeded = send_request(url)
+        latency = time.perf_counter() - scheduled_time
+        with lock:
+            results.append((latency, succeeded))
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        for i, url in enumerate(urls):
+            scheduled_time = start_time + i / rps
+            delay = scheduled_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, url, scheduled_time)
+    duration = time.perf_counter() - start_time
+
+    latencies = np.array([latency for latency, succeeded in results if succeeded])
+    errors = sum(1 for _, succeeded in results if not succeeded)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000 if len(latencies) else [float('nan')] * 3
+    return {
+        'target_rps': rps,
+        'requests': len(results),
+        'throughput_rps': len(latencies) / duration,
+        'p50_ms': p50,
+        'p95_ms': p95,
+        'p99_ms': p99,
+        'error_rate': errors / len(results) if results else 0.0,
+    }
+
+
+def run_load_test(url: str, args: argparse.Namespace, queries: List[str]) -> List[Dict[str, Any]]:
+    # Warm up the connections pools and the caches of the workers
+    warm_up_urls = [f'{url}/stock_metrics/?{query}' for query in queries[: args.max_concurrency]]
+    run_at_rate(warm_up_urls, rps=50, max_concurrency=args.max_concurrency)
+
+    reports = []
+    print(f'{"target rps":>10} {"rps":>10} {"p50 ms":>10} {"p95 ms":>10} {"p99 ms":>10} {"errors %":>9}')
+    for rps in args.rps:
+        n_requests = int(rps * args.duration)
+        urls = [f'{url}/stock_metrics/?{queries[i % len(queries)]}' for i in range(n_requests)]
+        report = run_at_rate(urls, rps, args.max_concurrency)
+        reports.append(report)
+        print(
+            f'{rps:>10.0f} {report["throughput_rps"]:>10.1f} {report["p50_ms"]:>10.1f} {report["p95_ms"]:>10.1f} '
+            f'{report["p99_ms"]:>10.1f} {report["error_rate"] * 100:>9.2f}'
+        )
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', action='store_true', help='replace the stock table with synthetic data')
+    parser.add_argument('--tickers', type=int, default=500, help='number of synthetic tickers')
+    parser.add_argument('--days', type=int, default=2520, help='number of business days of each synthetic ticker')
+    parser.add_argument('--start-api', action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn worker processes')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--startup-timeout', type=float, default=60)
+    parser.add_argument('--url', default='http://localhost:8000', help='API url when not started by the load test')
+    parser.add_argument('--rps', type=float, nargs='+', default=[25, 50, 100, 200, 400])
+    parser.add_argument('--duration', type=float, default=20, help='seconds at each rate')
+    parser.add_argument('--max-concurrency', type=int, default=256, help='maximum number of requests in flight')
+    parser.add_argument('--metrics', nargs='+', default=['mean', 'median', 'standard_deviation', 'min', 'max'])
+    parser.add_argument('--windows', type=int, nargs='+', default=[5, 20, 50, 100])
+    parser.add_argument('--spans', type=int, nargs='+', default=[21, 63, 252], help='date ranges in business days')
+    parser.add_argument('--distinct-queries', type=int, default=10_000)
+    parser.add_argument('--random-seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON report file')
+    args = parser.parse_args()
+
+    if args.seed:
+        seed_stock_table(args.tickers, args.days)
+
+    queries = get_queries(
+        n_queries=args.distinct_queries,
+        tickers=get_ticker_names(args.tickers),
+        metrics=args.metrics,
+        windows=args.windows,
+        spans=args.spans,
+        n_days=args.days,
+        seed=args.random_seed,
+    )
+
+    if args.start_api:
+        with run_api(args.port, args.workers, args.startup_timeout) as url:
+            reports = run_load_test(url, args, queries)
+    else:
+        reports = run_load_test(args.url, args, queries)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(
+                {
+                    'workers': args.workers if args.start_api else None,
+                    'tickers': args.tickers,
+                    'days': args.days,
+                    'rates': reports,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == '__main__':
+    main()
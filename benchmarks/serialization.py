@@ -0,0 +1,84 @@
+"""
+Compares the per-request CPU time of the /stock_metrics/ response serialization: the former per-row
+format_to_float + to_dict('records') + jsonable_encoder path and the vectorized records encoded with orjson.
+
+Usage (from the repository root, the api directory on the path for the API modules, no DB needed):
+    PYTHONPATH=api python -m benchmarks.serialization --rows 500 2500 10000
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+import orjson
+import pandas as pd
+from apis.serialization import get_stock_metric_records
+from fastapi.encoders import jsonable_encoder
+
+
+def format_to_float(input: str):
+    # Per-row rounding of the former response serialization
+    try:
+        return round(float(input), 2)
+    except ValueError:
+        return None
+
+
+def serialize_legacy(df: pd.DataFrame) -> bytes:
+    df = df.copy()
+    df['metric'] = df['metric'].fillna('').apply(format_to_float)
+    df = df.fillna('')
+    return json.dumps(jsonable_encoder(df[['date', 'metric']].to_dict('records'))).encode()
+
+
+def serialize_vectorized(df: pd.DataFrame) -> bytes:
+    return orjson.dumps(get_stock_metric_records(df))
+
+
+def get_metric_df(rows: int) -> pd.DataFrame:
+    metric = np.random.default_rng(0).uniform(5, 500, size=rows)
+    # Not enough rows for a complete rolling window at the beginning
+    metric[:10] = np.nan
+    # Halfway between two cents, rounded down by Python's round and up by np.round
+    metric[10:12] = [729.655, 1.005]
+    return pd.DataFrame(
+        {
+            'date': pd.bdate_range(start='2010-01-04', periods=rows).date,
+            'metric': metric,
+        }
+    )
+
+
+def time_it(function, repeat: int) -> float:
+    """
+    Returns the best process CPU time of repeat calls to function
+    """
+    durations = []
+    for _ in range(repeat):
+        start_time = time.process_time()
+        function()
+        durations.append(time.process_time() - start_time)
+    return min(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[500, 2500, 10000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        df = get_metric_df(rows)
+        assert json.loads(serialize_legacy(df)) == json.loads(serialize_vectorized(df))
+
+        legacy = time_it(lambda: serialize_legacy(df), args.repeat)
+        vectorized = time_it(lambda: serialize_vectorized(df), args.repeat)
+        print(
+            f'{rows:>8,} rows  legacy {legacy * 1000:>8.2f}ms  vectorized {vectorized * 1000:>8.2f}ms  '
+            f'{legacy / vectorized:>6.1f}x'
+        )
+
+
+if __name__ == '__main__':
+    main()
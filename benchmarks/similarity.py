@@ -0,0 +1,117 @@
+"""
+Latency of `/most_similar_stocks/` (correlating the rolling metric of a ticker with the one of every ticker) on a
+synthetic price matrix, in process and sharded across --workers processes, against the --target-seconds latency.
+
+Usage (from the repository root, the api directory on the path for the API modules, no DB needed):
+    PYTHONPATH=api python -m benchmarks.similarity --tickers 500 5000 --workers 0 4 --requests 50 --output sim.json
+
+The price matrix is built once per number of tickers (not timed, like the cached matrix of the API) and each
+request picks a ticker, a metric, a rolling window and a date range of --span business days at random.
+"""
+
+import argparse
+import json
+import random
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+from apis import settings, similarity
+from apis.similarity import PriceMatrix, PriceMatrixCache, get_most_similar_stocks, get_price_matrix
+
+from benchmarks.synthetic_data import generate_ohlcv_df, get_ticker_names
+
+FIRST_DATE = '2010-01-04'
+
+
+def get_synthetic_price_matrix(n_tickers: int, n_days: int, shared: bool) -> PriceMatrix:
+    df = generate_ohlcv_df(n_tickers=n_tickers, n_days=n_days, start_date=FIRST_DATE)
+    return get_price_matrix(df[['name', 'date', 'close_price']], 'close_price', shared)
+
+
+def run_requests(args: argparse.Namespace, n_tickers: int, workers: int) -> Dict[str, Any]:
+    settings.SIMILARITY_WORKERS = workers
+    price_matrix = get_synthetic_price_matrix(n_tickers, args.days, shared=workers > 0)
+    # The requests are served from this matrix, without querying the DB
+    similarity.price_matrix_cache = PriceMatrixCache(
+        version_check_seconds=float('inf'),
+        shared=workers > 0,
+        load_price_matrix=lambda db_session, price_column, shared: price_matrix,
+        get_dataset_version=lambda db_session: None,
+    )
+
+    rng = random.Random(args.random_seed)
+    tickers = get_ticker_names(n_tickers)
+    dates = pd.bdate_range(start=FIRST_DATE, periods=args.days).strftime('%Y-%m-%d')
+    span = min(args.span, args.days)
+
+    def send_request():
+        first_day = rng.randrange(args.days - span + 1)
+        get_most_similar_stocks(
+            None,
+            ticker=rng.choice(tickers),
+            start=dates[first_day],
+            end=dates[first_day + span - 1],
+            price_column='close_price',
+            metric=rng.choice(args.metrics),
+            rolling_window=rng.choice(args.windows),
+            top_k=10,
+        )
+
+    try:
+        # Starts the worker processes
+        send_request()
+        latencies = []
+        for _ in range(args.requests):
+            start_time = time.perf_counter()
+            send_request()
+            latencies.append(time.perf_counter() - start_time)
+    finally:
+        similarity.shutdown_similarity_workers()
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        'tickers': n_tickers,
+        'days': args.days,
+        'workers': workers,
+        'requests': args.requests,
+        'p50_ms': p50,
+        'p95_ms': p95,
+        'p99_ms': p99,
+        'within_target': bool(p99 / 1000 <= args.target_seconds),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, nargs='+', default=[500, 2000, 5000])
+    parser.add_argument('--days', type=int, default=2520, help='number of business days of each synthetic ticker')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 4], help='0 computes in the API process')
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--metrics', nargs='+', default=['mean', 'standard_deviation', 'max'])
+    parser.add_argument('--windows', type=int, nargs='+', default=[5, 20, 50, 100])
+    parser.add_argument('--span', type=int, default=252, help='date range of the requests in business days')
+    parser.add_argument('--target-seconds', type=float, default=1.0, help='p99 latency target')
+    parser.add_argument('--random-seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON report file')
+    args = parser.parse_args()
+
+    reports: List[Dict[str, Any]] = []
+    print(f'{"tickers":>8} {"workers":>8} {"p50 ms":>10} {"p95 ms":>10} {"p99 ms":>10}  target')
+    for n_tickers in args.tickers:
+        for workers in args.workers:
+            report = run_requests(args, n_tickers, workers)
+            reports.append(report)
+            print(
+                f'{n_tickers:>8} {workers:>8} {report["p50_ms"]:>10.1f} {report["p95_ms"]:>10.1f} '
+                f'{report["p99_ms"]:>10.1f}  {"ok" if report["within_target"] else "MISSED"}'
+            )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'target_seconds': args.target_seconds, 'results': reports}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+"""
+Micro-benchmarks of the metric and ingestion hot paths on synthetic OHLCV data. The results are written as JSON
+(with the commit, the machine and the library versions) so that two runs can be compared.
+
+Usage (from the repository root, the api directory on the path for the API modules, no DB needed):
+    PYTHONPATH=api python -m benchmarks.suite --output benchmark-results.json
+
+Compare with the results of a previous commit, exits with 1 if a benchmark is more than --max-slowdown slower:
+    PYTHONPATH=api python -m benchmarks.suite --output new.json --compare benchmark-results.json --max-slowdown 1.2
+
+The copies to Postgres (`benchmark` database) only run with --db, with the docker-compose db running:
+    POSTGRES_HOST=localhost POSTGRES_PASSWORD=postgres PYTHONPATH=api python -m benchmarks.suite --db --output db.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from apis.serialization import get_stock_metric_records
+from apis.stock_functions import Metric, get_agg_from_rolling_df, get_rolling_metrics
+
+from benchmarks.synthetic_data import DEFAULT_DAYS, generate_ohlcv_df, write_ohlcv_csv
+from pipeline.core.db_utils import (
+    copy_csv_to_table,
+    copy_pandas_df_to_table,
+    create_database_if_not_exists,
+    get_db_engine,
+)
+from pipeline.core.load_data import get_pd_dataframe_with_dates_columns_formated
+from pipeline.tables.stock import stock_table
+
+BENCHMARK_DB = 'benchmark'
+RESULTS_FORMAT_VERSION = 1
+
+
+@dataclass
+class Benchmark:
+    """
+    function is timed repeat times, setup (eg: recreating a table) runs before each call and isn't timed
+    """
+
+    name: str
+    rows: int
+    function: Callable[[], Any]
+    setup: Optional[Callable[[], Any]] = None
+
+
+def run_benchmark(benchmark: Benchmark, repeat: int) -> Dict[str, Any]:
+    durations = []
+    for _ in range(repeat):
+        if benchmark.setup is not None:
+            benchmark.setup()
+        start_time = time.perf_counter()
+        benchmark.function()
+        durations.append(time.perf_counter() - start_time)
+
+    return {
+        'name': benchmark.name,
+        'rows': benchmark.rows,
+        'repeat': repeat,
+        'min_seconds': min(durations),
+        'median_seconds': statistics.median(durations),
+        'mean_seconds': statistics.mean(durations),
+        'stdev_seconds': statistics.stdev(durations) if repeat > 1 else 0.0,
+        'rows_per_second': benchmark.rows / min(durations) if min(durations) else None,
+    }
+
+
+def get_price_df(rows: int) -> pd.DataFrame:
+    """
+    Dates and close prices of rows consecutive rows, made of several tickers above DEFAULT_DAYS rows since the
+    business days dates can't go past 2262
+    """
+    n_tickers = -(-rows // DEFAULT_DAYS)
+    return generate_ohlcv_df(n_tickers=n_tickers, n_days=min(rows, DEFAULT_DAYS))[['date', 'close_price']].head(rows)
+
+
+def get_metric_benchmarks(rows_list: List[int], windows: List[int]) -> List[Benchmark]:
+    """
+    The rolling metrics of get_agg_from_rolling_df (pandas engine) and get_rolling_metrics (several metrics),
+    and the records post-processing of get_stock_metric, per number of rows
+    """
+    benchmarks = []
+    for rows in rows_list:
+        price_df = get_price_df(rows)
+        prices = price_df['close_price'].to_numpy()
+        series = pd.Series(prices)
+        for window in windows:
+            for metric in Metric.keys():
+                benchmarks.append(
+                    Benchmark(
+                        name=f'rolling_agg/{metric}/window={window}/rows={rows}',
+                        rows=rows,
+                        function=lambda series=series, window=window, metric=metric: get_agg_from_rolling_df(
+                            series.rolling(window), metric
+                        ),
+                    )
+                )
+            benchmarks.append(
+                Benchmark(
+                    name=f'rolling_metrics/all/window={window}/rows={rows}',
+                    rows=rows,
+                    function=lambda prices=prices, window=window: get_rolling_metrics(prices, window, Metric.keys()),
+                )
+            )
+
+        metric_df = pd.DataFrame(
+            {
+                'date': pd.to_datetime(price_df['date']).dt.date.to_numpy(),
+                'metric': get_agg_from_rolling_df(series.rolling(windows[0]), Metric.MEAN.value).to_numpy(),
+            }
+        )
+        benchmarks.append(
+            Benchmark(
+                name=f'stock_metric_records/rows={rows}',
+                rows=rows,
+                function=lambda metric_df=metric_df: get_stock_metric_records(metric_df),
+            )
+        )
+    return benchmarks
+
+
+def get_ingestion_benchmarks(rows: int, tmp_dir: str, db: bool) -> List[Benchmark]:
+    """
+    The csv reading and date formatting of the pipeline, and with db the copies of a dataframe and of a csv file
+    to the stock table
+    """
+    csv_path = os.path.join(tmp_dir, 'stocks.csv')
+    write_ohlcv_csv(csv_path, rows)
+    benchmarks = [
+        Benchmark(
+            name=f'format_dates_csv/rows={rows}',
+            rows=rows,
+            # The absolute path isn't joined to the pipeline data directory
+            function=lambda: get_pd_dataframe_with_dates_columns_formated([csv_path]),
+        )
+    ]
+    if not db:
+        return benchmarks
+
+    create_database_if_not_exists(BENCHMARK_DB)
+    db_engine = get_db_engine(BENCHMARK_DB)
+    pandas_df = get_pd_dataframe_with_dates_columns_formated([csv_path])
+    headerless_csv_path = os.path.join(tmp_dir, 'stocks-headerless.csv')
+    pandas_df.to_csv(headerless_csv_path, header=False, index=False)
+
+    def recreate_table():
+        stock_table.drop(db_engine, checkfirst=True)
+        stock_table.create(db_engine)
+
+    return benchmarks + [
+        Benchmark(
+            name=f'copy_pandas_df_to_table/rows={rows}',
+            rows=rows,
+            function=lambda: copy_pandas_df_to_table(pandas_df, stock_table.name, db_engine),
+            setup=recreate_table,
+        ),
+        Benchmark(
+            name=f'copy_csv_to_table/rows={rows}',
+            rows=rows,
+            function=lambda: copy_csv_to_table(headerless_csv_path, stock_table.name, db_engine),
+            setup=recreate_table,
+        ),
+    ]
+
+
+def get_environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.utcnow().isoformat(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+
+
+def compare_results(results: List[Dict[str, Any]], baseline_path: str, max_slowdown: float) -> List[str]:
+    """
+    Prints the ratio of the min durations with the baseline results, returns the names of the benchmarks
+    slower than max_slowdown times the baseline
+    """
+    with open(baseline_path) as f:
+        baseline = {result['name']: result for result in json.load(f)['results']}
+
+    regressions = []
+    for result in results:
+        if result['name'] not in baseline:
+            continue
+        ratio = result['min_seconds'] / baseline[result['name']]['min_seconds']
+        flag = ' REGRESSION' if ratio > max_slowdown else ''
+        print(f'{result["name"]:<55} {ratio:>6.2f}x baseline{flag}')
+        if ratio > max_slowdown:
+            regressions.append(result['name'])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[2_500, 100_000, 1_000_000])
+    parser.add_argument('--windows', type=int, nargs='+', default=[10, 50, 100])
+    parser.add_argument('--ingestion-rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--db', action='store_true', help='also run the copies to Postgres')
+    parser.add_argument('--filter', default='', help='only run the benchmarks whose name contains it')
+    parser.add_argument('--output', help='JSON results file')
+    parser.add_argument('--compare', help='JSON results file of a previous run')
+    parser.add_argument('--max-slowdown', type=float, default=1.2)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        benchmarks = get_metric_benchmarks(args.rows, args.windows) + get_ingestion_benchmarks(
+            args.ingestion_rows, tmp_dir, args.db
+        )
+        for benchmark in benchmarks:
+            if args.filter not in benchmark.name:
+                continue
+            result = run_benchmark(benchmark, args.repeat)
+            results.append(result)
+            print(
+                f'{result["name"]:<55} {result["min_seconds"] * 1000:>10.2f}ms '
+                f'{result["rows_per_second"] or 0:>14,.0f} rows/s'
+            )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(
+                {'format_version': RESULTS_FORMAT_VERSION, 'environment': get_environment(), 'results': results},
+                f,
+                indent=2,
+            )
+
+    if args.compare and compare_results(results, args.compare, args.max_slowdown):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Synthetic OHLCV data with the `stock` table columns.
+
+Usage (from the repository root), writes a csv file of about --rows rows in chunks of tickers, up to 100M+ rows
+with a bounded memory:
+    python -m benchmarks.synthetic_data --rows 100000000 --output /tmp/stocks-synthetic.csv
+"""
+
+import argparse
+import math
+from typing import Iterator, List
+
+import numpy as np
+import pandas as pd
+
+MARKETS = ['NYSE', 'NASDAQ']
+# About 10 years of business days
+DEFAULT_DAYS = 2520
+# Distinct 4 letters names
+MAX_TICKERS = 26**4
+
+
+def get_ticker_names(n_tickers: int, first_ticker: int = 0) -> List[str]:
+    """
+    Returns n_tickers distinct 4 letters names (AAAA, AAAB, ...) starting from the first_ticker-th name
+    """
+    letters = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+    indexes = np.arange(first_ticker, first_ticker + n_tickers)
+    digits = [letters[(indexes // 26**power) % 26] for power in reversed(range(4))]
+    return [''.join(chars) for chars in zip(*digits)]
+
+
+def generate_ohlcv_df(
+    n_tickers: int, n_days: int, seed: int = 0, start_date: str = '2010-01-04', first_ticker: int = 0
+) -> pd.DataFrame:
+    """
+    Generates n_tickers * n_days rows of random walk OHLCV data with the `stock` table columns,
+    sorted by (name, date) and with business days dates as ISO strings. The tickers are named from the
+    first_ticker-th name.
+    """
+    rng = np.random.default_rng(seed)
+    n_rows = n_tickers * n_days
+
+    dates = pd.bdate_range(start=start_date, periods=n_days).strftime('%Y-%m-%d').to_numpy()
+    returns = rng.normal(0, 0.02, size=(n_tickers, n_days))
+    close_price = (rng.uniform(5, 500, size=(n_tickers, 1)) * np.exp(np.cumsum(returns, axis=1))).ravel()
+    open_price = close_price * (1 + rng.normal(0, 0.005, size=n_rows))
+    spread = np.abs(rng.normal(0, 0.01, size=n_rows))
+
+    return pd.DataFrame(
+        {
+            'name': np.repeat(get_ticker_names(n_tickers, first_ticker), n_days),
+            'date': np.tile(dates, n_tickers),
+            'open_price': open_price.round(4),
+            'close_price': close_price.round(4),
+            'high_price': (np.maximum(open_price, close_price) * (1 + spread)).round(4),
+            'low_price': (np.minimum(open_price, close_price) * (1 - spread)).round(4),
+            'volume': rng.integers(1_000, 10_000_000, size=n_rows),
+            'market': np.repeat(rng.choice(MARKETS, size=n_tickers), n_days),
+        }
+    )
+
+
+def iter_ohlcv_dfs(n_rows: int, n_days: int = DEFAULT_DAYS, chunk_rows: int = 1_000_000) -> Iterator[pd.DataFrame]:
+    """
+    Generates about n_rows rows (whole tickers of n_days rows) in chunks of about chunk_rows rows, only one chunk
+    is held in memory at a time
+    """
+    n_days = min(n_days, n_rows)
+    n_tickers = math.ceil(n_rows / n_days)
+    if n_tickers > MAX_TICKERS:
+        raise ValueError(f'{n_rows} rows need more than {MAX_TICKERS} tickers of {n_days} days, increase the days')
+
+    chunk_tickers = max(chunk_rows // n_days, 1)
+    for chunk, first_ticker in enumerate(range(0, n_tickers, chunk_tickers)):
+        yield generate_ohlcv_df(
+            n_tickers=min(chunk_tickers, n_tickers - first_ticker),
+            n_days=n_days,
+            seed=chunk,
+            first_ticker=first_ticker,
+        )
+
+
+def write_ohlcv_csv(path: str, n_rows: int, n_days: int = DEFAULT_DAYS, header: bool = True) -> int:
+    """
+    Writes about n_rows rows to the csv file at path chunk by chunk, returns the number of written rows
+    """
+    written_rows = 0
+    with open(path, 'w') as f:
+        for chunk_df in iter_ohlcv_dfs(n_rows, n_days):
+            chunk_df.to_csv(f, header=header and written_rows == 0, index=False)
+            written_rows += len(chunk_df)
+    return written_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, required=True)
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS)
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args()
+
+    written_rows = write_ohlcv_csv(args.output, args.rows, args.days)
+    print(f'Wrote {written_rows:,} rows to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""
+Upload pandas dataframes with `COPY ... (FORMAT binary)`.
+
+The columns are encoded from their NumPy arrays directly to the Postgres binary copy format
+(ref: https://www.postgresql.org/docs/14/sql-copy.html#id-1.9.3.55.9.4) in vectorized batches,
+so Postgres doesn't have to parse floats and dates back from text.
+"""
+
+import io
+import logging
+import struct
+import time
+from enum import Enum
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Table
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import sqltypes
+
+from pipeline.core.db_utils import ChunkStage, no_chunk_stage
+
+logger = logging.getLogger(__name__)
+
+
+PG_COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)  # signature, flags, header extension
+PG_COPY_BINARY_TRAILER = struct.pack('!h', -1)
+POSTGRES_EPOCH_DATE = np.datetime64('2000-01-01', 'D')
+
+# Variable length columns (text, enum) are encoded as utf-8 bytes
+VARIABLE_LENGTH = 'variable'
+DATE = '>i4 date'
+
+
+class CopyFormat(Enum):
+    CSV = 'csv'
+    BINARY = 'binary'
+
+
+def get_pg_binary_dtype(column_type: sqltypes.TypeEngine) -> Optional[str]:
+    """
+    Returns the big-endian numpy dtype used to encode column_type, VARIABLE_LENGTH for text columns,
+    DATE for date columns and None if the type isn't supported.
+    """
+    # Order matters since BigInteger and SmallInteger inherit from Integer and Float inherits from Numeric
+    if isinstance(column_type, sqltypes.REAL):
+        return '>f4'
+    if isinstance(column_type, sqltypes.Float):
+        return '>f4' if column_type.precision and column_type.precision <= 24 else '>f8'
+    if isinstance(column_type, sqltypes.BigInteger):
+        return '>i8'
+    if isinstance(column_type, sqltypes.SmallInteger):
+        return '>i2'
+    if isinstance(column_type, sqltypes.Integer):
+        return '>i4'
+    if isinstance(column_type, sqltypes.Date):
+        return DATE
+    if isinstance(column_type, sqltypes.String):  # Text and Enum (enum_recv expects the label)
+        return VARIABLE_LENGTH
+    return None
+
+
+def supports_binary_copy(table: Table) -> bool:
+    return all(get_pg_binary_dtype(column.type) is not None for column in table.columns)
+
+
+def _scatter_fixed_width(buffer: np.ndarray, positions: np.ndarray, values: np.ndarray):
+    """
+    Writes the bytes of each values[i] at buffer[positions[i]:]
+    """
+    width = values.dtype.itemsize
+    buffer[positions[:, None] + np.arange(width)] = values.view(np.uint8).reshape(-1, width)
+
+
+def _scatter_variable_width(buffer: np.ndarray, positions: np.ndarray, data: np.ndarray, lengths: np.ndarray):
+    """
+    Writes the concatenated data, made of pieces of the given lengths, with piece i at buffer[positions[i]:]
+    """
+    pieces_starts = np.cumsum(lengths) - lengths
+    buffer[np.repeat(positions - pieces_starts, lengths) + np.arange(len(data))] = data
+
+
+def check_integer_bounds(column_name: str, values: np.ndarray, pg_dtype: str):
+    """
+    Raises a ValueError if values don't fit the integer pg_dtype, the cast would wrap them around
+    """
+    dtype = np.dtype(pg_dtype)
+    if dtype.kind != 'i' or not len(values):
+        return
+    bounds = np.iinfo(dtype)
+    if values.min() < bounds.min or values.max() > bounds.max:
+        raise ValueError(f'{column_name} values overflow the {dtype.itemsize * 8} bits integer column')
+
+
+def encode_pandas_df_to_pg_binary(pandas_df: pd.DataFrame, table: Table) -> bytes:
+    """
+    Encodes the rows of pandas_df as binary copy tuples of table (without header and trailer).
+    The dataframe columns should be in the same order as the table columns, missing values are encoded as NULL.
+    """
+    n_rows = len(pandas_df)
+    fields = []  # (is_variable_length, lengths, null_mask, encoded values) per column
+
+    for i, column in enumerate(table.columns):
+        pg_dtype = get_pg_binary_dtype(column.type)
+        if pg_dtype is None:
+            raise ValueError(f'Column {column.name} of type {column.type} is not supported by the binary copy')
+
+        series = pandas_df.iloc[:, i]
+        null_mask = series.isna().to_numpy()
+
+        if pg_dtype == VARIABLE_LENGTH:
+            # Only the distinct values (tickers, markets) are encoded, then their bytes are gathered for each row
+            codes, uniques = pd.factorize(series[~null_mask])
+            encoded = [str(value).encode('utf-8') for value in uniques]
+            uniques_lengths = np.array([len(value) for value in encoded], dtype=np.int64)
+            uniques_starts = np.cumsum(uniques_lengths) - uniques_lengths
+            rows_lengths = uniques_lengths[codes]
+            rows_starts = np.cumsum(rows_lengths) - rows_lengths
+            uniques_bytes = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+            values = uniques_bytes[
+                np.repeat(uniques_starts[codes] - rows_starts, rows_lengths) + np.arange(rows_lengths.sum())
+            ]
+            lengths = np.zeros(n_rows, dtype=np.int64)
+            lengths[~null_mask] = rows_lengths
+        else:
+            if pg_dtype == DATE:
+                days = pd.to_datetime(series[~null_mask]).to_numpy().astype('datetime64[D]') - POSTGRES_EPOCH_DATE
+                values = days.astype('>i4')
+            else:
+                values = series[~null_mask].to_numpy()
+                check_integer_bounds(column.name, values, pg_dtype)
+                values = values.astype(pg_dtype)
+            lengths = np.where(null_mask, 0, values.dtype.itemsize)
+
+        fields.append((pg_dtype == VARIABLE_LENGTH, lengths, null_mask, values))
+
+    row_sizes = 2 + sum(4 + lengths for _, lengths, _, _ in fields)
+    rows_ends = np.cumsum(row_sizes)
+    buffer = np.empty(rows_ends[-1] if n_rows else 0, dtype=np.uint8)
+    positions = rows_ends - row_sizes
+
+    _scatter_fixed_width(buffer, positions, np.full(n_rows, len(fields), dtype='>i2'))
+    positions = positions + 2
+
+    for is_variable_length, lengths, null_mask, values in fields:
+        _scatter_fixed_width(buffer, positions, np.where(null_mask, -1, lengths).astype('>i4'))
+        positions = positions + 4
+        if is_variable_length:
+            _scatter_variable_width(buffer, positions[~null_mask], values, lengths[~null_mask])
+        else:
+            _scatter_fixed_width(buffer, positions[~null_mask], values)
+        positions = positions + lengths
+
+    return buffer.tobytes()
+
+
+class BytesIteratorReader(io.RawIOBase):
+    """
+    File-like object reading from an iterator of bytes, used to stream a COPY without building it in memory
+    """
+
+    def __init__(self, chunks: Iterator[bytes]) -> None:
+        self.chunks = chunks
+        self.chunk = memoryview(b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        parts = []
+        remaining = size
+        while remaining != 0:
+            if not self.chunk:
+                chunk = next(self.chunks, None)
+                if chunk is None:
+                    break
+                self.chunk = memoryview(chunk)
+            part = self.chunk if remaining < 0 else self.chunk[:remaining]
+            self.chunk = self.chunk[len(part) :]  # noqa: E203
+            parts.append(part)
+            if remaining > 0:
+                remaining -= len(part)
+        return b''.join(parts)
+
+
+def iter_pandas_df_batches(pandas_df: pd.DataFrame, batch_size: int) -> Iterator[pd.DataFrame]:
+    for batch_start in range(0, len(pandas_df), batch_size):
+        yield pandas_df.iloc[batch_start : batch_start + batch_size]  # noqa: E203
+
+
+def copy_pandas_dfs_to_table_binary(
+    pandas_dfs: Iterable[pd.DataFrame],
+    table: Table,
+    db_engine: Engine,
+    batch_size: int = 100_000,
+    chunk_stage: ChunkStage = no_chunk_stage,
+) -> int:
+    """
+    Use SQL binary COPY to upload an iterable of pandas dataframes to a postgres db table in a single COPY.
+    Each dataframe is encoded in batches of batch_size rows, the batches of a dataframe are encoded before being
+    sent so that chunk_stage times its encoding and not the reads of the COPY.
+
+    Returns:
+        - Number of uploaded rows
+    """
+    total_rows = 0
+
+    def iter_binary_chunks() -> Iterator[bytes]:
+        nonlocal total_rows
+        yield PG_COPY_BINARY_HEADER
+        for chunk_number, pandas_df in enumerate(pandas_dfs):
+            with chunk_stage(chunk_number, pandas_df):
+                batches = [
+                    encode_pandas_df_to_pg_binary(batch, table)
+                    for batch in iter_pandas_df_batches(pandas_df, batch_size)
+                ]
+            yield from batches
+            total_rows += len(pandas_df)
+        yield PG_COPY_BINARY_TRAILER
+
+    columns = ', '.join(column.name for column in table.columns)
+    start_time = time.perf_counter()
+
+    conn = db_engine.raw_connection()
+    cur = conn.cursor()
+    cur.copy_expert(
+        f'COPY {table.name} ({columns}) FROM STDIN WITH (FORMAT binary)',
+        BytesIteratorReader(iter_binary_chunks()),
+    )
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    duration = time.perf_counter() - start_time
+    logger.info(f'Binary copied {total_rows} rows to {table.name} in {duration:.2f}s')
+    return total_rows
+
+
+def copy_pandas_df_to_table_binary(
+    pandas_df: pd.DataFrame,
+    table: Table,
+    db_engine: Engine,
+    batch_size: int = 100_000,
+) -> int:
+    """
+    Use SQL binary COPY to upload a pandas dataframe to a postgres db table
+    """
+    return copy_pandas_dfs_to_table_binary([pandas_df], table, db_engine, batch_size=batch_size)
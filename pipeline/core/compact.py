@@ -0,0 +1,91 @@
+import logging
+from typing import Dict, Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from pipeline.tables.stock_compact import MARKET_CODES, PRICE_COLUMNS, stock_compact_table, ticker_table
+
+logger = logging.getLogger(__name__)
+
+
+MAX_INTEGER = np.iinfo(np.int32).max
+
+
+class TickerDictionary:
+    """
+    Ids of the ticker names in the ticker table, the unknown names are inserted when they are first encoded
+    """
+
+    def __init__(self, db_engine: Engine) -> None:
+        self.db_engine = db_engine
+        self.ids: Dict[str, int] = {}
+        ticker_table.create(self.db_engine, checkfirst=True)
+
+    def add_tickers(self, names: Iterable[str]):
+        names = list(names)
+        insert_sql = f"""
+            INSERT INTO {ticker_table.name} (name)
+            SELECT unnest(CAST(:names AS text[]))
+            ON CONFLICT (name) DO NOTHING
+        """
+        with self.db_engine.begin() as conn:
+            conn.execute(text(insert_sql), names=names)
+            rows = conn.execute(
+                text(f'SELECT name, id FROM {ticker_table.name} WHERE name = ANY(CAST(:names AS text[]))'),
+                names=names,
+            )
+            self.ids.update((name, ticker_id) for name, ticker_id in rows)
+        logger.info(f'Encoded {len(names)} new tickers, {len(self.ids)} known tickers')
+
+    def encode(self, names: pd.Series) -> np.ndarray:
+        unknown_names = [name for name in names.unique() if name not in self.ids]
+        if unknown_names:
+            self.add_tickers(unknown_names)
+        return names.map(self.ids).to_numpy(dtype=np.int32)
+
+
+def encode_prices(prices: pd.Series, price_decimals: int) -> np.ndarray:
+    scaled_prices = np.round(prices.to_numpy(dtype=np.float64) * 10**price_decimals)
+    if np.isnan(scaled_prices).any():
+        raise ValueError(f'{prices.name} has missing values, the integer column is not nullable')
+    if len(scaled_prices) and np.max(np.abs(scaled_prices)) > MAX_INTEGER:
+        message = f'{prices.name} values overflow the integer column with {price_decimals} decimals'
+        raise ValueError(f'{message}, lower PRICE_DECIMALS')
+    return scaled_prices.astype(np.int32)
+
+
+def encode_markets(markets: pd.Series) -> pd.Series:
+    codes = markets.map(MARKET_CODES)
+    unknown_markets = markets[codes.isna() & markets.notna()].unique()
+    if len(unknown_markets):
+        raise ValueError(f'Unknown markets {list(unknown_markets)}, expected one of {list(MARKET_CODES)}')
+    return codes.astype('Int16')
+
+
+def encode_compact_stock_df(
+    pandas_df: pd.DataFrame, ticker_dictionary: TickerDictionary, price_decimals: int
+) -> pd.DataFrame:
+    """
+    Encodes the rows of the stock csv files to the columns of the compact stock table, in the table order
+    """
+    # Built from arrays since the chunks of the csv files don't start at index 0
+    return pd.DataFrame(
+        {
+            'ticker_id': ticker_dictionary.encode(pandas_df['name']),
+            'date': pandas_df['date'].to_numpy(),
+            **{column: encode_prices(pandas_df[column], price_decimals) for column in PRICE_COLUMNS},
+            'volume': pandas_df['volume'].to_numpy(dtype=np.int64),
+            'market': encode_markets(pandas_df['market']).array,
+        },
+        columns=[column.name for column in stock_compact_table.columns],
+    )
+
+
+def iter_encoded_compact_stock_dfs(
+    pandas_dfs: Iterable[pd.DataFrame], ticker_dictionary: TickerDictionary, price_decimals: int
+) -> Iterator[pd.DataFrame]:
+    for pandas_df in pandas_dfs:
+        yield encode_compact_stock_df(pandas_df, ticker_dictionary, price_decimals)
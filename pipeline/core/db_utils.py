@@ -1,8 +1,10 @@
+import contextlib
 import io
 import logging
 import os
+import time
 from dataclasses import dataclass
-from typing import Dict
+from typing import Callable, ContextManager, Dict, Iterable, List, Tuple
 
 import pandas as pd
 import psycopg2
@@ -12,6 +14,14 @@ from sqlalchemy.engine import Engine
 
 logger = logging.getLogger(__name__)
 
+# Context manager factory wrapping the upload of each chunk of a stream of dataframes, called with the chunk number
+# and the chunk
+ChunkStage = Callable[[int, pd.DataFrame], ContextManager]
+
+
+def no_chunk_stage(chunk_number: int, pandas_df: pd.DataFrame) -> ContextManager:
+    return contextlib.nullcontext()
+
 
 @dataclass
 class DbConfig:
@@ -76,14 +86,61 @@ def create_database_if_not_exists(db_name: str):
     conn.close()
 
 
+class FileRangeReader:
+    """
+    Read only file-like object exposing the [start, end) bytes range of a file, used to COPY parts of a big
+    file in parallel.
+    """
+
+    def __init__(self, file, start: int, end: int) -> None:
+        self.file = file
+        self.end = end
+        self.file.seek(start)
+
+    def _remaining(self, size: int) -> int:
+        remaining = self.end - self.file.tell()
+        return remaining if size is None or size < 0 else min(size, remaining)
+
+    def read(self, size: int = -1) -> bytes:
+        return self.file.read(self._remaining(size))
+
+    def readline(self, size: int = -1) -> bytes:
+        return self.file.readline(self._remaining(size))
+
+
+def get_csv_file_byte_ranges(csv_file_path: str, split_size_bytes: int) -> List[Tuple[int, int]]:
+    """
+    Splits a csv file in [start, end) bytes ranges of around split_size_bytes, aligned on the end of lines.
+    """
+    file_size = os.path.getsize(csv_file_path)
+    byte_ranges = []
+
+    with open(csv_file_path, 'rb') as f:
+        start = 0
+        while start < file_size:
+            f.seek(min(start + split_size_bytes, file_size))
+            f.readline()
+            end = min(f.tell(), file_size)
+            byte_ranges.append((start, end))
+            start = end
+
+    return byte_ranges
+
+
 def copy_csv_to_table(
     csv_file_path: str,
     table_name: str,
     db_engine: Engine,
     csv_sep: str = ',',
-) -> None:
+    byte_range: Tuple[int, int] = None,
+) -> int:
     """
     Use SQL COPY to populate a csv file into a Postgres table.
+
+    Args:
+        - byte_range: Optional [start, end) bytes range of the file to copy, the whole file is copied by default
+    Returns:
+        - Number of copied rows
     """
 
     conn = db_engine.raw_connection()
@@ -92,15 +149,21 @@ def copy_csv_to_table(
     # Open a cursor to perform database operations
     cur = conn.cursor()
 
-    # Copy the data from the CSV file into the table
-    # By default copy appends to the existing table and doesn't truncate
-    with open(csv_file_path, 'r') as f:
-        cur.copy_from(f, table_name, sep=csv_sep)
-
-    # Close the cursor and connection
-    cur.close()
-    conn.set_isolation_level(isolation_level)
-    conn.close()
+    try:
+        # Copy the data from the CSV file into the table
+        # By default copy appends to the existing table and doesn't truncate
+        if byte_range is None:
+            with open(csv_file_path, 'r') as f:
+                cur.copy_from(f, table_name, sep=csv_sep)
+        else:
+            with open(csv_file_path, 'rb') as f:
+                cur.copy_from(FileRangeReader(f, *byte_range), table_name, sep=csv_sep)
+        return cur.rowcount
+    finally:
+        # Close the cursor and connection, also on failure so that parallel uploads don't leak connections
+        cur.close()
+        conn.set_isolation_level(isolation_level)
+        conn.close()
 
 
 def copy_pandas_df_to_table(
@@ -119,11 +182,70 @@ def copy_pandas_df_to_table(
     conn = db_engine.raw_connection()
     cur = conn.cursor()
     output = io.StringIO()
-    pandas_df.to_csv(output, sep=',', header=False, index=False)
-    output.seek(0)
-    # _ = output.getvalue()
-    cur.copy_from(output, table_name, null='', sep=',')  # null values become ''
+    _copy_pandas_df_with_cursor(cur, pandas_df, table_name, output)
     conn.commit()
 
     cur.close()
     conn.close()
+
+
+def copy_pandas_dfs_to_table(
+    pandas_dfs: Iterable[pd.DataFrame],
+    table_name: str,
+    db_engine: Engine,
+    chunk_stage: ChunkStage = no_chunk_stage,
+) -> int:
+    """
+    Use SQL COPY to stream an iterable of pandas dataframes (chunks) to a postgres db table.
+    One connection and one text buffer are reused for all the chunks and the load is committed once at the end,
+    so the memory used is bounded by the chunk size and not by the whole dataset size.
+
+    Args:
+        - pandas_dfs: Iterable[pd.DataFrame], dataframes to upload, can be a generator
+        - chunk_stage: Context manager wrapping the copy of each chunk (eg: a stage of the run report)
+    Returns:
+        - Number of uploaded rows
+    """
+
+    conn = db_engine.raw_connection()
+    cur = conn.cursor()
+    output = io.StringIO()
+    total_rows = 0
+    start_time = time.perf_counter()
+
+    for chunk_number, pandas_df in enumerate(pandas_dfs):
+        chunk_start_time = time.perf_counter()
+        with chunk_stage(chunk_number, pandas_df):
+            _copy_pandas_df_with_cursor(cur, pandas_df, table_name, output)
+        total_rows += len(pandas_df)
+        chunk_duration = time.perf_counter() - chunk_start_time
+        logger.info(
+            f'Chunk {chunk_number}: copied {len(pandas_df)} rows to {table_name} '
+            f'({_rows_per_second(len(pandas_df), chunk_duration):.0f} rows/sec)'
+        )
+
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    duration = time.perf_counter() - start_time
+    logger.info(
+        f'Copied {total_rows} rows to {table_name} in {duration:.2f}s '
+        f'({_rows_per_second(total_rows, duration):.0f} rows/sec)'
+    )
+    return total_rows
+
+
+def _copy_pandas_df_with_cursor(cur, pandas_df: pd.DataFrame, table_name: str, output: io.StringIO):
+    """
+    Serializes pandas_df to csv in the reusable output buffer and copies it with cur
+    """
+    output.seek(0)
+    output.truncate()
+    pandas_df.to_csv(output, sep=',', header=False, index=False)
+    output.seek(0)
+    cur.copy_from(output, table_name, null='', sep=',')  # null values become ''
+
+
+def _rows_per_second(rows: int, duration: float) -> float:
+    return rows / duration if duration > 0 else float('inf')
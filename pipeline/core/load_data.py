@@ -1,20 +1,101 @@
+import contextlib
+import dataclasses
 import logging
 import os
-from typing import List
+from typing import Iterator, List
 
 import pandas as pd
 from sqlalchemy.types import Date
 
+from pipeline.core.binary_copy import CopyFormat
+from pipeline.core.compact import TickerDictionary, encode_compact_stock_df, iter_encoded_compact_stock_dfs
 from pipeline.core.constants import PIPELINE, STOCK_MARKET_DATA
 from pipeline.core.db_utils import create_database_if_not_exists, get_db_engine
-from pipeline.core.populator import PandasDfPopulator
-from pipeline.tables.stock import stock_table_definition
+from pipeline.core.populator import LoadMode, PandasDfChunksPopulator, PandasDfPopulator, QueryPopulator
+from pipeline.core.run_report import PgProgressSampler, RunReport
+from pipeline.core.snapshot import export_stock_snapshot
+from pipeline.tables.stock import stock_table, stock_table_definition
+from pipeline.tables.stock_compact import StockSchema, get_stock_compact_source_sql, stock_compact_table_definition
+from pipeline.tables.stock_moments import get_stock_moments_query, stock_moments_table_definition
+from pipeline.tables.stock_range_index import (
+    get_range_index_levels,
+    get_stock_range_index_query,
+    stock_range_index_table_definition,
+)
+from pipeline.tables.table_definition import PartitionInterval, TableDefinition, TablePartitioning
 
 logger = logging.getLogger(__name__)
 
 
 CSV_FILES = ['stocks-2010.csv', 'stocks-2011.csv']
 
+# When set, the csv files are streamed to the DB in chunks of CSV_CHUNK_SIZE rows instead of being loaded at once
+CSV_CHUNK_SIZE = int(os.environ.get('CSV_CHUNK_SIZE') or 0)
+# csv (default) or binary
+COPY_FORMAT = CopyFormat(os.environ.get('COPY_FORMAT') or CopyFormat.CSV.value)
+# full (default) reloads the whole table, incremental merges only the new or changed rows
+LOAD_MODE = LoadMode(os.environ.get('LOAD_MODE') or LoadMode.FULL.value)
+# Full loads only: copy to a bare table and build the primary key and indexes afterwards
+DEFERRED_INDEXES = os.environ.get('DEFERRED_INDEXES', '').lower() in ('1', 'true')
+MAINTENANCE_WORK_MEM = os.environ.get('MAINTENANCE_WORK_MEM') or None
+MAX_PARALLEL_MAINTENANCE_WORKERS = (
+    int(os.environ['MAX_PARALLEL_MAINTENANCE_WORKERS']) if os.environ.get('MAX_PARALLEL_MAINTENANCE_WORKERS') else None
+)
+# default or compact: the compact stock table references the ticker table by id, stores the market as a code and
+# the prices as integers in units of 10^-PRICE_DECIMALS, see stock_compact_table. Switching schema needs a full load.
+STOCK_SCHEMA = StockSchema(os.environ.get('STOCK_SCHEMA') or StockSchema.DEFAULT.value)
+PRICE_DECIMALS = int(os.environ.get('PRICE_DECIMALS') or 4)
+# When set (month or year), the stock table is range partitioned by date, optionally sub-partitioned by a hash
+# of the ticker name in HASH_PARTITIONS partitions
+PARTITION_INTERVAL = os.environ.get('PARTITION_INTERVAL') or None
+HASH_PARTITIONS = int(os.environ.get('HASH_PARTITIONS') or 0)
+# Build the stock_moments prefix sums table after the stock table is loaded
+STOCK_MOMENTS = os.environ.get('STOCK_MOMENTS', '').lower() in ('1', 'true')
+# Build the stock_range_index min and max sparse tables after the stock table is loaded, answering the rolling
+# windows up to RANGE_INDEX_MAX_WINDOW rows
+STOCK_RANGE_INDEX = os.environ.get('STOCK_RANGE_INDEX', '').lower() in ('1', 'true')
+RANGE_INDEX_MAX_WINDOW = int(os.environ.get('RANGE_INDEX_MAX_WINDOW') or 1024)
+# When set, the stock table is exported after the load to a versioned columnar snapshot in this directory, which
+# the API memory maps (SNAPSHOT_DIR of the API), streamed in chunks of SNAPSHOT_CHUNK_SIZE rows
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR') or None
+SNAPSHOT_CHUNK_SIZE = int(os.environ.get('SNAPSHOT_CHUNK_SIZE') or 1_000_000)
+# When set, the wall time, rows, bytes, rows/sec and peak RSS of each stage of the run (populate phases, copied files
+# and chunks) are written to this JSON file, with the pg_stat_progress_* rows sampled every
+# PG_PROGRESS_INTERVAL_SECONDS (0 disables the sampling)
+RUN_REPORT_PATH = os.environ.get('RUN_REPORT_PATH') or None
+PG_PROGRESS_INTERVAL_SECONDS = float(os.environ.get('PG_PROGRESS_INTERVAL_SECONDS') or 0)
+
+
+def get_stock_table_definition() -> TableDefinition:
+    table_definition = stock_compact_table_definition if STOCK_SCHEMA == StockSchema.COMPACT else stock_table_definition
+    if not PARTITION_INTERVAL:
+        return table_definition
+
+    return dataclasses.replace(
+        table_definition,
+        partitioning=TablePartitioning(
+            range_column=stock_table.c.date.name,
+            interval=PartitionInterval(PARTITION_INTERVAL),
+            # The ticker name or id
+            hash_column=table_definition.high_water_mark_group_column if HASH_PARTITIONS else None,
+            hash_partitions=HASH_PARTITIONS or None,
+        ),
+    )
+
+
+def get_csv_file_path(filename: str) -> str:
+    base_dir_path = os.path.join(os.path.dirname(os.path.realpath(__file__)).split(PIPELINE)[0], PIPELINE)  # noqa
+    return os.path.join(base_dir_path, 'data', filename)
+
+
+def format_dates_column(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Format the date column to ISO format
+    """
+    df['date'] = pd.to_datetime(df['date'])
+    df['date'] = df['date'].dt.strftime('%Y-%m-%d')
+    return df
+
 
 def get_pd_dataframe_with_dates_columns_formated(csv_files_l: List[str]) -> pd.DataFrame:
     """
@@ -23,29 +104,118 @@ def get_pd_dataframe_with_dates_columns_formated(csv_files_l: List[str]) -> pd.D
     dfs = []
 
     for filename in csv_files_l:
-        base_dir_path = os.path.join(os.path.dirname(os.path.realpath(__file__)).split(PIPELINE)[0], PIPELINE)  # noqa
-        csv_file_path = os.path.join(base_dir_path, 'data', filename)
-        df = pd.read_csv(csv_file_path, index_col=None, header=0)
+        df = pd.read_csv(get_csv_file_path(filename), index_col=None, header=0)
         dfs.append(df)
 
     df_all = pd.concat(dfs, axis=0, ignore_index=True)
-    df_all['date'] = pd.to_datetime(df_all['date'])
-    df_all['date'] = df_all['date'].dt.strftime('%Y-%m-%d')
-    return df_all
+    return format_dates_column(df_all)
+
+
+def iter_pd_dataframe_chunks_with_dates_columns_formated(
+    csv_files_l: List[str],
+    chunk_size: int,
+) -> Iterator[pd.DataFrame]:
+    """
+    Lazily reads the csv files in chunks of chunk_size rows and format the date column of each chunk to ISO format.
+    Only one chunk is held in memory at a time.
+    """
+    for filename in csv_files_l:
+        with pd.read_csv(get_csv_file_path(filename), index_col=None, header=0, chunksize=chunk_size) as reader:
+            for chunk in reader:
+                yield format_dates_column(chunk)
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    # The bytes of the DataFrames are only measured for the written report
+    run_report = RunReport(record_bytes=bool(RUN_REPORT_PATH))
     create_database_if_not_exists(STOCK_MARKET_DATA)
-    db_engine = get_db_engine(STOCK_MARKET_DATA)
+    progress_sampler = (
+        PgProgressSampler(run_report, STOCK_MARKET_DATA, PG_PROGRESS_INTERVAL_SECONDS)
+        if PG_PROGRESS_INTERVAL_SECONDS
+        else contextlib.nullcontext()
+    )
+    # The report is also written when the run fails, with the error of the failed stage
+    try:
+        with progress_sampler:
+            db_engine = get_db_engine(STOCK_MARKET_DATA)
+            table_definition = get_stock_table_definition()
+            # The queries reading the stock table read the decoded compact table
+            stock_source = stock_table.name
+            if STOCK_SCHEMA == StockSchema.COMPACT:
+                ticker_dictionary = TickerDictionary(db_engine)
+                stock_source = get_stock_compact_source_sql(PRICE_DECIMALS)
 
-    df = get_pd_dataframe_with_dates_columns_formated(csv_files_l=CSV_FILES)
+            bulk_load_kwargs = dict(
+                deferred_indexes=DEFERRED_INDEXES,
+                maintenance_work_mem=MAINTENANCE_WORK_MEM,
+                max_parallel_maintenance_workers=MAX_PARALLEL_MAINTENANCE_WORKERS,
+                run_report=run_report,
+            )
 
-    populator = PandasDfPopulator(
-        table_definition=stock_table_definition,
-        db_engine=db_engine,
-        pandas_df=df,
-        columns_dtype={'date': Date()},  # noqa
-    )
-    populator.populate()
+            if CSV_CHUNK_SIZE:
+                pandas_dfs = iter_pd_dataframe_chunks_with_dates_columns_formated(
+                    csv_files_l=CSV_FILES, chunk_size=CSV_CHUNK_SIZE
+                )
+                if STOCK_SCHEMA == StockSchema.COMPACT:
+                    pandas_dfs = iter_encoded_compact_stock_dfs(pandas_dfs, ticker_dictionary, PRICE_DECIMALS)
+
+                populator = PandasDfChunksPopulator(
+                    table_definition=table_definition,
+                    db_engine=db_engine,
+                    pandas_dfs=pandas_dfs,
+                    copy_format=COPY_FORMAT,
+                    **bulk_load_kwargs,
+                )
+            else:
+                with run_report.stage('read csv files') as stage:
+                    df = get_pd_dataframe_with_dates_columns_formated(csv_files_l=CSV_FILES)
+                    stage.rows = len(df)
+                if STOCK_SCHEMA == StockSchema.COMPACT:
+                    df = encode_compact_stock_df(df, ticker_dictionary, PRICE_DECIMALS)
+
+                populator = PandasDfPopulator(
+                    table_definition=table_definition,
+                    db_engine=db_engine,
+                    pandas_df=df,
+                    columns_dtype={'date': Date()},  # noqa
+                    copy_format=COPY_FORMAT,
+                    **bulk_load_kwargs,
+                )
+            if LOAD_MODE == LoadMode.INCREMENTAL:
+                populator.populate_incrementally()
+            else:
+                populator.populate()
+
+            logger.info('data is uploaded to the DB')
+
+            if STOCK_MOMENTS:
+                QueryPopulator(
+                    table_definition=stock_moments_table_definition,
+                    db_engine=db_engine,
+                    query=get_stock_moments_query(stock_source),
+                    run_report=run_report,
+                ).populate()
+                logger.info('stock moments are computed')
+
+            if STOCK_RANGE_INDEX:
+                QueryPopulator(
+                    table_definition=stock_range_index_table_definition,
+                    db_engine=db_engine,
+                    query=get_stock_range_index_query(
+                        levels=get_range_index_levels(RANGE_INDEX_MAX_WINDOW), stock_source=stock_source
+                    ),
+                    run_report=run_report,
+                ).populate()
+                logger.info('stock range index is built')
 
-    logger.info('data is uploaded to the DB')
+            if SNAPSHOT_DIR:
+                with run_report.stage('stock snapshot export'):
+                    export_stock_snapshot(
+                        db_engine, snapshot_dir=SNAPSHOT_DIR, chunk_size=SNAPSHOT_CHUNK_SIZE, stock_source=stock_source
+                    )
+                logger.info('stock snapshot is exported')
+    finally:
+        if RUN_REPORT_PATH:
+            run_report.write(RUN_REPORT_PATH)
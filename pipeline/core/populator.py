@@ -1,14 +1,59 @@
+import json
+import logging
 import os
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Union
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import date
+from enum import Enum
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple, Union
 
 import pandas as pd
+from sqlalchemy import Table, text
 from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateIndex
 from sqlalchemy.sql.expression import Executable
 
+from pipeline.core.binary_copy import (
+    CopyFormat,
+    copy_pandas_df_to_table_binary,
+    copy_pandas_dfs_to_table_binary,
+    supports_binary_copy,
+)
 from pipeline.core.constants import PIPELINE, STOCK_MARKET_DATA
-from pipeline.core.db_utils import copy_csv_to_table, copy_pandas_df_to_table, get_db_conn
-from pipeline.tables.table_definition import TableDefinition
+from pipeline.core.db_utils import (
+    copy_csv_to_table,
+    copy_pandas_df_to_table,
+    copy_pandas_dfs_to_table,
+    get_csv_file_byte_ranges,
+    get_db_conn,
+)
+from pipeline.core.run_report import RunReport, StageReport
+from pipeline.tables.dataset_version import DATASET_VERSION_CHANNEL, dataset_version_table
+from pipeline.tables.high_water_mark import high_water_mark_table
+from pipeline.tables.table_definition import PartitionInterval, TableDefinition
+
+logger = logging.getLogger(__name__)
+
+PARTITION_PERIOD_FREQUENCIES = {PartitionInterval.MONTH: 'M', PartitionInterval.YEAR: 'Y'}
+
+
+class CsvUploadError(Exception):
+    """
+    Raised when some of the csv files (or parts of files) couldn't be uploaded
+    """
+
+    def __init__(self, errors: Dict[str, Exception]) -> None:
+        self.errors = errors
+        details = '\n'.join(f'- {upload}: {error!r}' for upload, error in errors.items())
+        super().__init__(f'{len(errors)} csv upload(s) failed:\n{details}')
+
+
+class LoadMode(Enum):
+    # Drop, recreate and reload the whole table
+    FULL = 'full'
+    # Merge only the new or changed rows into the existing table
+    INCREMENTAL = 'incremental'
 
 
 class BasePostgresTablePopulator(ABC):
@@ -22,7 +67,20 @@ class BasePostgresTablePopulator(ABC):
         db_engine: Engine,
         target_db: str = STOCK_MARKET_DATA,
         drop_table_if_exits: bool = True,
+        deferred_indexes: bool = False,
+        maintenance_work_mem: str = None,
+        max_parallel_maintenance_workers: int = None,
+        run_report: RunReport = None,
     ) -> None:
+        """
+        Args:
+            - deferred_indexes: Bulk load lifecycle, create the table without primary key and indexes, copy the data
+                and build the primary key and indexes afterwards, see bulk_populate
+            - maintenance_work_mem: Optional maintenance_work_mem used to build the deferred indexes, eg: '1GB'
+            - max_parallel_maintenance_workers: Optional number of parallel workers used to build each deferred index
+            - run_report: Optional report of the run the phases and copies are recorded in, shared by the populators
+                of the run. Without it the phases are only logged and the bytes of the DataFrames aren't measured
+        """
 
         self.table_definition = table_definition
         self.target_db = target_db
@@ -30,9 +88,35 @@ class BasePostgresTablePopulator(ABC):
         self.tablename = self.table_definition.table
         self.db_engine = db_engine
         self.drop_table_if_exits = drop_table_if_exits
+        self.deferred_indexes = deferred_indexes
+        self.maintenance_work_mem = maintenance_work_mem
+        self.max_parallel_maintenance_workers = max_parallel_maintenance_workers
+        self.phase_durations: Dict[str, float] = {}
+        self.run_report = run_report or RunReport(record_bytes=False)
+        # Lower bounds of the range partitions created by this populator
+        self.created_partitions: Set[date] = set()
+        # Table the data is copied to by upload_data, the staging table during incremental loads
+        self.copy_table = self.table_definition.table
 
-    def create_table(self):
-        self.table_definition.table.create(self.db_engine)
+    def create_table(self, checkfirst: bool = False):
+        if self.table_definition.partitioning:
+            self.table_definition.partitioned_table().create(self.db_engine, checkfirst=checkfirst)
+            for index in self.table_definition.indexes_list:
+                index.create(bind=self.db_engine, checkfirst=checkfirst)
+        else:
+            self.table_definition.table.create(self.db_engine, checkfirst=checkfirst)
+
+    def ensure_partitions(self, lower_bounds: Iterable[date]):
+        """
+        Creates the range partitions (and their hash sub-partitions) starting at lower_bounds if they don't exist
+        """
+        partitioning = self.table_definition.partitioning
+        for lower_bound in sorted(set(lower_bounds) - self.created_partitions):
+            for create_partition_sql in partitioning.get_create_partition_sql(
+                self.table_definition.table.name, lower_bound
+            ):
+                self.execute(create_partition_sql)
+            self.created_partitions.add(lower_bound)
 
     def drop_table(self):
         self.table_definition.table.drop(self.db_engine, checkfirst=True)
@@ -44,6 +128,47 @@ class BasePostgresTablePopulator(ABC):
         """
         pass
 
+    def use_binary_copy(self, copy_format: CopyFormat) -> bool:
+        """
+        Returns True if the binary copy can be used for copy_format, otherwise the csv copy is the fallback
+        """
+        if copy_format != CopyFormat.BINARY:
+            return False
+        if not supports_binary_copy(self.copy_table):
+            logger.warning(f'{self.copy_table.name} has column types not supported by the binary copy, using csv')
+            return False
+        return True
+
+    def copy_pandas_df(self, pandas_df: pd.DataFrame, table: Table, copy_format: CopyFormat):
+        nbytes = self.run_report.get_pandas_df_bytes(pandas_df)
+        with self.run_report.stage(f'copy to {table.name}', rows=len(pandas_df), nbytes=nbytes):
+            if self.use_binary_copy(copy_format):
+                copy_pandas_df_to_table_binary(pandas_df=pandas_df, table=table, db_engine=self.db_engine)
+            else:
+                copy_pandas_df_to_table(pandas_df=pandas_df, table_name=table.name, db_engine=self.db_engine)
+
+    def upload_pandas_df(self, pandas_df: pd.DataFrame, copy_format: CopyFormat):
+        """
+        Copies pandas_df to the copy_table. For partitioned tables the rows are split by range partition,
+        the missing partitions are created and each partition is copied independently, sorted by the sort_columns.
+        """
+        partitioning = self.table_definition.partitioning
+        # The staging table of the incremental loads isn't partitioned
+        if partitioning is None or self.copy_table is not self.table_definition.table:
+            self.copy_pandas_df(pandas_df, self.copy_table, copy_format)
+            return
+
+        periods = pd.to_datetime(pandas_df[partitioning.range_column]).dt.to_period(
+            PARTITION_PERIOD_FREQUENCIES[partitioning.interval]
+        )
+        for period, partition_df in pandas_df.groupby(periods, sort=True):
+            lower_bound = period.start_time.date()
+            self.ensure_partitions([lower_bound])
+            if self.table_definition.sort_columns:
+                partition_df = partition_df.sort_values(self.table_definition.sort_columns)
+            partition_name = partitioning.get_partition_name(self.table_definition.table.name, lower_bound)
+            self.copy_pandas_df(partition_df, self.table_definition.bare_table(partition_name), copy_format)
+
     def execute(
         self,
         stmt: Union[str, Executable],
@@ -64,17 +189,244 @@ class BasePostgresTablePopulator(ABC):
         self.execute(f'ANALYZE {self.tablename}')
 
     def execute_additional_sql(self):
+        if self.table_definition.partitioning:
+            logger.info(f'Skipping post copy sql of the partitioned {self.table_definition.table.name} table')
+            return
         if self.table_definition.post_copy_sql:
             self.execute(self.table_definition.post_copy_sql)
 
-    def populate(self):
-        if self.drop_table_if_exits:
+    @property
+    def copies_sorted_data(self) -> bool:
+        """
+        Whether upload_data copies the data sorted by the table definition sort_columns
+        """
+        return False
+
+    @contextmanager
+    def chunk_stage(self, chunk_number: int, pandas_df: pd.DataFrame) -> Iterator[StageReport]:
+        """
+        Records the upload of a chunk of a stream of DataFrames as a stage of the run report
+        """
+        name = f'copy to {self.copy_table.name} chunk {chunk_number}'
+        nbytes = self.run_report.get_pandas_df_bytes(pandas_df)
+        with self.run_report.stage(name, rows=len(pandas_df), nbytes=nbytes) as stage:
+            yield stage
+
+    @contextmanager
+    def timed_phase(self, phase: str) -> Iterator[StageReport]:
+        """
+        Records the phase as a stage of the run report, the rows of the phase can be set on the yielded StageReport
+        """
+        with self.run_report.stage(f'{self.table_definition.table.name} {phase}') as stage:
+            yield stage
+        self.phase_durations[phase] = stage.seconds
+
+    def build_deferred_indexes(self):
+        """
+        Builds the primary key and the indexes of a table created without them, in a single transaction
+        using the maintenance_work_mem and max_parallel_maintenance_workers settings.
+        """
+        with self.db_engine.begin() as conn:
+            if self.maintenance_work_mem:
+                conn.execute(text(f"SET LOCAL maintenance_work_mem = '{self.maintenance_work_mem}'"))
+            if self.max_parallel_maintenance_workers is not None:
+                conn.execute(
+                    text(f'SET LOCAL max_parallel_maintenance_workers = {int(self.max_parallel_maintenance_workers)}')
+                )
+
+            with self.timed_phase('primary_key'):
+                conn.execute(text(self.table_definition.add_primary_key_sql))
+            for index in self.table_definition.indexes_list:
+                with self.timed_phase(f'index_{index.name}'):
+                    conn.execute(CreateIndex(index))
+
+    def bulk_populate(self):
+        """
+        Bulk load lifecycle: the table is created as a bare heap (no primary key nor indexes) so that the copy
+        doesn't pay the indexes maintenance, the indexes are built once the data is copied. When the data
+        is copied sorted by the sort_columns the clustering post_copy_sql isn't needed.
+        """
+        with self.timed_phase('drop'):
             self.drop_table()
-        self.create_table()
-        self.upload_data()
-        # self.create_indexes()
-        self.execute_additional_sql()
-        self.analyze()
+        with self.timed_phase('create_heap'):
+            self.table_definition.bare_table(partitioned=True).create(self.db_engine)
+        with self.timed_phase('upload'):
+            self.upload_data()
+        self.build_deferred_indexes()
+        if not self.copies_sorted_data:
+            with self.timed_phase('post_copy_sql'):
+                self.execute_additional_sql()
+        with self.timed_phase('analyze'):
+            self.analyze()
+
+    def record_dataset_version(self):
+        """
+        Increments the version of the table in the dataset_version table, so that the readers caching its data
+        know that it changed, and notifies the new version on the DATASET_VERSION_CHANNEL (delivered at commit)
+        """
+        record_version_sql = f"""
+            INSERT INTO {dataset_version_table.name} (table_name, version)
+            VALUES (:table_name, 1)
+            ON CONFLICT (table_name) DO UPDATE
+            SET version = {dataset_version_table.name}.version + 1, loaded_at = now()
+            RETURNING version
+        """
+
+        table_name = self.table_definition.table.name
+        dataset_version_table.create(self.db_engine, checkfirst=True)
+        with self.db_engine.begin() as conn:
+            version = conn.execute(text(record_version_sql), table_name=table_name).scalar()
+            conn.execute(
+                text('SELECT pg_notify(:channel, :payload)'),
+                channel=DATASET_VERSION_CHANNEL,
+                payload=json.dumps({'table': table_name, 'version': version}),
+            )
+        logger.info(f'{table_name} dataset version is {version}')
+
+    def reset_high_water_marks(self):
+        """
+        Replaces the high water marks of the table by the last date of each group of the fully loaded rows, in a
+        single transaction: the marks of a previous incremental load would skip the rows loaded afterwards
+        """
+        hwm_column = self.table_definition.high_water_mark_column
+        if not hwm_column:
+            return
+        table_name = self.table_definition.table.name
+        group_column = self.table_definition.high_water_mark_group_column
+
+        reseed_sql = f"""
+            INSERT INTO {high_water_mark_table.name} (table_name, group_value, high_water_mark)
+            SELECT :table_name, {group_column}::text, max({hwm_column})
+            FROM {table_name}
+            GROUP BY {group_column}
+        """
+        high_water_mark_table.create(self.db_engine, checkfirst=True)
+        with self.db_engine.begin() as conn:
+            conn.execute(
+                text(f'DELETE FROM {high_water_mark_table.name} WHERE table_name = :table_name'), table_name=table_name
+            )
+            conn.execute(text(reseed_sql), table_name=table_name)
+
+    def populate(self):
+        if self.deferred_indexes:
+            self.bulk_populate()
+        else:
+            if self.drop_table_if_exits:
+                with self.timed_phase('drop'):
+                    self.drop_table()
+            with self.timed_phase('create'):
+                self.create_table()
+            with self.timed_phase('upload'):
+                self.upload_data()
+            # self.create_indexes()
+            with self.timed_phase('post_copy_sql'):
+                self.execute_additional_sql()
+            with self.timed_phase('analyze'):
+                self.analyze()
+
+        with self.timed_phase('reset_high_water_marks'):
+            self.reset_high_water_marks()
+        with self.timed_phase('record_dataset_version'):
+            self.record_dataset_version()
+
+    @property
+    def staging_table_name(self) -> str:
+        return f'{self.table_definition.table.name}_staging'
+
+    def merge_staging_table(self) -> int:
+        """
+        Merges the staging table rows into the target table in a single transaction:
+        - rows older than the high water mark of their group are skipped
+        - new rows are inserted and existing rows (same primary key) are updated only if they changed
+        - the high water marks are moved forward
+        Returns the number of inserted or updated rows
+        """
+        table_name = self.table_definition.table.name
+        columns = [column.name for column in self.table_definition.table.columns]
+        primary_key_columns = ', '.join(self.table_definition.primary_key_columns)
+        updated_columns = [column for column in columns if column not in self.table_definition.primary_key_columns]
+        hwm_column = self.table_definition.high_water_mark_column
+        group_column = self.table_definition.high_water_mark_group_column
+
+        skip_old_rows_sql = f"""
+            DELETE FROM {self.staging_table_name} AS staging
+            USING {high_water_mark_table.name} AS hwm
+            WHERE hwm.table_name = :table_name
+                AND staging.{group_column}::text = hwm.group_value
+                AND staging.{hwm_column} < hwm.high_water_mark
+        """
+        # DISTINCT ON since a row can't be updated twice by the same INSERT ... ON CONFLICT
+        upsert_sql = f"""
+            INSERT INTO {table_name} ({', '.join(columns)})
+            SELECT DISTINCT ON ({primary_key_columns}) {', '.join(columns)}
+            FROM {self.staging_table_name}
+            ORDER BY {primary_key_columns}
+            ON CONFLICT ({primary_key_columns}) DO UPDATE
+            SET {', '.join(f'{column} = EXCLUDED.{column}' for column in updated_columns)}
+            WHERE ({', '.join(f'{table_name}.{column}' for column in updated_columns)})
+                IS DISTINCT FROM ({', '.join(f'EXCLUDED.{column}' for column in updated_columns)})
+        """
+        update_high_water_marks_sql = f"""
+            INSERT INTO {high_water_mark_table.name} (table_name, group_value, high_water_mark)
+            SELECT :table_name, {group_column}::text, max({hwm_column})
+            FROM {self.staging_table_name}
+            GROUP BY {group_column}
+            ON CONFLICT (table_name, group_value) DO UPDATE
+            SET high_water_mark = GREATEST({high_water_mark_table.name}.high_water_mark, EXCLUDED.high_water_mark),
+                updated_at = now()
+        """
+
+        with self.db_engine.begin() as conn:
+            skipped_rows = conn.execute(text(skip_old_rows_sql), table_name=table_name).rowcount
+            merged_rows = conn.execute(text(upsert_sql)).rowcount
+            conn.execute(text(update_high_water_marks_sql), table_name=table_name)
+
+        logger.info(f'Skipped {skipped_rows} already loaded rows, inserted or updated {merged_rows} rows')
+        return merged_rows
+
+    def ensure_staging_partitions(self):
+        """
+        Creates the partitions of the target table needed by the staging table rows
+        """
+        partitioning = self.table_definition.partitioning
+        rows = self.execute(
+            f'SELECT DISTINCT date_trunc(\'{partitioning.interval.value}\', {partitioning.range_column})::date '
+            f'FROM {self.staging_table_name}'
+        )
+        self.ensure_partitions(row[0] for row in rows)
+
+    def populate_incrementally(self):
+        """
+        Loads the data to a staging table and merges only the new or changed rows into the target table,
+        see merge_staging_table. Running it twice with the same data is a no-op.
+        Only the statistics of the target table are refreshed (no CLUSTER), and only when rows changed.
+        """
+        if not self.table_definition.high_water_mark_column:
+            raise ValueError(f'{self.table_definition.table.name} table definition has no high_water_mark_column')
+
+        with self.timed_phase('create'):
+            self.create_table(checkfirst=True)
+            high_water_mark_table.create(self.db_engine, checkfirst=True)
+
+        self.copy_table = self.table_definition.bare_table(self.staging_table_name, prefixes=['UNLOGGED'])
+        self.copy_table.drop(self.db_engine, checkfirst=True)
+        self.copy_table.create(self.db_engine)
+        try:
+            with self.timed_phase('upload_staging'):
+                self.upload_data()
+            if self.table_definition.partitioning:
+                self.ensure_staging_partitions()
+            with self.timed_phase('merge') as stage:
+                merged_rows = stage.rows = self.merge_staging_table()
+        finally:
+            self.copy_table.drop(self.db_engine, checkfirst=True)
+            self.copy_table = self.table_definition.table
+
+        if merged_rows:
+            with self.timed_phase('analyze'):
+                self.analyze()
+            with self.timed_phase('record_dataset_version'):
+                self.record_dataset_version()
 
 
 class CsvFilePopulator(BasePostgresTablePopulator):
@@ -88,6 +440,8 @@ class CsvFilePopulator(BasePostgresTablePopulator):
         csv_file_names: List[str],
         csv_files_dir_path: str = 'data',
         csv_separator: str = ',',
+        max_workers: int = 1,
+        split_size_bytes: int = None,
         **kwargs,
     ) -> None:
         """
@@ -96,6 +450,10 @@ class CsvFilePopulator(BasePostgresTablePopulator):
             - csv_file_names: List of csv filenames
             - csv_files_dir_path: Dir where csv files exist, default is relative path data
             - csv_separator: csv separator
+            - max_workers: Number of files (or parts of files) copied in parallel, each worker uses its own
+                connection from the db_engine pool so the pool should allow max_workers connections
+            - split_size_bytes: When set, files bigger than split_size_bytes are split in ranges of lines of around
+                split_size_bytes that are copied in parallel
         """
         super().__init__(
             table_definition=table_definition,
@@ -104,21 +462,69 @@ class CsvFilePopulator(BasePostgresTablePopulator):
         self.csv_file_names = csv_file_names
         self.csv_files_dir_path = csv_files_dir_path
         self.csv_separator = csv_separator
+        self.max_workers = max_workers
+        self.split_size_bytes = split_size_bytes
 
-    def upload_data(self):
-        # TODO Use asycio for faster upload
+        if self.table_definition.partitioning:
+            raise ValueError('Partitioned tables are loaded with the pandas populators that create the partitions')
+
+    def get_csv_file_path(self, csv_file: str) -> str:
+        base_dir_path = os.path.join(os.path.dirname(os.path.realpath(__file__)).split(PIPELINE)[0], PIPELINE)  # noqa
+        return os.path.join(base_dir_path, self.csv_files_dir_path, csv_file)
+
+    def get_uploads(self) -> List[Tuple[str, Tuple[int, int]]]:
+        """
+        Returns the list of (csv_file_path, byte_range) to copy, byte_range is None to copy the whole file
+        """
+        uploads = []
         for csv_file in self.csv_file_names:
-            base_dir_path = os.path.join(
-                os.path.dirname(os.path.realpath(__file__)).split(PIPELINE)[0], PIPELINE
-            )  # noqa
-            csv_file_path = os.path.join(base_dir_path, self.csv_files_dir_path, csv_file)
-            copy_csv_to_table(
+            csv_file_path = self.get_csv_file_path(csv_file)
+            if self.split_size_bytes and os.path.getsize(csv_file_path) > self.split_size_bytes:
+                uploads.extend(
+                    (csv_file_path, byte_range)
+                    for byte_range in get_csv_file_byte_ranges(csv_file_path, self.split_size_bytes)
+                )
+            else:
+                uploads.append((csv_file_path, None))
+        return uploads
+
+    def upload_file(self, csv_file_path: str, byte_range: Tuple[int, int] = None):
+        if byte_range is None:
+            name, nbytes = f'copy {csv_file_path}', os.path.getsize(csv_file_path)
+        else:
+            name, nbytes = f'copy {csv_file_path} bytes {byte_range[0]}-{byte_range[1]}', byte_range[1] - byte_range[0]
+
+        with self.run_report.stage(name, nbytes=nbytes) as stage:
+            stage.rows = copy_csv_to_table(
                 csv_file_path=csv_file_path,
-                table_name=self.table_definition.table.name,
+                table_name=self.copy_table.name,
                 db_engine=self.db_engine,
                 csv_sep=self.csv_separator,
+                byte_range=byte_range,
             )
 
+    def upload_data(self):
+        errors = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self.upload_file, csv_file_path, byte_range): (
+                    csv_file_path if byte_range is None else f'{csv_file_path} bytes {byte_range[0]}-{byte_range[1]}'
+                )
+                for csv_file_path, byte_range in self.get_uploads()
+            }
+            for future in as_completed(futures):
+                upload = futures[future]
+                try:
+                    future.result()
+                    logger.info(f'Uploaded {upload}')
+                except Exception as error:
+                    logger.error(f'Failed to upload {upload}: {error!r}')
+                    errors[upload] = error
+
+        if errors:
+            raise CsvUploadError(errors)
+
 
 class PandasDfPopulator(BasePostgresTablePopulator):
     """
@@ -130,6 +536,7 @@ class PandasDfPopulator(BasePostgresTablePopulator):
         table_definition: TableDefinition,
         pandas_df: pd.DataFrame,
         columns_dtype: Dict[str, Any] = None,
+        copy_format: CopyFormat = CopyFormat.CSV,
         **kwargs,
     ) -> None:
         super().__init__(
@@ -138,9 +545,87 @@ class PandasDfPopulator(BasePostgresTablePopulator):
         )
         self.pandas_df = pandas_df
         self.columns_dtype = columns_dtype
+        self.copy_format = copy_format
+
+    @property
+    def copies_sorted_data(self) -> bool:
+        return self.deferred_indexes and bool(self.table_definition.sort_columns)
+
+    def upload_data(self):
+        if self.copies_sorted_data and not self.table_definition.partitioning:
+            self.pandas_df = self.pandas_df.sort_values(self.table_definition.sort_columns, ignore_index=True)
+
+        self.upload_pandas_df(self.pandas_df, self.copy_format)
+
+
+class PandasDfChunksPopulator(BasePostgresTablePopulator):
+    """
+    Given an iterable of pandas DataFrames (chunks) streams them to a target table.
+    The chunks are consumed lazily so a generator keeps the memory bounded by the chunk size.
+    """
+
+    def __init__(
+        self,
+        table_definition: TableDefinition,
+        pandas_dfs: Iterable[pd.DataFrame],
+        copy_format: CopyFormat = CopyFormat.CSV,
+        **kwargs,
+    ) -> None:
+        super().__init__(
+            table_definition=table_definition,
+            **kwargs,
+        )
+        self.pandas_dfs = pandas_dfs
+        self.copy_format = copy_format
 
     def upload_data(self):
+        # Each chunk is recorded in the run report while it is copied
+        if self.table_definition.partitioning:
+            # Each chunk is split by partition and each partition copied and committed on its own since creating
+            # a partition needs a lock on the partitioned table that a long running copy would hold.
+            for chunk_number, pandas_df in enumerate(self.pandas_dfs):
+                with self.chunk_stage(chunk_number, pandas_df):
+                    self.upload_pandas_df(pandas_df, self.copy_format)
+            return
+
+        if self.use_binary_copy(self.copy_format):
+            copy_pandas_dfs_to_table_binary(
+                pandas_dfs=self.pandas_dfs,
+                table=self.copy_table,
+                db_engine=self.db_engine,
+                chunk_stage=self.chunk_stage,
+            )
+        else:
+            copy_pandas_dfs_to_table(
+                pandas_dfs=self.pandas_dfs,
+                table_name=self.copy_table.name,
+                db_engine=self.db_engine,  # noqa
+                chunk_stage=self.chunk_stage,
+            )
 
-        copy_pandas_df_to_table(
-            pandas_df=self.pandas_df, table_name=self.table_definition.table.name, db_engine=self.db_engine  # noqa
+
+class QueryPopulator(BasePostgresTablePopulator):
+    """
+    Populates a target table with the result of a query on other tables of the DB, eg: pre-aggregations
+    """
+
+    def __init__(
+        self,
+        table_definition: TableDefinition,
+        query: str,
+        **kwargs,
+    ) -> None:
+        """
+        Args:
+            - query: SELECT query returning the target table columns in the same order
+        """
+        super().__init__(
+            table_definition=table_definition,
+            **kwargs,
         )
+        self.query = query
+
+    def upload_data(self):
+        columns = ', '.join(column.name for column in self.copy_table.columns)
+        with self.run_report.stage(f'insert into {self.copy_table.name}') as stage:
+            stage.rows = self.execute(f'INSERT INTO {self.copy_table.name} ({columns}) {self.query}').rowcount
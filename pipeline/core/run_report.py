@@ -0,0 +1,197 @@
+import json
+import logging
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+import pandas as pd
+import psycopg2
+
+from pipeline.core.db_utils import get_db_conn
+
+logger = logging.getLogger(__name__)
+
+
+# Server side progress of the running COPY, CLUSTER, CREATE INDEX and ANALYZE commands
+# (pg_stat_progress_copy needs Postgres 14, the views missing from the server are skipped)
+PG_PROGRESS_VIEWS = [
+    'pg_stat_progress_copy',
+    'pg_stat_progress_cluster',
+    'pg_stat_progress_create_index',
+    'pg_stat_progress_analyze',
+]
+
+
+def get_peak_rss_bytes() -> int:
+    """
+    Peak resident set size of the process so far
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def get_pandas_df_bytes(pandas_df: pd.DataFrame) -> int:
+    return int(pandas_df.memory_usage(index=False, deep=True).sum())
+
+
+@dataclass
+class StageReport:
+    """
+    Wall time of a stage of the run, with the rows and bytes (of the csv files or of the DataFrames in memory) it
+    processed when known. peak_rss_bytes is the peak RSS of the process when the stage ended.
+    """
+
+    name: str
+    started_at_seconds: float
+    seconds: Optional[float] = None
+    rows: Optional[int] = None
+    bytes: Optional[int] = None
+    rows_per_second: Optional[float] = None
+    peak_rss_bytes: Optional[int] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class ProgressSample:
+    """
+    A row of a pg_stat_progress_* view, with the stages open when it was sampled
+    """
+
+    elapsed_seconds: float
+    view: str
+    stages: List[str]
+    progress: Dict[str, Any]
+
+
+@dataclass
+class RunReport:
+    """
+    Stages of a pipeline run (populate phases, uploaded files and chunks...) written as JSON by write.
+    The stages can be recorded from several threads (eg: the parallel csv uploads). The bytes of the DataFrames
+    are only measured with record_bytes, measuring the text columns reads every string.
+    """
+
+    started_at: str = field(default_factory=lambda: datetime.utcnow().isoformat())
+    record_bytes: bool = True
+    stages: List[StageReport] = field(default_factory=list)
+    progress: List[ProgressSample] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        self.start_time = time.perf_counter()
+        self.open_stages: List[StageReport] = []
+        self.lock = threading.Lock()
+
+    def elapsed_seconds(self) -> float:
+        return time.perf_counter() - self.start_time
+
+    @contextmanager
+    def stage(self, name: str, rows: int = None, nbytes: int = None) -> Iterator[StageReport]:
+        """
+        Records the duration of the block as a stage, the rows of the stage can also be set on the yielded
+        StageReport when they are only known at its end
+        """
+        stage = StageReport(name=name, started_at_seconds=self.elapsed_seconds(), rows=rows, bytes=nbytes)
+        with self.lock:
+            self.open_stages.append(stage)
+        try:
+            yield stage
+        except BaseException as error:
+            stage.error = repr(error)
+            raise
+        finally:
+            stage.seconds = self.elapsed_seconds() - stage.started_at_seconds
+            if stage.rows is not None and stage.seconds > 0:
+                stage.rows_per_second = stage.rows / stage.seconds
+            stage.peak_rss_bytes = get_peak_rss_bytes()
+            with self.lock:
+                self.open_stages.remove(stage)
+                self.stages.append(stage)
+            rows = f', {stage.rows} rows ({stage.rows_per_second or 0:.0f} rows/sec)' if stage.rows is not None else ''
+            logger.info(f'{name} took {stage.seconds:.2f}s{rows}, peak RSS {stage.peak_rss_bytes / 2**20:.0f}MB')
+
+    def get_pandas_df_bytes(self, pandas_df: pd.DataFrame) -> Optional[int]:
+        return get_pandas_df_bytes(pandas_df) if self.record_bytes else None
+
+    def add_progress(self, view: str, progress: Dict[str, Any]):
+        with self.lock:
+            stages = [stage.name for stage in self.open_stages]
+            self.progress.append(ProgressSample(self.elapsed_seconds(), view, stages, progress))
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'started_at': self.started_at,
+                'seconds': self.elapsed_seconds(),
+                'peak_rss_bytes': get_peak_rss_bytes(),
+                'stages': [asdict(stage) for stage in self.stages],
+                'progress': [asdict(sample) for sample in self.progress],
+            }
+
+    def write(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+        logger.info(f'Run report written to {path}')
+
+
+class PgProgressSampler:
+    """
+    Background thread adding the rows of the PG_PROGRESS_VIEWS of the database to the run report every
+    interval_seconds, with a dedicated connection
+    """
+
+    def __init__(self, run_report: RunReport, db_name: str, interval_seconds: float) -> None:
+        self.run_report = run_report
+        self.db_name = db_name
+        self.interval_seconds = interval_seconds
+        self.views = list(PG_PROGRESS_VIEWS)
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def sample(self, conn):
+        for view in list(self.views):
+            sample_sql = f"""
+                SELECT to_jsonb(progress) || jsonb_build_object('relation', progress.relid::regclass::text)
+                FROM {view} AS progress
+                WHERE progress.datname = current_database()
+            """
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(sample_sql)
+                    rows = cur.fetchall()
+            except psycopg2.errors.UndefinedTable:
+                logger.warning(f'{view} is not available on this Postgres version, not sampled')
+                self.views.remove(view)
+                continue
+            for (progress,) in rows:
+                self.run_report.add_progress(view, progress)
+
+    def run(self):
+        try:
+            conn = get_db_conn(self.db_name)
+        except psycopg2.Error as error:
+            logger.warning(f'Could not connect to sample the progress views: {error!r}')
+            return
+        try:
+            while not self.stopped.wait(self.interval_seconds):
+                try:
+                    self.sample(conn)
+                except psycopg2.Error as error:
+                    # eg: the relation of a sampled command was dropped meanwhile
+                    logger.warning(f'Could not sample the progress views: {error!r}')
+        finally:
+            conn.close()
+
+    def __enter__(self) -> 'PgProgressSampler':
+        self.thread = threading.Thread(target=self.run, name='pg-progress-sampler', daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
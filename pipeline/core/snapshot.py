@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from pipeline.tables.dataset_version import dataset_version_table
+from pipeline.tables.stock import stock_table
+
+logger = logging.getLogger(__name__)
+
+
+# Columns exported as .npy files with their NumPy dtype, sorted by (name, date)
+SNAPSHOT_COLUMNS: Dict[str, str] = {
+    'date': 'datetime64[D]',
+    'open_price': 'float64',
+    'close_price': 'float64',
+    'high_price': 'float64',
+    'low_price': 'float64',
+    'volume': 'int64',
+}
+# File holding the name of the directory of the current snapshot, replaced atomically after an export
+CURRENT_FILE = 'CURRENT'
+METADATA_FILE = 'snapshot.json'
+
+
+def get_stock_dataset_version(db_engine: Engine) -> Optional[int]:
+    return db_engine.execute(
+        text(f'SELECT version FROM {dataset_version_table.name} WHERE table_name = :table_name'),
+        table_name=stock_table.name,
+    ).scalar()
+
+
+def read_current_snapshot(snapshot_dir: str) -> Optional[str]:
+    current_path = os.path.join(snapshot_dir, CURRENT_FILE)
+    if not os.path.exists(current_path):
+        return None
+    with open(current_path) as f:
+        return f.read().strip()
+
+
+def write_current_snapshot(snapshot_dir: str, version_dir_name: str):
+    """
+    Points the CURRENT file to version_dir_name, the readers either see the previous or the new snapshot
+    """
+    tmp_path = os.path.join(snapshot_dir, f'{CURRENT_FILE}.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(version_dir_name)
+    os.replace(tmp_path, os.path.join(snapshot_dir, CURRENT_FILE))
+
+
+def prune_snapshots(snapshot_dir: str, keep: List[Optional[str]]):
+    """
+    Removes the snapshot directories not in keep, the API processes still mapping them keep their pages until
+    they reload the CURRENT snapshot
+    """
+    for name in os.listdir(snapshot_dir):
+        path = os.path.join(snapshot_dir, name)
+        if name not in keep and os.path.isdir(path):
+            shutil.rmtree(path)
+
+
+def export_stock_snapshot(
+    db_engine: Engine, snapshot_dir: str, chunk_size: int = 1_000_000, stock_source: str = stock_table.name
+) -> str:
+    """
+    Exports the stock table to a versioned columnar snapshot in snapshot_dir that the API memory maps:
+    - one .npy file per SNAPSHOT_COLUMNS column, the rows sorted by (name, date)
+    - tickers.npy: the sorted ticker names and offsets.npy: the rows of tickers[i] are offsets[i]:offsets[i + 1]
+    The rows are streamed from a server side cursor in chunks of chunk_size rows to preallocated memory mapped
+    files, so the memory is bounded by the chunk size. The snapshot directory is written aside and published by
+    replacing the CURRENT file, only the previous snapshot is kept. The rows are read from stock_source, the stock
+    table or a subquery with its columns. Returns the snapshot directory name.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    version = get_stock_dataset_version(db_engine)
+    version_dir_name = f'{stock_table.name}_v{version}_{datetime.utcnow():%Y%m%dT%H%M%S}'
+    tmp_dir = os.path.join(snapshot_dir, f'{version_dir_name}.tmp')
+    os.makedirs(tmp_dir)
+
+    n_rows = db_engine.execute(f'SELECT count(*) FROM {stock_table.name}').scalar()
+    columns = {
+        column: open_memmap(os.path.join(tmp_dir, f'{column}.npy'), mode='w+', dtype=dtype, shape=(n_rows,))
+        for column, dtype in SNAPSHOT_COLUMNS.items()
+    }
+    tickers: List[str] = []
+    ticker_counts: List[int] = []
+
+    # Sorted by code point like np.unique and the np.searchsorted lookups of the API, the linguistic collations
+    # ignore the punctuation (eg: BF-B, BRK.B)
+    query = f'SELECT name, {", ".join(SNAPSHOT_COLUMNS)} FROM {stock_source} ORDER BY name COLLATE "C", date'
+    position = 0
+    with db_engine.connect().execution_options(stream_results=True) as conn:
+        for chunk in pd.read_sql(query, conn, chunksize=chunk_size):
+            chunk_rows = len(chunk)
+            columns['date'][position : position + chunk_rows] = pd.to_datetime(chunk['date']).to_numpy()  # noqa: E203
+            for column in SNAPSHOT_COLUMNS:
+                if column != 'date':
+                    columns[column][position : position + chunk_rows] = chunk[column].to_numpy()  # noqa: E203
+            position += chunk_rows
+
+            # The names are sorted, a ticker can only span the boundary between two chunks
+            names, counts = np.unique(chunk['name'].to_numpy(dtype=str), return_counts=True)
+            if tickers and names[0] == tickers[-1]:
+                ticker_counts[-1] += int(counts[0])
+                names, counts = names[1:], counts[1:]
+            tickers.extend(names.tolist())
+            ticker_counts.extend(counts.tolist())
+
+    for array in columns.values():
+        array.flush()
+    np.save(os.path.join(tmp_dir, 'tickers.npy'), np.array(tickers, dtype=str))
+    np.save(os.path.join(tmp_dir, 'offsets.npy'), np.concatenate(([0], np.cumsum(ticker_counts, dtype=np.int64))))
+    with open(os.path.join(tmp_dir, METADATA_FILE), 'w') as f:
+        json.dump({'table': stock_table.name, 'dataset_version': version, 'rows': n_rows, 'tickers': len(tickers)}, f)
+
+    os.rename(tmp_dir, os.path.join(snapshot_dir, version_dir_name))
+    previous_dir_name = read_current_snapshot(snapshot_dir)
+    write_current_snapshot(snapshot_dir, version_dir_name)
+    prune_snapshots(snapshot_dir, keep=[version_dir_name, previous_dir_name])
+
+    logger.info(f'Exported {n_rows} rows of {len(tickers)} tickers to the {version_dir_name} snapshot')
+    return version_dir_name
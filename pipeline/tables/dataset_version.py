@@ -0,0 +1,18 @@
+from sqlalchemy import BigInteger, Column, DateTime, MetaData, Table, Text, func
+
+sqla_metadata = MetaData()
+
+
+# Version of each loaded table, incremented by every load that changes the table. Readers caching the data
+# (eg: the API price cache) compare it with the version they cached to know when to drop their copy.
+dataset_version_table = Table(
+    'dataset_version',
+    sqla_metadata,
+    Column('table_name', Text, primary_key=True),
+    Column('version', BigInteger, nullable=False),
+    Column('loaded_at', DateTime, nullable=False, server_default=func.now()),
+)
+
+# Channel notified with {"table": table name, "version": new version} when a load is committed, the API listens to
+# it to drop its caches immediately
+DATASET_VERSION_CHANNEL = 'dataset_version'
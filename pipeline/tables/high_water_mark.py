@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Date, DateTime, MetaData, Table, Text, func
+
+sqla_metadata = MetaData()
+
+
+# Last loaded date of each group (eg: ticker) of the incrementally loaded tables
+high_water_mark_table = Table(
+    'high_water_mark',
+    sqla_metadata,
+    Column('table_name', Text, primary_key=True),
+    Column('group_value', Text, primary_key=True),
+    Column('high_water_mark', Date, nullable=False),
+    Column('updated_at', DateTime, nullable=False, server_default=func.now()),
+)
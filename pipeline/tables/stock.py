@@ -39,4 +39,7 @@ stock_table_definition = TableDefinition(
     table=stock_table,
     indexes_list=stock_table_indexes,
     post_copy_sql=f'CLUSTER {stock_table.name} USING {idx_name_date}',
+    high_water_mark_column=stock_table.c.date.name,
+    high_water_mark_group_column=stock_table.c.name.name,
+    sort_columns=[stock_table.c.name.name, stock_table.c.date.name],
 )
@@ -0,0 +1,69 @@
+from enum import Enum
+
+from sqlalchemy import BigInteger, Column, Date, Integer, MetaData, SmallInteger, Table, Text
+
+from pipeline.tables.stock import StockExchangeEnum, stock_table
+from pipeline.tables.table_definition import TableDefinition
+
+sqla_metadata = MetaData()
+
+PRICE_COLUMNS = ['open_price', 'close_price', 'high_price', 'low_price']
+
+
+class StockSchema(Enum):
+    # name and market as text, prices as double precision
+    DEFAULT = 'default'
+    # ticker_id referencing the ticker table, market code, prices as scaled integers, see stock_compact_table
+    COMPACT = 'compact'
+
+
+# Code of each market stored in the market column of the compact stock table
+MARKET_CODES = {StockExchangeEnum.NASDAQ.value: 1, StockExchangeEnum.NYSE.value: 2}
+
+# Dictionary of the ticker names, the ids are kept across the full loads
+ticker_table = Table(
+    'ticker',
+    sqla_metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', Text, nullable=False, unique=True),
+)
+
+# Same rows as the stock table with narrower columns: the ticker name is replaced by its ticker id, the market by
+# its MARKET_CODES code and the prices are integers in units of 10^-price_decimals (4 bytes instead of 8). Each
+# (ticker_id, date) key takes 8 bytes instead of the ticker text and the date.
+stock_compact_table = Table(
+    stock_table.name,
+    sqla_metadata,
+    Column('ticker_id', Integer, primary_key=True),
+    Column('date', Date, primary_key=True),
+    *[Column(price_column, Integer, nullable=False) for price_column in PRICE_COLUMNS],
+    Column('volume', BigInteger, nullable=False),
+    Column('market', SmallInteger),
+)
+
+
+def get_stock_compact_source_sql(price_decimals: int) -> str:
+    """
+    Returns a subquery decoding the compact stock table to the name, date, prices and volume columns of the
+    stock table, for the queries reading the stock table (eg: the stock_moments and stock_range_index queries)
+    """
+    stock, ticker = stock_compact_table.name, ticker_table.name
+    prices_sql = ', '.join(
+        f'{stock}.{price_column}::double precision / {10 ** price_decimals} AS {price_column}'
+        for price_column in PRICE_COLUMNS
+    )
+    return f"""(
+        SELECT {ticker}.name, {stock}.date, {prices_sql}, {stock}.volume
+        FROM {stock} JOIN {ticker} ON {ticker}.id = {stock}.ticker_id
+    ) AS {stock_table.name}"""
+
+
+# The primary key index is the only index, the rows are clustered on it
+stock_compact_table_definition = TableDefinition(
+    table=stock_compact_table,
+    indexes_list=[],
+    post_copy_sql=f'CLUSTER {stock_compact_table.name} USING {stock_compact_table.name}_pkey',
+    high_water_mark_column=stock_compact_table.c.date.name,
+    high_water_mark_group_column=stock_compact_table.c.ticker_id.name,
+    sort_columns=[stock_compact_table.c.ticker_id.name, stock_compact_table.c.date.name],
+)
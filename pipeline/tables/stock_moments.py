@@ -0,0 +1,57 @@
+from sqlalchemy import Column, Date, Index, Integer, MetaData, Numeric, Table, Text
+
+from pipeline.tables.stock import stock_table
+from pipeline.tables.table_definition import TableDefinition
+
+sqla_metadata = MetaData()
+
+PRICE_COLUMNS = ['open_price', 'close_price', 'high_price', 'low_price']
+
+
+# Per ticker prefix sums of the prices and of their squares: the row of ordinal i holds the sums of the first i
+# rows of the ticker ordered by date. The sum over the rolling window ending at ordinal i is the difference
+# with the prefix of ordinal i - rolling_window, which answers the rolling mean and standard deviation
+# without reading the raw prices.
+# The sums are exact numeric sums (floats are casted to numeric) so that differencing big prefixes doesn't
+# lose precision.
+stock_moments_table = Table(
+    'stock_moments',
+    sqla_metadata,
+    Column('name', Text, primary_key=True),
+    Column('ordinal', Integer, primary_key=True),
+    Column('date', Date, nullable=False),
+    *[
+        Column(f'{price_column}{suffix}', Numeric, nullable=False)
+        for price_column in PRICE_COLUMNS
+        for suffix in ('_sum', '_sum_squares')
+    ],
+)
+
+idx_moments_name_date = 'idx_moments_name_date'
+stock_moments_table_indexes = [
+    Index(idx_moments_name_date, stock_moments_table.c.name, stock_moments_table.c.date, postgresql_using='btree')
+]
+
+moments_columns_sql = ', '.join(
+    f'sum({price_column}::numeric) OVER w, sum({price_column}::numeric * {price_column}::numeric) OVER w'
+    for price_column in PRICE_COLUMNS
+)
+
+
+def get_stock_moments_query(stock_source: str = stock_table.name) -> str:
+    """
+    Returns the query computing the prefix sums from stock_source, the stock table or a subquery with its columns
+    """
+    # Sorted by (name, ordinal) so that the inserted table is physically ordered as its primary key
+    return f"""
+        SELECT name, row_number() OVER w AS ordinal, date, {moments_columns_sql}
+        FROM {stock_source}
+        WINDOW w AS (PARTITION BY name ORDER BY date ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW)
+        ORDER BY name, date
+    """
+
+
+stock_moments_table_definition = TableDefinition(
+    table=stock_moments_table,
+    indexes_list=stock_moments_table_indexes,
+)
@@ -0,0 +1,101 @@
+from sqlalchemy import Column, Date, Float, Index, Integer, MetaData, Table, Text
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from pipeline.tables.stock import stock_table
+from pipeline.tables.table_definition import TableDefinition
+
+sqla_metadata = MetaData()
+
+PRICE_COLUMNS = ['open_price', 'close_price', 'high_price', 'low_price']
+RANGE_AGGREGATES = {'min': 'LEAST', 'max': 'GREATEST'}
+
+
+# Per ticker sparse tables of the min and max of the prices: element k (1-based k + 1) of the arrays of the row of
+# ordinal i holds the min (max) of the prices of the 2^k rows of the ticker ending at ordinal i (fewer for the
+# first rows). The min over the rolling window of w rows ending at ordinal i is the min of the element
+# k = floor(log2(w)) of the rows of ordinals i and i - w + 2^k, which answers the rolling min and max of windows
+# up to 2^levels - 1 rows without reading the raw prices.
+stock_range_index_table = Table(
+    'stock_range_index',
+    sqla_metadata,
+    Column('name', Text, primary_key=True),
+    Column('ordinal', Integer, primary_key=True),
+    Column('date', Date, nullable=False),
+    *[
+        Column(f'{price_column}_{aggregate}', ARRAY(Float), nullable=False)
+        for price_column in PRICE_COLUMNS
+        for aggregate in RANGE_AGGREGATES
+    ],
+)
+
+idx_range_index_name_date = 'idx_range_index_name_date'
+stock_range_index_table_indexes = [
+    Index(
+        idx_range_index_name_date,
+        stock_range_index_table.c.name,
+        stock_range_index_table.c.date,
+        postgresql_using='btree',
+    )
+]
+
+
+def get_range_index_levels(max_rolling_window: int) -> int:
+    """
+    Returns the number of levels of the sparse tables needed by the windows up to max_rolling_window rows
+    """
+    return max_rolling_window.bit_length()
+
+
+def get_stock_range_index_query(levels: int, stock_source: str = stock_table.name) -> str:
+    """
+    Returns the query building the sparse tables with levels levels from stock_source (the stock table or a
+    subquery with its columns): the level k is computed from the level k - 1 of the row and of the row
+    2^(k - 1) rows before, one window pass per level
+    """
+    level_columns = [
+        f'{price_column} AS {price_column}_{aggregate}_0'
+        for price_column in PRICE_COLUMNS
+        for aggregate in RANGE_AGGREGATES
+    ]
+    level_queries = [
+        f"""level_0 AS (
+            SELECT name, row_number() OVER (PARTITION BY name ORDER BY date) AS ordinal, date,
+                {', '.join(level_columns)}
+            FROM {stock_source}
+        )"""
+    ]
+    for level in range(1, levels):
+        # LEAST and GREATEST ignore the NULL lag of the first rows of each ticker
+        level_columns = [
+            f'{function}({price_column}_{aggregate}_{level - 1}, '
+            f'lag({price_column}_{aggregate}_{level - 1}, {2 ** (level - 1)}) OVER w) '
+            f'AS {price_column}_{aggregate}_{level}'
+            for price_column in PRICE_COLUMNS
+            for aggregate, function in RANGE_AGGREGATES.items()
+        ]
+        level_queries.append(
+            f"""level_{level} AS (
+            SELECT *, {', '.join(level_columns)}
+            FROM level_{level - 1}
+            WINDOW w AS (PARTITION BY name ORDER BY ordinal)
+        )"""
+        )
+
+    array_columns = ', '.join(
+        f"ARRAY[{', '.join(f'{price_column}_{aggregate}_{level}' for level in range(levels))}]"
+        for price_column in PRICE_COLUMNS
+        for aggregate in RANGE_AGGREGATES
+    )
+    # Sorted by (name, ordinal) so that the inserted table is physically ordered as its primary key
+    return f"""
+        WITH {', '.join(level_queries)}
+        SELECT name, ordinal, date, {array_columns}
+        FROM level_{levels - 1}
+        ORDER BY name, ordinal
+    """
+
+
+stock_range_index_table_definition = TableDefinition(
+    table=stock_range_index_table,
+    indexes_list=stock_range_index_table_indexes,
+)
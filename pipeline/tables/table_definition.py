@@ -1,7 +1,68 @@
 from dataclasses import dataclass
+from datetime import date
+from enum import Enum
 from typing import List
 
-from sqlalchemy import Index, Table
+from sqlalchemy import Column, Index, MetaData, Table
+
+
+class PartitionInterval(Enum):
+    MONTH = 'month'
+    YEAR = 'year'
+
+
+@dataclass
+class TablePartitioning:
+    """Declarative partitioning of a table:
+    - range_column: Date column the table is range partitioned on, one partition per interval
+    - interval: Range covered by each partition
+    - hash_column: Optional column the range partitions are sub-partitioned on by hash, eg: the ticker name
+    - hash_partitions: Number of hash sub-partitions of each range partition
+    """
+
+    range_column: str
+    interval: PartitionInterval = PartitionInterval.MONTH
+    hash_column: str = None
+    hash_partitions: int = None
+
+    def get_lower_bound(self, day: date) -> date:
+        """
+        Returns the lower bound (included) of the range partition containing day
+        """
+        if self.interval == PartitionInterval.YEAR:
+            return date(day.year, 1, 1)
+        return date(day.year, day.month, 1)
+
+    def get_upper_bound(self, lower_bound: date) -> date:
+        """
+        Returns the upper bound (excluded) of the range partition starting at lower_bound
+        """
+        if self.interval == PartitionInterval.YEAR or lower_bound.month == 12:
+            return date(lower_bound.year + 1, 1, 1)
+        return date(lower_bound.year, lower_bound.month + 1, 1)
+
+    def get_partition_name(self, table_name: str, lower_bound: date) -> str:
+        suffix = lower_bound.strftime('%Y' if self.interval == PartitionInterval.YEAR else '%Y_%m')
+        return f'{table_name}_{suffix}'
+
+    def get_create_partition_sql(self, table_name: str, lower_bound: date) -> List[str]:
+        """
+        Returns the queries creating the range partition starting at lower_bound and its hash sub-partitions
+        """
+        partition_name = self.get_partition_name(table_name, lower_bound)
+        upper_bound = self.get_upper_bound(lower_bound)
+        create_partition_sql = (
+            f'CREATE TABLE IF NOT EXISTS {partition_name} PARTITION OF {table_name} '
+            f"FOR VALUES FROM ('{lower_bound.isoformat()}') TO ('{upper_bound.isoformat()}')"
+        )
+        if not self.hash_column:
+            return [create_partition_sql]
+
+        return [f'{create_partition_sql} PARTITION BY HASH ({self.hash_column})'] + [
+            f'CREATE TABLE IF NOT EXISTS {partition_name}_h{remainder} PARTITION OF {partition_name} '
+            f'FOR VALUES WITH (MODULUS {self.hash_partitions}, REMAINDER {remainder})'
+            for remainder in range(self.hash_partitions)
+        ]
 
 
 @dataclass
@@ -10,9 +71,62 @@ class TableDefinition:
     - table: Sqla table
     - indexes_list: List of sqla indexes to be created when the table is populated
     - post_copy_sql: Optional query to be run after the indexes and the table is populated
-        can be for clustering.
+        can be for clustering. It isn't run for partitioned tables that can't be clustered.
+    - high_water_mark_column: Optional column (date) tracked per high_water_mark_group_column value for the
+        incremental loads, rows older than the high water mark of their group are skipped.
+    - high_water_mark_group_column: Column grouping the high water marks, eg: the ticker name
+    - sort_columns: Optional columns order in which the bulk loads copy the data, when the data is copied sorted
+        the post_copy_sql (clustering) is skipped.
+    - partitioning: Optional TablePartitioning, the partitions are created on the fly when the data is loaded
     """
 
     table: Table
     indexes_list: List[Index]
     post_copy_sql: str = None
+    high_water_mark_column: str = None
+    high_water_mark_group_column: str = None
+    sort_columns: List[str] = None
+    partitioning: TablePartitioning = None
+
+    @property
+    def primary_key_columns(self) -> List[str]:
+        return [column.name for column in self.table.primary_key.columns]
+
+    @property
+    def partition_by(self) -> str:
+        return f'RANGE ({self.partitioning.range_column})' if self.partitioning else None
+
+    def bare_table(self, name: str = None, partitioned: bool = False, **table_kwargs) -> Table:
+        """
+        Returns a copy of the table holding only the columns, without primary key, constraints and indexes,
+        named name (defaults to the table name) in a separate metadata.
+        When partitioned the copy is partitioned as declared by the partitioning.
+        """
+        if partitioned and self.partitioning:
+            table_kwargs['postgresql_partition_by'] = self.partition_by
+
+        return Table(
+            name or self.table.name,
+            MetaData(),
+            *[Column(column.name, column.type, nullable=column.nullable) for column in self.table.columns],
+            **table_kwargs,
+        )
+
+    def partitioned_table(self) -> Table:
+        """
+        Returns a copy of the table with its primary key, partitioned as declared by the partitioning.
+        The indexes of the table are created on the partitioned table, Postgres creates them on each partition.
+        """
+        return Table(
+            self.table.name,
+            MetaData(),
+            *[
+                Column(column.name, column.type, nullable=column.nullable, primary_key=column.primary_key)
+                for column in self.table.columns
+            ],
+            postgresql_partition_by=self.partition_by,
+        )
+
+    @property
+    def add_primary_key_sql(self) -> str:
+        return f'ALTER TABLE {self.table.name} ADD PRIMARY KEY ({", ".join(self.primary_key_columns)})'
@@ -0,0 +1,158 @@
+import struct
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import BigInteger, Column, Date, Float, Integer, MetaData, SmallInteger, Table, Text
+
+from pipeline.core.binary_copy import (
+    PG_COPY_BINARY_HEADER,
+    PG_COPY_BINARY_TRAILER,
+    copy_pandas_df_to_table_binary,
+    encode_pandas_df_to_pg_binary,
+)
+from pipeline.core.db_utils import copy_pandas_df_to_table
+from pipeline.tables.stock import stock_table_definition
+from pipeline.tests.test_utils import get_test_db_engine
+
+test_db_engine = get_test_db_engine()
+
+encoded_table = Table(
+    'encoded',
+    MetaData(),
+    Column('name', Text),
+    Column('date', Date),
+    Column('price', Float),
+    Column('volume', BigInteger),
+    Column('count', Integer),
+    Column('code', SmallInteger),
+)
+
+
+def decode_tuples(data: bytes) -> List[List[Optional[bytes]]]:
+    """
+    Splits binary copy tuples (without header and trailer) into the bytes of their fields, None for NULL
+    """
+    tuples, position = [], 0
+    while position < len(data):
+        (n_fields,) = struct.unpack_from('!h', data, position)
+        position += 2
+        fields = []
+        for _ in range(n_fields):
+            (length,) = struct.unpack_from('!i', data, position)
+            position += 4
+            if length == -1:
+                fields.append(None)
+            else:
+                fields.append(data[position : position + length])  # noqa: E203
+                position += length
+        tuples.append(fields)
+    return tuples
+
+
+def test_header_and_trailer():
+    # Signature, flags and header extension length
+    assert PG_COPY_BINARY_HEADER == b'PGCOPY\n\xff\r\n\x00' + b'\x00\x00\x00\x00' + b'\x00\x00\x00\x00'
+    assert PG_COPY_BINARY_TRAILER == b'\xff\xff'
+
+
+def test_encoded_tuples():
+    pandas_df = pd.DataFrame(
+        {
+            'name': ['BRK.B', None, 'Ä'],
+            'date': ['2000-01-01', '2010-01-04', None],
+            'price': [1.5, np.nan, -2.25],
+            'volume': [2**40, 0, -1],
+            'count': [7, -7, 2**31 - 1],
+            'code': [1, 2, -(2**15)],
+        }
+    )
+
+    tuples = decode_tuples(encode_pandas_df_to_pg_binary(pandas_df, encoded_table))
+
+    assert [len(fields) for fields in tuples] == [6, 6, 6]
+    assert tuples[0] == [
+        b'BRK.B',
+        struct.pack('!i', 0),  # days since the Postgres epoch 2000-01-01
+        struct.pack('!d', 1.5),
+        struct.pack('!q', 2**40),
+        struct.pack('!i', 7),
+        struct.pack('!h', 1),
+    ]
+    assert tuples[1] == [
+        None,
+        struct.pack('!i', 3656),
+        None,
+        struct.pack('!q', 0),
+        struct.pack('!i', -7),
+        struct.pack('!h', 2),
+    ]
+    assert tuples[2] == [
+        'Ä'.encode('utf-8'),
+        None,
+        struct.pack('!d', -2.25),
+        struct.pack('!q', -1),
+        struct.pack('!i', 2**31 - 1),
+        struct.pack('!h', -(2**15)),
+    ]
+
+
+def test_empty_dataframe_has_no_tuples():
+    pandas_df = pd.DataFrame(columns=[column.name for column in encoded_table.columns])
+
+    assert encode_pandas_df_to_pg_binary(pandas_df, encoded_table) == b''
+
+
+@pytest.mark.parametrize(
+    'column,value',
+    [('count', 2**31), ('count', -(2**31) - 1), ('code', 2**15), ('volume', 2**63)],
+)
+def test_integer_overflow_is_rejected(column: str, value: int):
+    pandas_df = pd.DataFrame(
+        {'name': ['AA'], 'date': ['2010-01-04'], 'price': [1.0], 'volume': [1], 'count': [1], 'code': [1]}
+    )
+    pandas_df[column] = pd.Series([value], dtype=object if value >= 2**63 else np.int64)
+
+    with pytest.raises(ValueError, match=f'{column} values overflow'):
+        encode_pandas_df_to_pg_binary(pandas_df, encoded_table)
+
+
+@pytest.fixture()
+def copied_tables() -> Tuple[Table, Table]:
+    tables = (stock_table_definition.bare_table('stock_binary'), stock_table_definition.bare_table('stock_csv'))
+    for table in tables:
+        table.drop(test_db_engine, checkfirst=True)
+        table.create(test_db_engine)
+
+    yield tables
+
+    for table in tables:
+        table.drop(test_db_engine, checkfirst=True)
+
+
+def test_binary_copy_matches_the_csv_copy(copied_tables):
+    binary_table, csv_table = copied_tables
+    rng = np.random.default_rng(0)
+    n_rows = 1000
+    pandas_df = pd.DataFrame(
+        {
+            'name': rng.choice(['AA', 'BRK.B', 'BF-B', 'Ä'], size=n_rows),
+            'date': (np.datetime64('1990-01-01') + rng.integers(0, 20_000, size=n_rows)).astype(str),
+            'open_price': rng.normal(100, 50, size=n_rows),
+            'close_price': rng.normal(100, 50, size=n_rows),
+            'high_price': rng.normal(100, 50, size=n_rows),
+            'low_price': rng.normal(100, 50, size=n_rows),
+            'volume': rng.integers(0, 2**31 - 1, size=n_rows),
+            'market': rng.choice(['NYSE', 'NASDAQ', None], size=n_rows),
+        }
+    )
+
+    assert copy_pandas_df_to_table_binary(pandas_df, binary_table, test_db_engine, batch_size=300) == n_rows
+    copy_pandas_df_to_table(pandas_df, csv_table.name, test_db_engine)
+
+    query = 'SELECT * FROM {} ORDER BY name, date, open_price'
+    binary_df = pd.read_sql(query.format(binary_table.name), test_db_engine)
+    csv_df = pd.read_sql(query.format(csv_table.name), test_db_engine)
+    assert len(binary_df) == n_rows
+    pd.testing.assert_frame_equal(binary_df, csv_df)
@@ -0,0 +1,74 @@
+import pandas as pd
+import pytest
+
+from pipeline.core.populator import PandasDfChunksPopulator, PandasDfPopulator
+from pipeline.tables.dataset_version import dataset_version_table
+from pipeline.tables.high_water_mark import high_water_mark_table
+from pipeline.tables.stock import idx_name_date, stock_table, stock_table_definition
+from pipeline.tests.test_utils import get_stock_df, get_test_db_engine, read_table
+
+test_db_engine = get_test_db_engine()
+
+
+@pytest.fixture()
+def stock_df():
+    # Not sorted by the sort_columns, so that the sorted copy has to sort it
+    stock_df = get_stock_df(['BB', 'AA', 'CC'], ['2010-01-06', '2010-01-04', '2010-01-05'])
+    stock_df['open_price'] = range(len(stock_df))
+    stock_df.loc[0, 'market'] = None
+
+    yield stock_df
+
+    for table in [stock_table, dataset_version_table, high_water_mark_table]:
+        table.drop(test_db_engine, checkfirst=True)
+
+
+def get_indexes() -> dict:
+    """
+    Returns the definitions of the indexes of the stock table by index name
+    """
+    rows = test_db_engine.execute(f"SELECT indexname, indexdef FROM pg_indexes WHERE tablename = '{stock_table.name}'")
+    return dict(rows.fetchall())
+
+
+def get_physical_order() -> list:
+    rows = test_db_engine.execute(f'SELECT name, date::text FROM {stock_table.name} ORDER BY ctid')
+    return [tuple(row) for row in rows]
+
+
+@pytest.mark.parametrize(
+    'get_populator',
+    [
+        lambda stock_df, **kwargs: PandasDfPopulator(
+            table_definition=stock_table_definition, pandas_df=stock_df, **kwargs
+        ),
+        lambda stock_df, **kwargs: PandasDfChunksPopulator(
+            table_definition=stock_table_definition, pandas_dfs=[stock_df.iloc[:4], stock_df.iloc[4:]], **kwargs
+        ),
+    ],
+    ids=['sorted_copy', 'chunks'],
+)
+def test_bulk_load_builds_the_deferred_indexes_and_loads_the_rows_of_populate(stock_df, get_populator):
+    get_populator(stock_df, db_engine=test_db_engine).populate()
+    expected_indexes = get_indexes()
+    expected_df = read_table(test_db_engine, stock_table.name)
+
+    populator = get_populator(
+        stock_df,
+        db_engine=test_db_engine,
+        deferred_indexes=True,
+        maintenance_work_mem='64MB',
+        max_parallel_maintenance_workers=0,
+    )
+    populator.populate()
+
+    assert get_indexes() == expected_indexes
+    assert set(expected_indexes) == {f'{stock_table.name}_pkey', idx_name_date}
+    pd.testing.assert_frame_equal(read_table(test_db_engine, stock_table.name), expected_df)
+
+    # The sorted copy replaces the clustering post_copy_sql, either way the rows end up in the index order
+    assert get_physical_order() == sorted(get_physical_order())
+    assert ('post_copy_sql' in populator.phase_durations) == (not populator.copies_sorted_data)
+    assert {'create_heap', 'upload', 'primary_key', f'index_{idx_name_date}', 'analyze'} <= set(
+        populator.phase_durations
+    )
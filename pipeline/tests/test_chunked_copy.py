@@ -0,0 +1,67 @@
+import contextlib
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import BigInteger, Column, Date, Float, MetaData, Table, Text
+
+from pipeline.core.db_utils import copy_pandas_dfs_to_table
+from pipeline.tests.test_utils import get_test_db_engine
+
+test_db_engine = get_test_db_engine()
+
+chunks_table = Table(
+    'chunks',
+    MetaData(),
+    Column('name', Text),
+    Column('date', Date),
+    Column('price', Float),
+    Column('volume', BigInteger),
+)
+
+
+@pytest.fixture()
+def create_chunks_table():
+    chunks_table.drop(test_db_engine, checkfirst=True)
+    chunks_table.create(test_db_engine)
+
+    yield
+
+    chunks_table.drop(test_db_engine, checkfirst=True)
+
+
+def test_chunks_are_streamed_to_the_table(create_chunks_table):
+    n_rows = 100
+    pandas_df = pd.DataFrame(
+        {
+            'name': [f'T{row}' for row in range(n_rows)],
+            'date': [date(2010, 1, 1) + pd.Timedelta(days=row) for row in range(n_rows)],
+            # Not rounded by the csv serialization
+            'price': np.random.default_rng(0).normal(100, 50, size=n_rows),
+            'volume': pd.array(range(n_rows), dtype='Int64'),
+        }
+    )
+    pandas_df.loc[[1, 50], 'name'] = None
+    pandas_df.loc[[2, 51], 'date'] = None
+    pandas_df.loc[[3, 52], 'price'] = np.nan
+    pandas_df.loc[[4, 53], 'volume'] = pd.NA
+    chunk_numbers = []
+
+    @contextlib.contextmanager
+    def chunk_stage(chunk_number: int, chunk_df: pd.DataFrame):
+        chunk_numbers.append(chunk_number)
+        yield
+
+    # A generator of chunks, including an empty one
+    pandas_dfs = (pandas_df.iloc[start : start + 30] for start in [0, 30, 60, 90, 100])  # noqa: E203
+    copied_rows = copy_pandas_dfs_to_table(pandas_dfs, chunks_table.name, test_db_engine, chunk_stage=chunk_stage)
+
+    assert copied_rows == n_rows
+    assert chunk_numbers == [0, 1, 2, 3, 4]
+    copied_df = pd.read_sql(f'SELECT * FROM {chunks_table.name} ORDER BY date NULLS FIRST, name', test_db_engine)
+    copied_df = copied_df.astype({'volume': 'Int64'})
+    expected_df = pandas_df.sort_values(['date', 'name'], ignore_index=True, na_position='first')
+    pd.testing.assert_frame_equal(copied_df, expected_df, check_dtype=False)
+    # The NULLs are copied as NULLs
+    assert copied_df.isna().sum().to_dict() == {'name': 2, 'date': 2, 'price': 2, 'volume': 2}
@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline.core.compact import encode_prices
+
+
+def test_encode_prices_scales_to_integers():
+    prices = pd.Series([12.34, 0.0001, 0.5], name='close_price')
+
+    assert encode_prices(prices, price_decimals=4).tolist() == [123400, 1, 5000]
+    assert encode_prices(prices, price_decimals=4).dtype == np.int32
+
+
+@pytest.mark.parametrize(
+    'prices,error',
+    [
+        ([12.34, np.nan], 'close_price has missing values'),
+        ([12.34, 300_000.0], 'close_price values overflow the integer column with 4 decimals'),
+        ([-300_000.0], 'close_price values overflow the integer column with 4 decimals'),
+    ],
+)
+def test_encode_prices_rejects_the_values_not_fitting_the_integer_column(prices, error):
+    with pytest.raises(ValueError, match=error):
+        encode_prices(pd.Series(prices, name='close_price'), price_decimals=4)
@@ -0,0 +1,103 @@
+from typing import Tuple
+
+import pandas as pd
+import pytest
+
+from pipeline.core.db_utils import FileRangeReader, get_csv_file_byte_ranges
+from pipeline.core.populator import CsvFilePopulator, CsvUploadError
+from pipeline.tables.dataset_version import dataset_version_table
+from pipeline.tables.high_water_mark import high_water_mark_table
+from pipeline.tables.stock import stock_table, stock_table_definition
+from pipeline.tests.test_utils import get_stock_df, get_test_db_engine, read_table
+
+test_db_engine = get_test_db_engine()
+
+TICKERS = ['AA', 'BB', 'CC']
+DATES = [day.strftime('%Y-%m-%d') for day in pd.bdate_range(start='2010-01-04', periods=20)]
+
+
+@pytest.fixture()
+def drop_tables():
+    yield
+
+    for table in [stock_table, dataset_version_table, high_water_mark_table]:
+        table.drop(test_db_engine, checkfirst=True)
+
+
+def write_csv_file(path, pandas_df: pd.DataFrame, header: bool = False, last_newline: bool = True) -> bytes:
+    content = pandas_df.to_csv(header=header, index=False).encode()
+    if not last_newline:
+        content = content.rstrip(b'\n')
+    path.write_bytes(content)
+    return content
+
+
+@pytest.mark.parametrize('header', [False, True])
+@pytest.mark.parametrize('last_newline', [True, False])
+@pytest.mark.parametrize('split_size_bytes', [1, 50, 333, 10_000])
+def test_byte_ranges_split_the_file_on_line_boundaries(tmp_path, header, last_newline, split_size_bytes):
+    csv_file_path = tmp_path / 'stock.csv'
+    content = write_csv_file(csv_file_path, get_stock_df(TICKERS, DATES), header=header, last_newline=last_newline)
+
+    byte_ranges = get_csv_file_byte_ranges(str(csv_file_path), split_size_bytes)
+
+    # The ranges follow each other from the start to the end of the file
+    assert byte_ranges[0][0] == 0
+    assert byte_ranges[-1][1] == len(content)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(byte_ranges, byte_ranges[1:]))
+
+    parts = []
+    with open(csv_file_path, 'rb') as f:
+        for start, end in byte_ranges:
+            reader = FileRangeReader(f, start, end)
+            # Read by lines as the COPY of a range does, without going past the end of the range
+            part = b''.join(iter(reader.readline, b''))
+            assert part == content[start:end]
+            assert part.endswith(b'\n') or end == len(content)
+            parts.append(part)
+    assert b''.join(parts) == content
+
+
+def test_parallel_load_of_the_split_files_loads_the_rows_of_a_single_worker(tmp_path, drop_tables):
+    pandas_dfs = [get_stock_df([ticker], DATES, price=price) for price, ticker in enumerate(TICKERS, start=2)]
+    csv_file_names = []
+    for number, pandas_df in enumerate(pandas_dfs):
+        csv_file_names.append(f'stock_{number}.csv')
+        write_csv_file(tmp_path / csv_file_names[-1], pandas_df, last_newline=number > 0)
+
+    def load(**kwargs) -> Tuple[CsvFilePopulator, pd.DataFrame]:
+        populator = CsvFilePopulator(
+            table_definition=stock_table_definition,
+            csv_file_names=csv_file_names,
+            csv_files_dir_path=str(tmp_path),
+            db_engine=test_db_engine,
+            **kwargs,
+        )
+        populator.populate()
+        return populator, read_table(test_db_engine, stock_table.name)
+
+    _, single_worker_df = load()
+    parallel_populator, parallel_df = load(max_workers=4, split_size_bytes=200)
+
+    assert len(parallel_populator.get_uploads()) > len(csv_file_names)
+    assert len(single_worker_df) == len(TICKERS) * len(DATES)
+    pd.testing.assert_frame_equal(parallel_df, single_worker_df)
+
+
+def test_failed_upload_raises_the_errors_of_every_failed_worker(tmp_path, drop_tables):
+    write_csv_file(tmp_path / 'valid.csv', get_stock_df(['AA'], DATES))
+    invalid_df = get_stock_df(['BB'], DATES)
+    invalid_df.loc[3, 'date'] = 'not a date'
+    write_csv_file(tmp_path / 'invalid.csv', invalid_df)
+
+    populator = CsvFilePopulator(
+        table_definition=stock_table_definition,
+        csv_file_names=['valid.csv', 'invalid.csv'],
+        csv_files_dir_path=str(tmp_path),
+        db_engine=test_db_engine,
+        max_workers=2,
+    )
+    with pytest.raises(CsvUploadError) as error:
+        populator.populate()
+
+    assert list(error.value.errors) == [str(tmp_path / 'invalid.csv')]
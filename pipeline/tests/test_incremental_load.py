@@ -0,0 +1,83 @@
+import pandas as pd
+import pytest
+
+from pipeline.core.populator import PandasDfChunksPopulator
+from pipeline.core.run_report import RunReport
+from pipeline.tables.dataset_version import dataset_version_table
+from pipeline.tables.high_water_mark import high_water_mark_table
+from pipeline.tables.stock import stock_table, stock_table_definition
+from pipeline.tests.test_utils import get_stock_df, get_test_db_engine, read_table
+
+test_db_engine = get_test_db_engine()
+
+
+@pytest.fixture()
+def drop_tables():
+    yield
+
+    for table in [stock_table, dataset_version_table, high_water_mark_table]:
+        table.drop(test_db_engine, checkfirst=True)
+
+
+def get_populator(pandas_df: pd.DataFrame, run_report: RunReport = None) -> PandasDfChunksPopulator:
+    return PandasDfChunksPopulator(
+        table_definition=stock_table_definition, db_engine=test_db_engine, pandas_dfs=[pandas_df], run_report=run_report
+    )
+
+
+def load_incrementally(pandas_df: pd.DataFrame) -> int:
+    """
+    Returns the number of merged rows
+    """
+    run_report = RunReport(record_bytes=False)
+    get_populator(pandas_df, run_report).populate_incrementally()
+    (merge_stage,) = [stage for stage in run_report.stages if stage.name == 'stock merge']
+    return merge_stage.rows
+
+
+def get_high_water_marks() -> dict:
+    rows = test_db_engine.execute(f'SELECT group_value, high_water_mark FROM {high_water_mark_table.name}')
+    return {group_value: str(high_water_mark) for group_value, high_water_mark in rows}
+
+
+def test_rerun_of_an_incremental_load_changes_nothing(drop_tables):
+    pandas_df = get_stock_df(['AA', 'BB'], ['2010-01-04', '2010-01-05'])
+
+    assert load_incrementally(pandas_df) == 4
+    version = test_db_engine.execute(f'SELECT version FROM {dataset_version_table.name}').scalar()
+    assert load_incrementally(pandas_df) == 0
+
+    assert test_db_engine.execute(f'SELECT version FROM {dataset_version_table.name}').scalar() == version
+    pd.testing.assert_frame_equal(read_table(test_db_engine, stock_table.name), read_table_of(pandas_df))
+
+
+def test_incremental_load_updates_the_changed_rows_and_skips_the_rows_before_the_mark(drop_tables):
+    load_incrementally(get_stock_df(['AA'], ['2010-01-04', '2010-01-05']))
+
+    # The row at the mark is updated, the row before it is skipped, the new row is inserted
+    changed_df = get_stock_df(['AA'], ['2010-01-04', '2010-01-05', '2010-01-06'], price=2.5)
+    assert load_incrementally(changed_df) == 2
+
+    prices = read_table(test_db_engine, stock_table.name).set_index('date')['open_price'].to_dict()
+    assert prices == {'2010-01-04': 1.5, '2010-01-05': 2.5, '2010-01-06': 2.5}
+    assert get_high_water_marks() == {'AA': '2010-01-06'}
+
+
+def test_incremental_load_after_a_full_load_keeps_every_row(drop_tables):
+    load_incrementally(get_stock_df(['AA'], ['2010-01-04', '2011-06-01']))
+    # A full reload of older data replaces the marks of the previous incremental load
+    get_populator(get_stock_df(['AA', 'BB'], ['2011-01-03'])).populate()
+    assert get_high_water_marks() == {'AA': '2011-01-03', 'BB': '2011-01-03'}
+
+    incremental_df = get_stock_df(['AA'], ['2011-02-01', '2011-06-01'])
+    assert load_incrementally(incremental_df) == 2
+
+    expected_df = pd.concat([get_stock_df(['AA', 'BB'], ['2011-01-03']), incremental_df])
+    pd.testing.assert_frame_equal(read_table(test_db_engine, stock_table.name), read_table_of(expected_df))
+
+
+def read_table_of(pandas_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    pandas_df as read back by read_table
+    """
+    return pandas_df.sort_values(list(pandas_df.columns), ignore_index=True)
@@ -0,0 +1,124 @@
+import dataclasses
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from pipeline.core.populator import PandasDfChunksPopulator
+from pipeline.tables.dataset_version import dataset_version_table
+from pipeline.tables.high_water_mark import high_water_mark_table
+from pipeline.tables.stock import stock_table, stock_table_definition
+from pipeline.tables.table_definition import PartitionInterval, TablePartitioning
+from pipeline.tests.test_utils import get_stock_df, get_test_db_engine, read_table
+
+test_db_engine = get_test_db_engine()
+
+TICKERS = ['AA', 'BB', 'CC', 'DD', 'EE']
+DATES = ['2010-01-04', '2010-01-29', '2010-02-01', '2011-03-01']
+
+
+@pytest.fixture()
+def drop_tables():
+    yield
+
+    for table in [stock_table, dataset_version_table, high_water_mark_table]:
+        table.drop(test_db_engine, checkfirst=True)
+
+
+def get_populator(partitioning: TablePartitioning, pandas_df: pd.DataFrame) -> PandasDfChunksPopulator:
+    return PandasDfChunksPopulator(
+        table_definition=dataclasses.replace(stock_table_definition, partitioning=partitioning),
+        db_engine=test_db_engine,
+        pandas_dfs=[pandas_df],
+    )
+
+
+def get_partitions(table_name: str) -> list:
+    """
+    Returns the names of the direct partitions of table_name
+    """
+    rows = test_db_engine.execute(
+        f"SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = '{table_name}'::regclass"
+    )
+    return sorted(row[0] for row in rows)
+
+
+def get_row_partitions() -> dict:
+    """
+    Returns the name of the leaf partition holding each (name, date) row of the stock table
+    """
+    rows = test_db_engine.execute(f'SELECT name, date::text, tableoid::regclass::text FROM {stock_table.name}')
+    return {(name, day): partition for name, day, partition in rows}
+
+
+@pytest.mark.parametrize(
+    'interval, expected_partitions',
+    [
+        (PartitionInterval.MONTH, {'2010-01': 'stock_2010_01', '2010-02': 'stock_2010_02', '2011-03': 'stock_2011_03'}),
+        (PartitionInterval.YEAR, {'2010-01': 'stock_2010', '2010-02': 'stock_2010', '2011-03': 'stock_2011'}),
+    ],
+)
+@pytest.mark.parametrize('hash_partitions', [None, 3])
+def test_rows_are_routed_to_their_range_and_hash_partitions(
+    drop_tables, interval, expected_partitions, hash_partitions
+):
+    partitioning = TablePartitioning(
+        range_column='date',
+        interval=interval,
+        hash_column='name' if hash_partitions else None,
+        hash_partitions=hash_partitions,
+    )
+    pandas_df = get_stock_df(TICKERS, DATES)
+
+    get_populator(partitioning, pandas_df).populate()
+
+    range_partitions = sorted(set(expected_partitions.values()))
+    assert get_partitions(stock_table.name) == range_partitions
+    pd.testing.assert_frame_equal(
+        read_table(test_db_engine, stock_table.name),
+        pandas_df.sort_values(list(pandas_df.columns), ignore_index=True),
+    )
+
+    row_partitions = get_row_partitions()
+    for (name, day), partition in row_partitions.items():
+        range_partition = expected_partitions[day[:7]]
+        if hash_partitions:
+            assert partition in [f'{range_partition}_h{remainder}' for remainder in range(hash_partitions)]
+        else:
+            assert partition == range_partition
+    if hash_partitions:
+        for range_partition in range_partitions:
+            assert len(get_partitions(range_partition)) == hash_partitions
+        # A ticker always hashes to the same sub-partition
+        remainders = {(name, partition[-1]) for (name, _), partition in row_partitions.items()}
+        assert len(remainders) == len(TICKERS)
+
+
+def test_partitioned_table_keeps_the_primary_key_and_indexes(drop_tables):
+    partitioning = TablePartitioning(range_column='date')
+
+    get_populator(partitioning, get_stock_df(TICKERS, DATES)).populate()
+
+    index_names = {
+        row[0] for row in test_db_engine.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'stock'")
+    }
+    assert index_names == {'stock_pkey', 'idx_name_date'}
+    with pytest.raises(Exception, match='duplicate key'):
+        test_db_engine.execute("INSERT INTO stock_2010_01 SELECT * FROM stock WHERE date = '2010-01-04'")
+
+
+def test_rerun_creates_only_the_missing_partitions(drop_tables):
+    partitioning = TablePartitioning(range_column='date', hash_column='name', hash_partitions=2)
+    populator = get_populator(partitioning, get_stock_df(TICKERS, DATES[:2]))
+    populator.populate()
+    # Created again by populators that don't know the existing partitions
+    populator.create_table(checkfirst=True)
+    get_populator(partitioning, None).ensure_partitions([date(2010, 1, 1)])
+
+    # The incremental load creates the partitions of the staging rows
+    incremental_df = get_stock_df(TICKERS, DATES[1:])
+    get_populator(partitioning, incremental_df).populate_incrementally()
+
+    assert get_partitions(stock_table.name) == ['stock_2010_01', 'stock_2010_02', 'stock_2011_03']
+    assert get_partitions('stock_2011_03') == ['stock_2011_03_h0', 'stock_2011_03_h1']
+    assert len(read_table(test_db_engine, stock_table.name)) == len(TICKERS) * len(DATES)
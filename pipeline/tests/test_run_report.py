@@ -0,0 +1,62 @@
+import psycopg2
+import pytest
+
+from pipeline.core.binary_copy import CopyFormat
+from pipeline.core.populator import PandasDfChunksPopulator
+from pipeline.core.run_report import RunReport
+from pipeline.tables.dataset_version import dataset_version_table
+from pipeline.tables.high_water_mark import high_water_mark_table
+from pipeline.tables.stock import stock_table, stock_table_definition
+from pipeline.tests.test_utils import get_stock_df, get_test_db_engine
+
+test_db_engine = get_test_db_engine()
+
+
+@pytest.fixture()
+def drop_stock_table():
+    yield
+
+    stock_table.drop(test_db_engine, checkfirst=True)
+    dataset_version_table.drop(test_db_engine, checkfirst=True)
+    high_water_mark_table.drop(test_db_engine, checkfirst=True)
+
+
+@pytest.mark.parametrize('copy_format', [CopyFormat.CSV, CopyFormat.BINARY])
+def test_failed_chunk_stage_records_the_copy_error(drop_stock_table, copy_format):
+    run_report = RunReport()
+    # The second chunk has a duplicated primary key
+    pandas_dfs = [get_stock_df(['AA'], ['2010-01-04']), get_stock_df(['AA'], ['2010-01-04'])]
+    populator = PandasDfChunksPopulator(
+        table_definition=stock_table_definition,
+        db_engine=test_db_engine,
+        pandas_dfs=pandas_dfs,
+        copy_format=copy_format,
+        run_report=run_report,
+    )
+
+    with pytest.raises(psycopg2.errors.UniqueViolation):
+        populator.populate()
+
+    stages = {stage.name: stage for stage in run_report.stages}
+    errors = {name: stage.error for name, stage in stages.items()}
+    assert errors['stock upload'].startswith('UniqueViolation')
+    assert errors['copy to stock chunk 0'] is None
+    # The csv chunks are copied one by one, the binary chunks are only encoded in their stage
+    if copy_format == CopyFormat.CSV:
+        assert errors['copy to stock chunk 1'].startswith('UniqueViolation')
+    else:
+        assert errors['copy to stock chunk 1'] is None
+    assert stages['copy to stock chunk 0'].bytes > 0
+
+
+def test_chunk_stages_without_a_report_do_not_measure_the_bytes(drop_stock_table):
+    populator = PandasDfChunksPopulator(
+        table_definition=stock_table_definition,
+        db_engine=test_db_engine,
+        pandas_dfs=[get_stock_df(['AA'], ['2010-01-04']), get_stock_df(['BB'], ['2010-01-04'])],
+    )
+
+    populator.populate()
+
+    chunk_stages = [stage for stage in populator.run_report.stages if ' chunk ' in stage.name]
+    assert [(stage.rows, stage.bytes) for stage in chunk_stages] == [(1, None), (1, None)]
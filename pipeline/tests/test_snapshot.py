@@ -0,0 +1,85 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline.core.populator import PandasDfChunksPopulator
+from pipeline.core.snapshot import CURRENT_FILE, METADATA_FILE, SNAPSHOT_COLUMNS, export_stock_snapshot
+from pipeline.tables.dataset_version import dataset_version_table
+from pipeline.tables.high_water_mark import high_water_mark_table
+from pipeline.tables.stock import stock_table, stock_table_definition
+from pipeline.tests.test_utils import get_test_db_engine
+
+test_db_engine = get_test_db_engine()
+
+# Sorted differently by the linguistic collations, which ignore the punctuation, and by the code points
+TICKERS = ['BRK.B', 'BF-B', 'BRKA', 'BFA', 'aa', 'AA']
+DAYS = 4
+
+
+@pytest.fixture()
+def stock_df():
+    rows = []
+    for ticker_number, ticker in enumerate(TICKERS):
+        for day, date in enumerate(pd.bdate_range(start='2010-01-04', periods=DAYS).strftime('%Y-%m-%d')):
+            price = ticker_number * 100 + day + 0.5
+            rows.append(
+                {
+                    'name': ticker,
+                    'date': date,
+                    'open_price': price,
+                    'close_price': price + 0.25,
+                    'high_price': price + 1,
+                    'low_price': price - 1,
+                    'volume': ticker_number * 1000 + day,
+                    'market': 'NYSE',
+                }
+            )
+    stock_df = pd.DataFrame(rows)
+    PandasDfChunksPopulator(
+        table_definition=stock_table_definition, db_engine=test_db_engine, pandas_dfs=[stock_df]
+    ).populate()
+
+    yield stock_df
+
+    stock_table.drop(test_db_engine, checkfirst=True)
+    dataset_version_table.drop(test_db_engine, checkfirst=True)
+    high_water_mark_table.drop(test_db_engine, checkfirst=True)
+
+
+def read_snapshot(path: str, ticker: str) -> pd.DataFrame:
+    """
+    Reads the rows of ticker like the API: the ticker is looked up with a binary search of the sorted tickers
+    """
+    tickers, offsets = np.load(os.path.join(path, 'tickers.npy')), np.load(os.path.join(path, 'offsets.npy'))
+    index = int(np.searchsorted(tickers, ticker))
+    assert tickers[index] == ticker
+    rows = slice(int(offsets[index]), int(offsets[index + 1]))
+    return pd.DataFrame(
+        {column: np.load(os.path.join(path, f'{column}.npy'), mmap_mode='r')[rows] for column in SNAPSHOT_COLUMNS}
+    )
+
+
+# A chunk size splitting the tickers across the chunks
+@pytest.mark.parametrize('chunk_size', [3, 1000])
+def test_exported_snapshot_reads_back_every_ticker(stock_df, tmp_path, chunk_size):
+    snapshot_dir = str(tmp_path)
+
+    version_dir_name = export_stock_snapshot(test_db_engine, snapshot_dir=snapshot_dir, chunk_size=chunk_size)
+
+    with open(os.path.join(snapshot_dir, CURRENT_FILE)) as f:
+        assert f.read() == version_dir_name
+    path = os.path.join(snapshot_dir, version_dir_name)
+    with open(os.path.join(path, METADATA_FILE)) as f:
+        assert json.load(f) == {'table': 'stock', 'dataset_version': 1, 'rows': len(stock_df), 'tickers': len(TICKERS)}
+    assert np.load(os.path.join(path, 'tickers.npy')).tolist() == sorted(TICKERS)
+
+    for ticker in TICKERS:
+        expected = stock_df[stock_df['name'] == ticker].reset_index(drop=True)
+        snapshot_df = read_snapshot(path, ticker)
+        assert snapshot_df['date'].tolist() == pd.to_datetime(expected['date']).tolist()
+        for column in SNAPSHOT_COLUMNS:
+            if column != 'date':
+                assert snapshot_df[column].tolist() == expected[column].tolist()
@@ -0,0 +1,47 @@
+from typing import List
+
+import pandas as pd
+from sqlalchemy.engine import Engine
+
+from pipeline.core.db_utils import create_database_if_not_exists, get_db_engine
+from pipeline.tables.stock import stock_table
+
+TEST_DB = 'pipeline_test'
+
+
+def get_test_db_engine() -> Engine:
+    create_database_if_not_exists(TEST_DB)
+    return get_db_engine(TEST_DB)
+
+
+def get_stock_df(tickers: List[str], dates: List[str], price: float = 1.5) -> pd.DataFrame:
+    """
+    Rows of the stock csv files, one per ticker and date, in the stock table columns order
+    """
+    return pd.DataFrame(
+        [
+            {
+                'name': ticker,
+                'date': date,
+                'open_price': price,
+                'close_price': price,
+                'high_price': price + 1,
+                'low_price': price - 1,
+                'volume': 100,
+                'market': 'NYSE',
+            }
+            for ticker in tickers
+            for date in dates
+        ],
+        columns=[column.name for column in stock_table.columns],
+    )
+
+
+def read_table(db_engine: Engine, table_name: str) -> pd.DataFrame:
+    """
+    Rows of table_name sorted by all of its columns, the dates as ISO strings
+    """
+    df = pd.read_sql(f'SELECT * FROM {table_name}', db_engine)
+    if 'date' in df:
+        df['date'] = df['date'].astype(str)
+    return df.sort_values(list(df.columns), ignore_index=True)